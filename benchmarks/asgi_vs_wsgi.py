@@ -0,0 +1,140 @@
+"""
+Compare the sync views under WSGI with the async views under ASGI.
+
+Drives the patient dashboard and the available-slots page through Django's
+WSGI handler (one thread per concurrent connection, sync views) and its
+ASGI handler (one event loop, ASYNC_VIEWS on), --concurrency connections at
+a time. Reports requests per second and latency percentiles per endpoint,
+and the Python memory held per concurrent connection (traced peak during a
+burst of --concurrency requests, divided by --concurrency).
+
+This measures the Django stack in-process, without a network server; use a
+real server and load generator (see README) for capacity planning.
+
+    python -m benchmarks.asgi_vs_wsgi --concurrency 64 --requests 2000
+"""
+import argparse
+import asyncio
+import importlib
+import threading
+import time as clock
+import tracemalloc
+
+from benchmarks.common import setup_django, test_database, percentile
+from benchmarks.slot_listing import seed
+
+
+def use_async_views(enabled):
+    from django.conf import settings
+    from django.urls import clear_url_caches
+    settings.ASYNC_VIEWS = enabled
+    importlib.reload(importlib.import_module('core.urls'))
+    importlib.reload(importlib.import_module(settings.ROOT_URLCONF))
+    clear_url_caches()
+
+
+def run_wsgi(patient, urls, concurrency, requests):
+    from django.db import connection
+    from django.test import Client
+
+    clients = []
+    for _ in range(concurrency):
+        client = Client()
+        client.force_login(patient)
+        clients.append(client)
+    latencies = []
+    lock = threading.Lock()
+    per_worker = requests // concurrency
+
+    def worker(n, client):
+        local = []
+        try:
+            for i in range(per_worker):
+                started = clock.perf_counter()
+                response = client.get(urls[(n + i) % len(urls)])
+                local.append(clock.perf_counter() - started)
+                assert response.status_code == 200, response.status_code
+        finally:
+            connection.close()
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(n, c)) for n, c in enumerate(clients)]
+    started = clock.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return clock.perf_counter() - started, latencies
+
+
+def run_asgi(patient, urls, concurrency, requests):
+    from django.test import AsyncClient
+
+    async def main():
+        clients = []
+        for _ in range(concurrency):
+            client = AsyncClient()
+            await client.aforce_login(patient)
+            clients.append(client)
+        latencies = []
+        per_worker = requests // concurrency
+
+        async def worker(n, client):
+            for i in range(per_worker):
+                started = clock.perf_counter()
+                response = await client.get(urls[(n + i) % len(urls)])
+                latencies.append(clock.perf_counter() - started)
+                assert response.status_code == 200, response.status_code
+
+        started = clock.perf_counter()
+        await asyncio.gather(*(worker(n, c) for n, c in enumerate(clients)))
+        return clock.perf_counter() - started, latencies
+
+    return asyncio.run(main())
+
+
+def memory_per_connection(run, patient, urls, concurrency):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    run(patient, urls, concurrency, concurrency)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return (peak - baseline) / concurrency
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=1000, help='Requests per endpoint and mode')
+    parser.add_argument('--doctors', type=int, default=20)
+    parser.add_argument('--slots', type=int, default=40)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.core.cache import cache
+    from django.urls import reverse
+
+    with test_database():
+        patient, doctors = seed(args.doctors, args.slots)
+        endpoints = {
+            'dashboard': [reverse('dashboard')],
+            'slot listing': [reverse('view_available_slots', args=[d.id]) for d in doctors],
+        }
+        print(f"concurrency={args.concurrency} requests={args.requests} doctors={args.doctors} slots={args.slots}")
+        for mode, run, async_views in (('WSGI', run_wsgi, False), ('ASGI', run_asgi, True)):
+            use_async_views(async_views)
+            for name, urls in endpoints.items():
+                cache.clear()
+                elapsed, latencies = run(patient, urls, args.concurrency, args.requests)
+                ms = [value * 1000 for value in latencies]
+                memory = memory_per_connection(run, patient, urls, args.concurrency)
+                print(f"{mode} {name:<13} req/s={len(ms) / elapsed:8.1f} "
+                      f"p50={percentile(ms, 50):7.2f}ms p95={percentile(ms, 95):7.2f}ms "
+                      f"p99={percentile(ms, 99):7.2f}ms mem/conn={memory / 1024:7.1f}KiB")
+        use_async_views(False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Memory and throughput of the streaming booking export.
+
+Seeds --bookings bookings across a year, then streams /api/v1/bookings/export/
+as NDJSON and CSV for a staff user, consuming the body chunk by chunk the way
+a WSGI server does. Reports rows per second and the traced Python memory
+peak. Run it with two very different --bookings values: the peak should stay
+about the same, since rows are fetched EXPORT_CHUNK_SIZE at a time.
+
+    python -m benchmarks.booking_export --bookings 200000
+"""
+import argparse
+import time as clock
+import tracemalloc
+from datetime import date, time, timedelta
+
+from benchmarks.common import setup_django, test_database
+
+BATCH = 5000
+
+
+def seed(booking_count):
+    from core.models import User, AvailabilitySlot, Booking
+
+    admin = User.objects.create(username='bench-admin', role='doctor', is_staff=True)
+    doctor = User.objects.create(username='bench-doctor', role='doctor', first_name='Doc', last_name='Bench')
+    patient = User.objects.create(username='bench-patient', role='patient', first_name='Pat', last_name='Bench')
+    start = date.today() - timedelta(days=365)
+    for offset in range(0, booking_count, BATCH):
+        slots = AvailabilitySlot.objects.bulk_create([
+            AvailabilitySlot(
+                doctor=doctor, is_booked=True,
+                date=start + timedelta(days=n // 1440),
+                start_time=time((n % 1440) // 60, n % 60),
+                end_time=time((n % 1440) // 60, n % 60, 59),
+            )
+            for n in range(offset, min(offset + BATCH, booking_count))
+        ])
+        Booking.objects.bulk_create([Booking(patient=patient, availability_slot=slot) for slot in slots])
+    return admin
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--bookings', type=int, default=50000)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.test import Client
+    from django.urls import reverse
+
+    with test_database():
+        admin = seed(args.bookings)
+        client = Client()
+        client.force_login(admin)
+        print(f"bookings={args.bookings}")
+        for fmt in ('ndjson', 'csv'):
+            tracemalloc.start()
+            started = clock.perf_counter()
+            response = client.get(reverse('api_bookings_export'), {'format': fmt})
+            size = 0
+            for chunk in response.streaming_content:
+                size += len(chunk)
+            elapsed = clock.perf_counter() - started
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"{fmt:<7} rows/s={args.bookings / elapsed:10.0f} body={size / 2**20:8.1f}MiB "
+                  f"peak={peak / 2**20:6.1f}MiB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Concurrency benchmark for the booking engine.
+
+--threads patients race to book --slots open slots of one doctor. Every
+thread keeps picking random slots that it has not seen taken until none are
+left. Reports attempts and bookings per second, per-attempt latency
+percentiles, and checks that no slot was booked twice.
+
+Use a PostgreSQL database for meaningful numbers; SQLite serialises writers.
+
+    python -m benchmarks.booking_race --threads 32 --slots 200
+"""
+import argparse
+import random
+import threading
+import time as clock
+from datetime import date, datetime, time, timedelta
+
+from benchmarks.common import setup_django, test_database, percentile
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--slots', type=int, default=200)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.db import connection, OperationalError
+    from django.db.models import Count
+    from core.booking import book_slot, BookingError
+    from core.models import User, AvailabilitySlot, Booking
+
+    with test_database():
+        doctor = User.objects.create(username='race-doctor', role='doctor')
+        patients = [User.objects.create(username=f'race-patient-{i}', role='patient')
+                    for i in range(args.threads)]
+        start_day = date.today() + timedelta(days=1)
+        AvailabilitySlot.objects.bulk_create([
+            AvailabilitySlot(
+                doctor=doctor,
+                date=start_day + timedelta(days=i // 32),
+                start_time=(datetime.combine(start_day, time(9)) + timedelta(minutes=15 * (i % 32))).time(),
+                end_time=(datetime.combine(start_day, time(9)) + timedelta(minutes=15 * (i % 32 + 1))).time(),
+            )
+            for i in range(args.slots)
+        ])
+        slot_ids = list(AvailabilitySlot.objects.values_list('id', flat=True))
+
+        latencies = []
+        outcomes = {'booked': 0, 'taken': 0, 'errors': 0}
+        lock = threading.Lock()
+        barrier = threading.Barrier(args.threads)
+
+        def patient_worker(patient):
+            remaining = slot_ids[:]
+            random.shuffle(remaining)
+            local_latencies = []
+            local = {'booked': 0, 'taken': 0, 'errors': 0}
+            barrier.wait()
+            try:
+                for slot_id in remaining:
+                    started = clock.perf_counter()
+                    try:
+                        book_slot(patient, slot_id)
+                        local['booked'] += 1
+                    except BookingError:
+                        local['taken'] += 1
+                    except OperationalError:
+                        local['errors'] += 1
+                    local_latencies.append(clock.perf_counter() - started)
+            finally:
+                connection.close()
+            with lock:
+                latencies.extend(local_latencies)
+                for key, value in local.items():
+                    outcomes[key] += value
+
+        threads = [threading.Thread(target=patient_worker, args=(p,)) for p in patients]
+        started = clock.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = clock.perf_counter() - started
+
+        ms = [value * 1000 for value in latencies]
+        doubles = Booking.objects.values('availability_slot').annotate(n=Count('id')).filter(n__gt=1).count()
+        booked_slots = AvailabilitySlot.objects.filter(is_booked=True).count()
+        bookings = Booking.objects.count()
+
+        print(f"threads={args.threads} slots={args.slots} elapsed={elapsed:.2f}s")
+        print(f"attempts/s={len(ms) / elapsed:.1f} bookings/s={outcomes['booked'] / elapsed:.1f}")
+        print(f"booked={outcomes['booked']} taken={outcomes['taken']} errors={outcomes['errors']}")
+        print(f"latency p50={percentile(ms, 50):.2f}ms p95={percentile(ms, 95):.2f}ms "
+              f"p99={percentile(ms, 99):.2f}ms max={max(ms):.2f}ms")
+        print(f"bookings={bookings} booked_slots={booked_slots} double_bookings={doubles}")
+        if doubles or bookings != booked_slots:
+            raise SystemExit('Consistency check FAILED')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Google Calendar sync throughput, batched vs one call per request.
+
+Books --bookings appointments across --doctors doctors and --patients
+patients (everyone has a connected calendar), then drains the sync queue against the
+stub Calendar API with --latency seconds per HTTP round trip. Runs once
+with Calendar API batch requests and once with one event per request, and
+reports events synced per second, HTTP requests and token refreshes.
+
+    python -m benchmarks.calendar_sync --doctors 20 --patients 200 --bookings 2000 --latency 0.05
+"""
+import argparse
+import time as clock
+from datetime import time, timedelta
+
+from benchmarks.common import setup_django, test_database
+from benchmarks.stub_calendar import StubCalendarServer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--doctors', type=int, default=20)
+    parser.add_argument('--patients', type=int, default=200)
+    parser.add_argument('--bookings', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='Seconds the stub waits before answering each request')
+    parser.add_argument('--batch-size', type=int, default=200, help='Tasks claimed per worker iteration')
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+    from django.core.cache import cache
+    from django.utils import timezone
+    from core import calendar_sync
+    from core.models import User, AvailabilitySlot, Booking, CalendarSyncTask
+    from core.scheduling import generate_availability
+
+    settings.CALENDAR_SYNC_RATE_PER_USER = 10 ** 9
+
+    with StubCalendarServer(latency=args.latency) as stub, test_database():
+        settings.GOOGLE_CALENDAR_API_URL = stub.url
+
+        def credentials(name):
+            return {'refresh_token': name, 'token_uri': f'{stub.url}/token'}
+
+        doctors = User.objects.bulk_create([
+            User(username=f'doc{n}', role='doctor', google_calendar_credentials=credentials(f'doc{n}'))
+            for n in range(args.doctors)
+        ])
+        per_doctor = -(-args.bookings // args.doctors)
+        start = timezone.now().date() + timedelta(days=1)
+        days = -(-per_doctor // 32)
+        generate_availability([d.id for d in doctors], start, start + timedelta(days=days - 1),
+                              range(7), time(8), time(16), 15)
+        slots = []
+        for doctor in doctors:
+            slots.extend(AvailabilitySlot.objects.filter(doctor=doctor).order_by('id')[:per_doctor])
+        slots = slots[:args.bookings]
+        patients = User.objects.bulk_create([
+            User(username=f'pat{n}', role='patient', google_calendar_credentials=credentials(f'pat{n}'))
+            for n in range(args.patients)
+        ])
+        patients = [patients[n % len(patients)] for n in range(len(slots))]
+        AvailabilitySlot.objects.filter(id__in=[s.id for s in slots]).update(is_booked=True)
+        bookings = Booking.objects.bulk_create([
+            Booking(patient=patient, availability_slot=slot) for patient, slot in zip(patients, slots)
+        ])
+        doctors_by_id = {d.id: d for d in doctors}
+        entries = [
+            (user, booking.id) for booking, patient, slot in zip(bookings, patients, slots)
+            for user in (patient, doctors_by_id[slot.doctor_id])
+        ]
+
+        people = doctors + patients[:args.patients]
+        for label, batch_limit in (('batched', calendar_sync.CALENDAR_BATCH_LIMIT), ('one per request', 1)):
+            cache.clear()
+            # Forget the access tokens saved by the previous run
+            User.objects.bulk_update(people, ['google_calendar_credentials'])
+            CalendarSyncTask.objects.all().delete()
+            Booking.objects.update(doctor_calendar_event_id='', patient_calendar_event_id='')
+            stub.calendars.clear()
+            stub.stats.update(dict.fromkeys(stub.stats, 0))
+            calendar_sync.queue_calendar_upserts(entries)
+            calendar_sync.CALENDAR_BATCH_LIMIT = batch_limit
+
+            started = clock.perf_counter()
+            synced = 0
+            while True:
+                done, deferred, retried, failed = calendar_sync.sync_calendar_batch(args.batch_size)
+                assert not (retried or failed), (retried, failed)
+                synced += done
+                if not (done or deferred):
+                    break
+            elapsed = clock.perf_counter() - started
+            print(f"{label:<16} events={synced:<6} events/s={synced / elapsed:8.1f} "
+                  f"http_requests={stub.stats['batches']:<6} token_refreshes={stub.stats['token_refreshes']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Shared helpers for the benchmark scripts.
+
+Benchmarks run against a throwaway test database created from the configured
+DATABASES setting (like `manage.py test`), so they never touch real data.
+Run them from the repository root, e.g. `python -m benchmarks.dashboard`.
+"""
+import os
+import statistics
+import time
+from contextlib import contextmanager
+
+
+def setup_django():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'hospital_system.settings')
+    import django
+    django.setup()
+
+
+@contextmanager
+def test_database():
+    """Create a fresh test database for the duration of the block"""
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    k = (len(ordered) - 1) * pct / 100
+    low = int(k)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (k - low)
+
+
+def timed(fn, iterations):
+    """Call fn `iterations` times and return the per-call durations in seconds"""
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def report(label, samples, extra=''):
+    ms = [s * 1000 for s in samples]
+    print(f"{label:<32} n={len(ms):<6} mean={statistics.fmean(ms):8.2f}ms "
+          f"p50={percentile(ms, 50):8.2f}ms p95={percentile(ms, 95):8.2f}ms "
+          f"p99={percentile(ms, 99):8.2f}ms {extra}".rstrip())
@@ -0,0 +1,93 @@
+"""
+Doctor dashboard render time with a large slot history.
+
+Seeds one doctor with --slots availability slots spread over past and future
+dates, then measures full request/render time of the dashboard's first page,
+a deep keyset page and (optionally) the whole history rendered at once.
+
+    python -m benchmarks.dashboard --slots 100000 --iterations 50
+"""
+import argparse
+from datetime import date, datetime, time, timedelta
+
+from benchmarks.common import setup_django, test_database, timed, report
+
+
+def seed(doctor, count):
+    from core.models import AvailabilitySlot
+
+    per_day = 32  # 09:00-17:00 in 15-minute slots
+    first_day = date.today() - timedelta(days=count // per_day // 2)
+    batch = []
+    for i in range(count):
+        day = first_day + timedelta(days=i // per_day)
+        start = datetime.combine(day, time(9)) + timedelta(minutes=15 * (i % per_day))
+        batch.append(AvailabilitySlot(
+            doctor=doctor, date=day, start_time=start.time(),
+            end_time=(start + timedelta(minutes=15)).time(), is_booked=i % 3 == 0,
+        ))
+        if len(batch) == 5000:
+            AvailabilitySlot.objects.bulk_create(batch)
+            batch = []
+    AvailabilitySlot.objects.bulk_create(batch)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--slots', type=int, default=100000)
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--pages', type=int, default=20,
+                        help='How many Next links to follow for the deep page')
+    parser.add_argument('--full-history', action='store_true',
+                        help='Also render every slot at once (the old behaviour)')
+    args = parser.parse_args()
+
+    setup_django()
+    from django.test import Client
+    from django.urls import reverse
+    from core.models import User, AvailabilitySlot
+
+    with test_database():
+        doctor = User.objects.create(username='bench-doctor', role='doctor',
+                                     first_name='Bench', last_name='Doctor')
+        seed(doctor, args.slots)
+        client = Client()
+        client.force_login(doctor)
+        url = reverse('dashboard')
+
+        def first_page():
+            assert client.get(url).status_code == 200
+
+        report('dashboard first page', timed(first_page, args.iterations),
+               f'({args.slots} slots)')
+
+        # Walk forward to find a deep cursor, then time that page
+        from core.pagination import keyset_paginate
+        from core.views import DOCTOR_DASHBOARD_PAGE_SIZE
+        slots = AvailabilitySlot.objects.filter(doctor=doctor)
+        page = keyset_paginate(slots, ('date', 'start_time', 'id'), DOCTOR_DASHBOARD_PAGE_SIZE)
+        for _ in range(args.pages):
+            page = keyset_paginate(slots, ('date', 'start_time', 'id'),
+                                   DOCTOR_DASHBOARD_PAGE_SIZE, after=page.next_cursor)
+        deep_url = f'{url}?from_date=&after={page.next_cursor}'
+
+        def deep_page():
+            assert client.get(deep_url).status_code == 200
+
+        report(f'dashboard page {args.pages + 1} (all dates)', timed(deep_page, args.iterations))
+
+        if args.full_history:
+            from django.template.loader import render_to_string
+
+            def full_history():
+                render_to_string('core/doctor_dashboard.html', {
+                    'slots': AvailabilitySlot.objects.filter(doctor=doctor),
+                    'bookings': [],
+                    'user': doctor,
+                })
+
+            report('full history render (old view)', timed(full_history, max(1, args.iterations // 10)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Latency of the earliest-available-slot search by specialization.
+
+Seeds --doctors doctors spread over --specializations specializations (plus
+one "Rare" specialization with a single doctor whose schedule starts halfway
+through), each with --days days of --slots-per-day slots, and books --booked
+of them at random. Then times find_earliest_slots for a common specialization, the
+rare one and one nobody has, and prints the query plan of the first. The
+target is well under 50 ms at 10k doctors and 10M slots (use PostgreSQL;
+seeding that many rows takes a while).
+
+    python -m benchmarks.earliest_slots --doctors 10000 --days 63 --slots-per-day 16
+"""
+import argparse
+import random
+from datetime import date, datetime, time, timedelta
+
+from benchmarks.common import report, setup_django, test_database, timed
+
+
+def seed(args):
+    from django.db import connection
+    from core.availability import refresh_open_slot_counts
+    from core.models import User, DoctorProfile, AvailabilitySlot
+
+    doctors = User.objects.bulk_create(
+        [User(username=f'bench-doctor-{n}', role='doctor', last_name=str(n)) for n in range(args.doctors)],
+        batch_size=5000
+    )
+    names = [f'Specialty {n}' for n in range(args.specializations)]
+    DoctorProfile.objects.bulk_create([
+        DoctorProfile(user=doctor, specialization='Rare' if n == 0 else names[n % len(names)])
+        for n, doctor in enumerate(doctors)
+    ], batch_size=5000)
+
+    start = date.today() + timedelta(days=1)
+    times = [
+        ((datetime.combine(start, time(8)) + timedelta(minutes=30 * n)).time(),
+         (datetime.combine(start, time(8)) + timedelta(minutes=30 * (n + 1))).time())
+        for n in range(args.slots_per_day)
+    ]
+    rng = random.Random(1)
+    for n, doctor in enumerate(doctors):
+        # The rare specialist's first open day is weeks out
+        first_day = args.days // 2 if n == 0 else 0
+        AvailabilitySlot.objects.bulk_create([
+            AvailabilitySlot(
+                doctor_id=doctor.id, date=start + timedelta(days=day), start_time=start_time,
+                end_time=end_time, is_booked=rng.random() < args.booked,
+            )
+            for day in range(first_day, args.days)
+            for start_time, end_time in times
+        ], batch_size=5000)
+    refresh_open_slot_counts()
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+    return names
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--doctors', type=int, default=2000)
+    parser.add_argument('--specializations', type=int, default=20)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--slots-per-day', type=int, default=16)
+    parser.add_argument('--booked', type=float, default=0.8, help='Fraction of slots already booked')
+    parser.add_argument('--limit', type=int, default=10)
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    setup_django()
+    from core.availability import _earliest_slots_query, find_earliest_slots
+
+    with test_database():
+        names = seed(args)
+        slots = args.doctors * args.days * args.slots_per_day
+        print(f"doctors={args.doctors} slots={slots} booked={args.booked:.0%} limit={args.limit}")
+        for label, specialization in (('common', names[1]), ('rare', 'Rare'), ('unknown', 'Nobody')):
+            found = find_earliest_slots([specialization], limit=args.limit)
+            report(f'{label} ({len(found)} found)', timed(
+                lambda: find_earliest_slots([specialization], limit=args.limit), args.iterations
+            ))
+
+        from django.utils import timezone
+        from core.models import DoctorProfile
+        now = timezone.localtime()
+        doctors = DoctorProfile.objects.filter(specialization__in=[names[1]]).values('user_id')
+        print(_earliest_slots_query(doctors, now.date(), now.time(), now, None, args.limit, True).explain())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+"""
+End-to-end load test: signup, login, dashboards, slot listing and booking.
+
+Seeds a throwaway database with core.seeding (the data behind
+`manage.py seed_load`), then runs each scenario for --duration seconds with
+--threads concurrent clients going through the real URL routes, middleware
+and views (Django's test client, so no network hop and no CSRF checks).
+Emails go to an in-process stub of the serverless function: bookings and
+signups queue them, and the outbox is drained into the stub at the end.
+
+Reports requests, errors, throughput and latency percentiles per scenario
+and checks that no slot was double-booked. --output saves the results as
+JSON; --baseline compares against a saved run and exits non-zero when a
+scenario's throughput drops or its p95 grows by more than --tolerance.
+Logins and signups pay the real password-hash cost (PASSWORD_HASH_ITERATIONS).
+Use PostgreSQL for meaningful concurrency numbers; SQLite serialises writers.
+
+    python -m benchmarks.load_test --threads 16 --duration 10 --output load.json
+    python -m benchmarks.load_test --threads 16 --duration 10 --baseline load.json
+"""
+import argparse
+import json
+import os
+import random
+import threading
+import time as clock
+from collections import Counter
+
+from benchmarks.common import percentile, setup_django, test_database
+from benchmarks.stub_email import StubEmailServer
+
+SCENARIOS = ('signup', 'login', 'patient_dashboard', 'doctor_dashboard', 'slot_listing', 'booking')
+PASSWORD = 'load-test-password'
+
+
+class LoadContext:
+    """What the scenarios need to know about the seeded data"""
+
+    def __init__(self, args):
+        from django.utils import timezone
+        from core.models import User, AvailabilitySlot
+
+        self.args = args
+        self.patients = list(User.objects.filter(username__startswith='load-patient-').order_by('id'))
+        self.doctors = list(User.objects.filter(username__startswith='load-doctor-').order_by('id'))
+        hot = [doctor.id for doctor in self.doctors[:args.hot_doctors]]
+        # Every booking client competes for the open slots of a few doctors
+        self.hot_slot_ids = list(AvailabilitySlot.objects.filter(
+            doctor_id__in=hot, is_booked=False, date__gt=timezone.localdate()
+        ).values_list('id', flat=True))
+        self.run_id = random.randrange(10 ** 6)
+
+    def popular_doctor(self, rng):
+        # Skewed towards the first doctors, as real traffic is
+        return self.doctors[int(len(self.doctors) * rng.random() ** 3)]
+
+
+def signup(client, ctx, worker, n, rng):
+    from django.urls import reverse
+    name = f'signup-{ctx.run_id}-{worker}-{n}'
+    response = client.post(reverse('patient_signup'), {
+        'username': name, 'email': f'{name}@example.com', 'first_name': 'Load', 'last_name': 'Test',
+        'password1': PASSWORD, 'password2': PASSWORD,
+    })
+    client.cookies.clear()
+    return response.status_code == 302
+
+
+def login(client, ctx, worker, n, rng):
+    from django.urls import reverse
+    patient = rng.choice(ctx.patients)
+    response = client.post(reverse('login'), {'username': patient.username, 'password': PASSWORD})
+    client.cookies.clear()
+    return response.status_code == 302
+
+
+def patient_dashboard(client, ctx, worker, n, rng):
+    from django.urls import reverse
+    return client.get(reverse('dashboard')).status_code == 200
+
+
+def doctor_dashboard(client, ctx, worker, n, rng):
+    from django.urls import reverse
+    return client.get(reverse('dashboard')).status_code == 200
+
+
+def slot_listing(client, ctx, worker, n, rng):
+    from django.urls import reverse
+    return client.get(reverse('view_available_slots', args=[ctx.popular_doctor(rng).id])).status_code == 200
+
+
+def booking(client, ctx, worker, n, rng):
+    from django.urls import reverse
+    # The view redirects whether or not the slot was still free; losing the race is not an error
+    return client.post(reverse('book_appointment', args=[rng.choice(ctx.hot_slot_ids)])).status_code == 302
+
+
+def login_as(name, client, ctx, worker):
+    """Log each client in as the user its scenario acts as, if any"""
+    if name == 'doctor_dashboard':
+        client.force_login(ctx.doctors[worker % len(ctx.doctors)])
+    elif name in ('patient_dashboard', 'slot_listing', 'booking'):
+        client.force_login(ctx.patients[worker % len(ctx.patients)])
+
+
+def run_scenario(name, ctx):
+    from django.db import connection
+    from django.test import Client
+
+    step = globals()[name]
+    args = ctx.args
+    latencies = []
+    outcomes = Counter()
+    lock = threading.Lock()
+    barrier = threading.Barrier(args.threads + 1)
+    state = {}
+
+    def worker(number):
+        rng = random.Random(number)
+        client = Client()
+        local_latencies = []
+        local = Counter()
+        try:
+            login_as(name, client, ctx, number)
+            barrier.wait()
+            n = 0
+            while clock.perf_counter() < state['deadline']:
+                started = clock.perf_counter()
+                try:
+                    local['ok' if step(client, ctx, number, n, rng) else 'failed'] += 1
+                except Exception as e:
+                    local[type(e).__name__] += 1
+                local_latencies.append(clock.perf_counter() - started)
+                n += 1
+        finally:
+            connection.close()
+        with lock:
+            latencies.extend(local_latencies)
+            outcomes.update(local)
+
+    threads = [threading.Thread(target=worker, args=(number,)) for number in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    state['deadline'] = clock.perf_counter() + args.duration
+    started = clock.perf_counter()
+    barrier.wait()
+    for thread in threads:
+        thread.join()
+    elapsed = clock.perf_counter() - started
+
+    ms = [value * 1000 for value in latencies]
+    errors = {key: value for key, value in outcomes.items() if key != 'ok'}
+    return {
+        'requests': len(ms),
+        'errors': sum(errors.values()),
+        'error_kinds': errors,
+        'throughput': len(ms) / elapsed,
+        'p50': percentile(ms, 50),
+        'p95': percentile(ms, 95),
+        'p99': percentile(ms, 99),
+    }
+
+
+def regressions(results, baseline, tolerance):
+    found = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        if result['throughput'] < before['throughput'] * (1 - tolerance):
+            found.append(f"{name}: throughput {before['throughput']:.1f} -> {result['throughput']:.1f} req/s")
+        if result['p95'] > before['p95'] * (1 + tolerance):
+            found.append(f"{name}: p95 {before['p95']:.2f} -> {result['p95']:.2f} ms")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--doctors', type=int, default=200)
+    parser.add_argument('--patients', type=int, default=2000)
+    parser.add_argument('--days', type=int, default=14, help='Days of future slots per doctor')
+    parser.add_argument('--past-days', type=int, default=14, help='Days of past, mostly booked, slots')
+    parser.add_argument('--threads', type=int, default=8, help='Concurrent clients per scenario')
+    parser.add_argument('--duration', type=float, default=5.0, help='Seconds per scenario')
+    parser.add_argument('--hot-doctors', type=int, default=5, help='Doctors whose slots the booking clients race for')
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS, dest='scenarios',
+                        help='Scenario to run (repeatable); defaults to all')
+    parser.add_argument('--email-latency', type=float, default=0.0, help='Seconds the email stub takes per call')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed relative drop in throughput or rise in p95 against the baseline')
+    args = parser.parse_args()
+
+    with StubEmailServer(latency=args.email_latency) as email_stub:
+        # Read by core.email_service at import, so set before Django loads
+        os.environ['SERVERLESS_EMAIL_URL'] = email_stub.url
+        setup_django()
+        from django.db.models import Count
+        from core.email_service import process_outbox
+        from core.models import AvailabilitySlot, Booking
+        from core.seeding import seed_load
+
+        with test_database():
+            started = clock.perf_counter()
+            seeded = seed_load(doctors=args.doctors, patients=args.patients, days=args.days,
+                               past_days=args.past_days, password=PASSWORD)
+            print(f"seeded {seeded.doctors} doctors, {seeded.patients} patients, {seeded.slots} slots, "
+                  f"{seeded.bookings} bookings in {clock.perf_counter() - started:.1f}s")
+            ctx = LoadContext(args)
+
+            results = {}
+            for name in args.scenarios or SCENARIOS:
+                result = results[name] = run_scenario(name, ctx)
+                kinds = ' '.join(f'{kind}={count}' for kind, count in sorted(result['error_kinds'].items()))
+                print(f"{name:<18} requests={result['requests']:<6} errors={result['errors']:<4} "
+                      f"{result['throughput']:8.1f} req/s  p50={result['p50']:8.2f}ms "
+                      f"p95={result['p95']:8.2f}ms p99={result['p99']:8.2f}ms {kinds}".rstrip())
+
+            sent = 0
+            while True:
+                delivered, retried, failed = process_outbox(batch_size=200)
+                sent += delivered
+                if not (delivered or retried or failed):
+                    break
+            print(f"emails delivered to the stub: {sent} in {email_stub.stats['requests']} calls")
+
+            doubles = Booking.objects.values('availability_slot').annotate(n=Count('id')).filter(n__gt=1).count()
+            mismatch = AvailabilitySlot.objects.filter(is_booked=True).count() != Booking.objects.count()
+            if doubles or mismatch:
+                raise SystemExit(f'Consistency check FAILED: double_bookings={doubles} booked_mismatch={mismatch}')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for line in found:
+            print(f"REGRESSION {line}")
+        if found:
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Login throughput per CPU core at different password-hashing costs.
+
+For each --iterations value, sets PASSWORD_HASH_ITERATIONS, gives a user a
+password at that cost and posts --logins successful logins through the login
+view in one process (so one core). Reports logins per second, the part of
+each login spent hashing, and how fast throttled attempts are refused.
+Divide the expected peak logins per second by logins/s/core to size the
+fleet.
+
+    python -m benchmarks.login_throughput --iterations 1000000,600000,300000 --logins 50
+"""
+import argparse
+import time as clock
+
+from benchmarks.common import setup_django, test_database
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--iterations', default='1000000,600000,300000',
+                        help='Comma separated PBKDF2 iteration counts')
+    parser.add_argument('--logins', type=int, default=50)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+    from django.contrib.auth.hashers import check_password, make_password
+    from django.core.cache import cache
+    from django.test import Client
+    from django.urls import reverse
+    from core.models import User
+
+    # Every request comes from one address in the test client; lift the limits
+    # so only the throttling measurement below is throttled
+    settings.LOGIN_MAX_FAILURES_PER_IP = settings.LOGIN_MAX_FAILURES_PER_USER = 10 ** 9
+
+    with test_database():
+        user = User.objects.create(username='bench-user', role='patient')
+        client = Client()
+        url = reverse('login')
+        for iterations in [int(value) for value in args.iterations.split(',')]:
+            settings.PASSWORD_HASH_ITERATIONS = iterations
+            user.password = make_password('bench-password')
+            user.save(update_fields=['password'])
+
+            started = clock.perf_counter()
+            for _ in range(args.logins):
+                check_password('bench-password', user.password)
+            hash_seconds = (clock.perf_counter() - started) / args.logins
+
+            started = clock.perf_counter()
+            for _ in range(args.logins):
+                response = client.post(url, {'username': 'bench-user', 'password': 'bench-password'})
+                assert response.status_code == 302, response.status_code
+                client.logout()
+            login_seconds = (clock.perf_counter() - started) / args.logins
+            print(f"iterations={iterations:<9} logins/s/core={1 / login_seconds:8.1f} "
+                  f"ms/login={login_seconds * 1000:7.1f} hashing={hash_seconds / login_seconds:6.1%}")
+
+        settings.LOGIN_MAX_FAILURES_PER_USER = 0
+        cache.clear()
+        started = clock.perf_counter()
+        for _ in range(args.logins * 10):
+            response = client.post(url, {'username': 'bench-user', 'password': 'guess'})
+            assert response.status_code == 429, response.status_code
+        refused_seconds = (clock.perf_counter() - started) / (args.logins * 10)
+        print(f"throttled attempts refused/s/core={1 / refused_seconds:8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Cost of the request metrics: MetricsMiddleware plus the query timer.
+
+Serves a mix of pages (home, patient dashboard, a doctor's slots, the
+earliest-slot search, the doctor API) through the full middleware stack,
+alternating --rounds rounds with the metrics off and on, and reports the
+median time per request of each and the overhead. The budget is 2%.
+
+    python -m benchmarks.metrics_overhead --rounds 20 --requests 500
+"""
+import argparse
+import statistics
+import time as clock
+from datetime import date, time, timedelta
+
+from benchmarks.common import setup_django, test_database
+
+BUDGET = 0.02
+
+
+def seed(doctor_count):
+    from core.models import User, DoctorProfile
+    from core.scheduling import generate_availability
+
+    patient = User.objects.create(username='bench-patient', role='patient')
+    doctors = User.objects.bulk_create([
+        User(username=f'bench-doctor-{n}', role='doctor', first_name='Doc', last_name=str(n))
+        for n in range(doctor_count)
+    ])
+    DoctorProfile.objects.bulk_create([DoctorProfile(user=d, specialization='Cardiology') for d in doctors])
+    start = date.today() + timedelta(days=1)
+    generate_availability([d.id for d in doctors], start, start + timedelta(days=13), range(7),
+                          time(9), time(17), 30)
+    return patient, doctors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--doctors', type=int, default=20)
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--requests', type=int, default=300, help='Requests per round')
+    args = parser.parse_args()
+
+    setup_django()
+    from django.conf import settings
+    from django.db import connection
+    from django.test import Client, override_settings
+    from django.urls import reverse
+    from core.metrics import time_query
+
+    with test_database():
+        patient, doctors = seed(args.doctors)
+        urls = [
+            reverse('home'),
+            reverse('dashboard'),
+            reverse('view_available_slots', args=[doctors[0].id]),
+            reverse('earliest_slots') + '?specialization=Cardiology',
+            reverse('api_doctors'),
+        ]
+
+        connection.ensure_connection()
+        clients = {}
+        without = [m for m in settings.MIDDLEWARE if m != 'core.middleware.MetricsMiddleware']
+        for label, middleware in (('off', without), ('on', settings.MIDDLEWARE)):
+            with override_settings(MIDDLEWARE=middleware):
+                client = clients[label] = Client()
+                client.force_login(patient)
+                # The handler builds its middleware chain on the first request
+                for url in urls:
+                    assert client.get(url).status_code == 200, url
+
+        def run(label):
+            if label == 'on':
+                connection.execute_wrappers.append(time_query)
+            try:
+                client = clients[label]
+                start = clock.perf_counter()
+                for n in range(args.requests):
+                    client.get(urls[n % len(urls)])
+                return (clock.perf_counter() - start) / args.requests
+            finally:
+                if label == 'on':
+                    connection.execute_wrappers.remove(time_query)
+
+        connection.execute_wrappers.remove(time_query)
+        samples = {'off': [], 'on': []}
+        for n in range(args.rounds):
+            # Alternate which goes first so drift hits both equally
+            for label in (('off', 'on') if n % 2 == 0 else ('on', 'off')):
+                samples[label].append(run(label))
+
+        off = statistics.median(samples['off'])
+        on = statistics.median(samples['on'])
+        overhead = on / off - 1
+        print(f"requests={args.rounds * args.requests} per mode, {len(urls)} pages")
+        print(f"metrics off  {off * 1000:8.3f} ms/request")
+        print(f"metrics on   {on * 1000:8.3f} ms/request")
+        print(f"overhead     {overhead:+8.2%} (budget {BUDGET:.0%}) {'OK' if overhead < BUDGET else 'OVER BUDGET'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Concurrency benchmark for rescheduling.
+
+--threads patients each hold one booking with the same doctor and keep moving
+it to random slots among --slots slots (fewer slots means more contention)
+for --moves attempts each. Reports reschedules per second, conflict and error
+counts, per-attempt latency percentiles, and checks that every booked slot has
+exactly one booking and the open-slot counters still match the slot rows.
+
+Use a PostgreSQL database for meaningful numbers; SQLite serialises writers.
+
+    python -m benchmarks.reschedule_race --threads 32 --slots 64 --moves 50
+"""
+import argparse
+import random
+import threading
+import time as clock
+from datetime import date, datetime, time, timedelta
+
+from benchmarks.common import setup_django, test_database, percentile
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--slots', type=int, default=32)
+    parser.add_argument('--moves', type=int, default=50)
+    args = parser.parse_args()
+    if args.slots <= args.threads:
+        parser.error('--slots must be larger than --threads')
+
+    setup_django()
+    from django.db import connection, OperationalError
+    from django.db.models import Count, Sum
+    from core.availability import refresh_open_slot_counts
+    from core.booking import book_slot, reschedule_booking, BookingError
+    from core.models import User, AvailabilitySlot, Booking, OpenSlotCount
+
+    with test_database():
+        doctor = User.objects.create(username='race-doctor', role='doctor')
+        patients = [User.objects.create(username=f'race-patient-{i}', role='patient')
+                    for i in range(args.threads)]
+        start_day = date.today() + timedelta(days=1)
+        AvailabilitySlot.objects.bulk_create([
+            AvailabilitySlot(
+                doctor=doctor,
+                date=start_day + timedelta(days=i // 32),
+                start_time=(datetime.combine(start_day, time(9)) + timedelta(minutes=15 * (i % 32))).time(),
+                end_time=(datetime.combine(start_day, time(9)) + timedelta(minutes=15 * (i % 32 + 1))).time(),
+            )
+            for i in range(args.slots)
+        ])
+        refresh_open_slot_counts([doctor.id])
+        slot_ids = list(AvailabilitySlot.objects.values_list('id', flat=True))
+        bookings = {patient.id: book_slot(patient, slot_id).id for patient, slot_id in zip(patients, slot_ids)}
+
+        latencies = []
+        outcomes = {'moved': 0, 'conflicts': 0, 'errors': 0}
+        lock = threading.Lock()
+        barrier = threading.Barrier(args.threads)
+
+        def patient_worker(patient):
+            local_latencies = []
+            local = {'moved': 0, 'conflicts': 0, 'errors': 0}
+            barrier.wait()
+            try:
+                for _ in range(args.moves):
+                    started = clock.perf_counter()
+                    try:
+                        reschedule_booking(patient, bookings[patient.id], random.choice(slot_ids))
+                        local['moved'] += 1
+                    except BookingError:
+                        local['conflicts'] += 1
+                    except OperationalError:
+                        local['errors'] += 1
+                    local_latencies.append(clock.perf_counter() - started)
+            finally:
+                connection.close()
+            with lock:
+                latencies.extend(local_latencies)
+                for key, value in local.items():
+                    outcomes[key] += value
+
+        threads = [threading.Thread(target=patient_worker, args=(p,)) for p in patients]
+        started = clock.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = clock.perf_counter() - started
+
+        ms = [value * 1000 for value in latencies]
+        doubles = Booking.objects.values('availability_slot').annotate(n=Count('id')).filter(n__gt=1).count()
+        booked_slots = AvailabilitySlot.objects.filter(is_booked=True).count()
+        booking_count = Booking.objects.count()
+        counted_open = OpenSlotCount.objects.aggregate(total=Sum('open_slots'))['total']
+        actual_open = AvailabilitySlot.objects.filter(is_booked=False).count()
+
+        print(f"threads={args.threads} slots={args.slots} moves={args.moves} elapsed={elapsed:.2f}s")
+        print(f"attempts/s={len(ms) / elapsed:.1f} reschedules/s={outcomes['moved'] / elapsed:.1f}")
+        print(f"moved={outcomes['moved']} conflicts={outcomes['conflicts']} errors={outcomes['errors']}")
+        print(f"latency p50={percentile(ms, 50):.2f}ms p95={percentile(ms, 95):.2f}ms "
+              f"p99={percentile(ms, 99):.2f}ms max={max(ms):.2f}ms")
+        print(f"bookings={booking_count} booked_slots={booked_slots} double_bookings={doubles} "
+              f"open_slots={actual_open} counted_open={counted_open}")
+        if doubles or booking_count != args.threads or booked_slots != booking_count or counted_open != actual_open:
+            raise SystemExit('Consistency check FAILED')
+
+
+if __name__ == '__main__':
+    main()
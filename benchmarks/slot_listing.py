@@ -0,0 +1,98 @@
+"""
+Load test for the available-slots page with and without the snapshot cache.
+
+Simulates the clinic-opening rush: --requests page views spread over a few
+popular doctors, each with --slots open slots. A booking every
+--book-every requests invalidates that doctor's snapshot. Reports requests
+per second, database queries per request and per second, and how many of
+those were reads of the slot table.
+
+    python -m benchmarks.slot_listing --doctors 5 --slots 200 --requests 1000
+"""
+import argparse
+import time as clock
+from datetime import date, datetime, time, timedelta
+
+from benchmarks.common import setup_django, test_database
+
+
+def seed(doctor_count, slot_count):
+    from core.models import User, DoctorProfile, AvailabilitySlot
+
+    patient = User.objects.create(username='bench-patient', role='patient')
+    doctors = []
+    for i in range(doctor_count):
+        doctor = User.objects.create(username=f'bench-doctor-{i}', role='doctor',
+                                     first_name='Doc', last_name=str(i))
+        DoctorProfile.objects.create(user=doctor, specialization='Cardiology')
+        doctors.append(doctor)
+        start = date.today() + timedelta(days=1)
+        AvailabilitySlot.objects.bulk_create([
+            AvailabilitySlot(
+                doctor=doctor,
+                date=start + timedelta(days=n // 32),
+                start_time=(datetime.combine(start, time(9)) + timedelta(minutes=15 * (n % 32))).time(),
+                end_time=(datetime.combine(start, time(9)) + timedelta(minutes=15 * (n % 32 + 1))).time(),
+            )
+            for n in range(slot_count)
+        ])
+    return patient, doctors
+
+
+def run(label, patient, doctors, requests, book_every):
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import CaptureQueriesContext
+    from django.urls import reverse
+    from core.models import AvailabilitySlot
+
+    client = Client()
+    client.force_login(patient)
+    urls = [reverse('view_available_slots', args=[d.id]) for d in doctors]
+    booked = 0
+    with CaptureQueriesContext(connection) as queries:
+        start = clock.perf_counter()
+        for i in range(requests):
+            if book_every and i and i % book_every == 0:
+                doctor = doctors[i % len(doctors)]
+                slot = AvailabilitySlot.objects.filter(doctor=doctor, is_booked=False).first()
+                client.post(reverse('book_appointment', args=[slot.id]))
+                booked += 1
+            response = client.get(urls[i % len(urls)])
+            assert response.status_code == 200
+        elapsed = clock.perf_counter() - start
+    count = len(queries)
+    slot_reads = sum(
+        1 for q in queries
+        if q['sql'].startswith('SELECT') and 'core_availabilityslot' in q['sql']
+    )
+    print(f"{label:<10} {requests / elapsed:9.1f} req/s  {count / requests:6.2f} queries/req  "
+          f"{count / elapsed:9.1f} queries/s  {slot_reads / elapsed:9.1f} slot reads/s  "
+          f"({booked} bookings)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--doctors', type=int, default=5)
+    parser.add_argument('--slots', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--book-every', type=int, default=100,
+                        help='Book a slot every N requests (0 disables bookings)')
+    args = parser.parse_args()
+
+    setup_django()
+    from django.core.cache import cache
+    from django.test.utils import override_settings
+
+    with test_database():
+        patient, doctors = seed(args.doctors, args.slots)
+        with override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.dummy.DummyCache'
+        }}):
+            run('no cache', patient, doctors, args.requests, args.book_every)
+        cache.clear()
+        run('cached', patient, doctors, args.requests, args.book_every)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+"""
+Minimal in-process Google Calendar API for tests and benchmarks.
+
+It implements the OAuth token refresh, events.list with sync tokens and the
+batch endpoint (events insert, update and delete) closely enough for
+core.calendar_sync, and counts what it received. Each refresh token owns one
+calendar: the access token is "token-<refresh token>". An optional
+per-request delay emulates the round trip to Google.
+"""
+import json
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+EVENTS_PATH = '/calendar/v3/calendars/primary/events'
+REASONS = {200: 'OK', 204: 'No Content', 404: 'Not Found', 409: 'Conflict', 410: 'Gone'}
+
+
+class _CalendarHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send headers and body in one segment; separate small writes stall on delayed ACKs
+    wbufsize = 64 * 1024
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status, body=None, content_type='application/json'):
+        payload = json.dumps(body).encode() if content_type == 'application/json' else body
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def calendar(self):
+        token = self.headers.get('Authorization', '').removeprefix('Bearer ')
+        if not token.startswith('token-'):
+            return None
+        return self.server.calendar(token.removeprefix('token-'))
+
+    def do_POST(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        path = urlsplit(self.path).path
+        if path == '/token':
+            self.server.count('token_refreshes')
+            form = {key: values[0] for key, values in parse_qs(body.decode()).items()}
+            refresh_token = form.get('refresh_token', '')
+            if not refresh_token or refresh_token in self.server.revoked:
+                return self.send(400, {'error': 'invalid_grant'})
+            return self.send(200, {'access_token': f'token-{refresh_token}', 'expires_in': 3600})
+        if path != '/batch/calendar/v3':
+            return self.send(404, {'error': 'not found'})
+        calendar = self.calendar()
+        if calendar is None:
+            return self.send(401, {'error': 'unauthorized'})
+        self.server.count('batches')
+        message = BytesParser(policy=HTTP).parsebytes(
+            f'Content-Type: {self.headers["Content-Type"]}\r\n\r\n'.encode() + body
+        )
+        boundary = 'batch_stub'
+        parts = []
+        for part in message.iter_parts():
+            self.server.count('calls')
+            raw = (part.get_payload(decode=True) or b'').replace(b'\r\n', b'\n')
+            head, _, call_body = raw.partition(b'\n\n')
+            method, call_path = head.split(b'\n', 1)[0].decode().split()[:2]
+            status, result = self.server.apply(calendar, method, call_path, call_body)
+            content_id = part.get('Content-ID', '<item0>').strip('<>')
+            inner = f'HTTP/1.1 {status} {REASONS.get(status, "Error")}\r\n'
+            if result is not None:
+                inner += f'Content-Type: application/json\r\n\r\n{json.dumps(result)}'
+            else:
+                inner += '\r\n'
+            parts.append(
+                f'--{boundary}\r\nContent-Type: application/http\r\n'
+                f'Content-ID: <response-{content_id}>\r\n\r\n{inner}\r\n'
+            )
+        payload = (''.join(parts) + f'--{boundary}--\r\n').encode()
+        self.send(200, payload, f'multipart/mixed; boundary={boundary}')
+
+    def do_GET(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        url = urlsplit(self.path)
+        if url.path != EVENTS_PATH:
+            return self.send(404, {'error': 'not found'})
+        calendar = self.calendar()
+        if calendar is None:
+            return self.send(401, {'error': 'unauthorized'})
+        self.server.count('lists')
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        status, result = self.server.list(calendar, params)
+        self.send(status, result)
+
+
+class StubCalendarServer(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0):
+        super().__init__((host, port), _CalendarHandler)
+        self.latency = latency
+        self.stats = {'token_refreshes': 0, 'batches': 0, 'calls': 0, 'lists': 0}
+        # refresh token -> {'events': {id: event}, 'sequence': n}
+        self.calendars = {}
+        self.revoked = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        return f'http://{self.server_address[0]}:{self.server_address[1]}'
+
+    def count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def calendar(self, name):
+        with self._lock:
+            return self.calendars.setdefault(name, {'events': {}, 'sequence': 0})
+
+    def events(self, name):
+        """Live (not deleted) events of a calendar, by id"""
+        return {
+            event_id: event for event_id, event in self.calendar(name)['events'].items()
+            if event.get('status') != 'cancelled'
+        }
+
+    def change(self, name, event_id, **fields):
+        """Edit or delete (status='cancelled') an event, as its owner would in Google"""
+        calendar = self.calendar(name)
+        with self._lock:
+            calendar['sequence'] += 1
+            calendar['events'][event_id].update(fields, _sequence=calendar['sequence'])
+
+    def apply(self, calendar, method, path, body):
+        event_id = path.removeprefix(EVENTS_PATH).strip('/')
+        with self._lock:
+            events = calendar['events']
+            existing = events.get(event_id or None)
+            live = existing is not None and existing.get('status') != 'cancelled'
+            calendar['sequence'] += 1
+            if method == 'POST':
+                event = json.loads(body)
+                if events.get(event['id'], {}).get('status') == 'confirmed':
+                    return 409, {'error': {'code': 409, 'message': 'duplicate'}}
+                event.update(status='confirmed', _sequence=calendar['sequence'])
+                events[event['id']] = event
+                return 200, {k: v for k, v in event.items() if not k.startswith('_')}
+            if method == 'PUT':
+                if not live:
+                    return 404, {'error': {'code': 404, 'message': 'not found'}}
+                event = json.loads(body)
+                event.update(id=event_id, status='confirmed', _sequence=calendar['sequence'])
+                events[event_id] = event
+                return 200, {k: v for k, v in event.items() if not k.startswith('_')}
+            if method == 'DELETE':
+                if existing is None:
+                    return 404, {'error': {'code': 404, 'message': 'not found'}}
+                if not live:
+                    return 410, {'error': {'code': 410, 'message': 'deleted'}}
+                existing.update(status='cancelled', _sequence=calendar['sequence'])
+                return 204, None
+        return 400, {'error': {'code': 400, 'message': f'unsupported {method}'}}
+
+    def list(self, calendar, params):
+        with self._lock:
+            since = 0
+            if 'syncToken' in params:
+                if not params['syncToken'].isdigit() or int(params['syncToken']) > calendar['sequence']:
+                    return 410, {'error': {'code': 410, 'message': 'fullSyncRequired'}}
+                since = int(params['syncToken'])
+            items = [
+                {k: v for k, v in event.items() if not k.startswith('_')}
+                for event in calendar['events'].values()
+                if event['_sequence'] > since
+                and (since or params.get('showDeleted') == 'true' or event.get('status') != 'cancelled')
+            ]
+            return 200, {'items': items, 'nextSyncToken': str(calendar['sequence'])}
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
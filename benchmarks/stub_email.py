@@ -0,0 +1,76 @@
+"""
+Minimal in-process stand-in for the serverless email function.
+
+Accepts the single-message and batch ({"messages": [...]}) payloads of
+core.email_service, answers them the way email_service/handler.py does
+(every message "sent") and counts what it received. An optional
+per-request delay emulates the round trip to the function.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _EmailHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send headers and body in one segment; separate small writes stall on delayed ACKs
+    wbufsize = 64 * 1024
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if 'messages' in body:
+            results = [{'to': m.get('to'), 'action': m.get('action'), 'status': 'sent'} for m in body['messages']]
+            self.server.count(len(results))
+            payload = {'message': f'{len(results)} of {len(results)} emails sent', 'sent': len(results),
+                       'failed': 0, 'results': results}
+        else:
+            self.server.count(1)
+            payload = {'message': 'Email sent successfully', 'action': body.get('action')}
+        data = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class StubEmailServer(ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0):
+        super().__init__((host, port), _EmailHandler)
+        self.latency = latency
+        self.stats = {'requests': 0, 'messages': 0}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        return f'http://{self.server_address[0]}:{self.server_address[1]}/dev/send-email'
+
+    def count(self, messages):
+        with self._lock:
+            self.stats['requests'] += 1
+            self.stats['messages'] += messages
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,72 @@
+"""
+Throughput and memory of the bulk user import.
+
+Writes --users rows (one doctor in every --doctor-every) to a temporary CSV
+or NDJSON file and runs `manage.py import_users` on it, reporting users per
+second, database queries and the process's peak RSS. The peak should depend
+on --batch-size, not on --users.
+
+    python -m benchmarks.user_import --users 100000
+"""
+import argparse
+import csv
+import json
+import resource
+import tempfile
+import time as clock
+
+from benchmarks.common import setup_django, test_database
+
+COLUMNS = ('username', 'email', 'first_name', 'last_name', 'role', 'specialization', 'phone')
+
+
+def write_rows(handle, fmt, count, doctor_every):
+    writer = csv.writer(handle) if fmt == 'csv' else None
+    if writer:
+        writer.writerow(COLUMNS)
+    for n in range(count):
+        doctor = n % doctor_every == 0
+        row = (f'user{n}', f'user{n}@example.com', 'First', f'Last{n}',
+               'doctor' if doctor else 'patient', 'Cardiology' if doctor else '', '555-0100')
+        if writer:
+            writer.writerow(row)
+        else:
+            handle.write(json.dumps(dict(zip(COLUMNS, row))) + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--doctor-every', type=int, default=20)
+    parser.add_argument('--format', choices=['csv', 'ndjson'], default='ndjson')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.core.management import call_command
+    from django.db import connection
+
+    queries = 0
+
+    def count_queries(execute, sql, params, many, context):
+        nonlocal queries
+        queries += 1
+        return execute(sql, params, many, context)
+
+    with tempfile.NamedTemporaryFile('w+', suffix=f'.{args.format}', newline='') as handle:
+        write_rows(handle, args.format, args.users, args.doctor_every)
+        handle.flush()
+        with test_database():
+            with connection.execute_wrapper(count_queries):
+                started = clock.perf_counter()
+                call_command('import_users', handle.name, batch_size=args.batch_size)
+                elapsed = clock.perf_counter() - started
+    # ru_maxrss is in KiB on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"users={args.users} format={args.format} batch={args.batch_size} "
+          f"users/s={args.users / elapsed:8.0f} elapsed={elapsed:6.1f}s "
+          f"queries={queries} peak_rss={peak:6.1f}MiB")
+
+
+if __name__ == '__main__':
+    main()
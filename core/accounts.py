@@ -0,0 +1,98 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.db.models.functions import Lower
+from django.utils.crypto import get_random_string
+from .email_service import queue_email
+from .models import User
+
+# Alternative usernames offered when the chosen one is taken
+USERNAME_SUGGESTIONS = 3
+# Numbered candidates (<username>1, <username>2, ...) checked in one lookup
+USERNAME_CANDIDATES = 20
+
+
+class SignupConflict(Exception):
+    """The username or email was taken between validation and the INSERT"""
+
+    def __init__(self, field, message):
+        super().__init__(message)
+        self.field = field
+        self.message = message
+
+
+def matching_accounts(usernames, emails):
+    """
+    (username, lowercased email) of the accounts holding any of the given
+    usernames or lowercased emails. The blank-email exclusion repeats the
+    condition of the partial index on LOWER(email), so the planner can use
+    that index instead of scanning the users table.
+    """
+    return User.objects.annotate(email_lower=Lower('email')).filter(
+        Q(username__in=usernames) | (Q(email_lower__in=emails) & ~Q(email=''))
+    ).values_list('username', 'email_lower')
+
+
+def taken_fields(username, email):
+    """
+    Return which of 'username' and 'email' already belong to an account, in
+    one query. Emails compare case-insensitively, like the unique index on
+    LOWER(email) that enforces them.
+    """
+    email = email.lower()
+    taken = set()
+    for row_username, row_email in matching_accounts([username], [email])[:2]:
+        if row_username == username:
+            taken.add('username')
+        if row_email == email:
+            taken.add('email')
+    return taken
+
+
+def suggest_usernames(username, count=USERNAME_SUGGESTIONS):
+    """
+    Free variants of a taken username. The numbered candidates are checked
+    against the username index in one query; random suffixes fill in when
+    they are all taken.
+    """
+    max_length = User._meta.get_field('username').max_length
+    candidates = [
+        name for name in (f'{username}{n}' for n in range(1, USERNAME_CANDIDATES + 1))
+        if len(name) <= max_length
+    ]
+    taken = set(User.objects.filter(username__in=candidates).values_list('username', flat=True))
+    free = [name for name in candidates if name not in taken][:count]
+    while len(free) < count:
+        suffix = get_random_string(6, '0123456789')
+        free.append(f'{username[:max_length - len(suffix)]}{suffix}')
+    return free
+
+
+def create_account(user, profile):
+    """
+    Save a new user and their profile, and queue the welcome email, in one
+    transaction. The database's unique constraints are the final check: if
+    another signup took the username or email after validation,
+    SignupConflict names the field.
+    """
+    try:
+        with transaction.atomic():
+            user.save()
+            profile.user = user
+            profile.save()
+            queue_email('SIGNUP_WELCOME', user.email, {
+                'name': user.get_full_name(),
+                'role': user.get_role_display()
+            })
+    except IntegrityError:
+        user.pk = None
+        taken = taken_fields(user.username, user.email)
+        if 'username' in taken:
+            raise SignupConflict('username', username_taken_message(user.username))
+        if 'email' in taken:
+            raise SignupConflict('email', 'An account with this email already exists.')
+        raise
+    return user
+
+
+def username_taken_message(username):
+    return 'This username is already taken. Try: ' + ', '.join(suggest_usernames(username))
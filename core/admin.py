@@ -1,9 +1,16 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import User, DoctorProfile, PatientProfile, AvailabilitySlot, Booking
+from .models import (
+    User, DoctorProfile, PatientProfile, AvailabilitySlot, Booking, CalendarSyncTask, EmailOutbox, OpenSlotCount,
+    WaitlistEntry,
+)
 
 admin.site.register(User, UserAdmin)
 admin.site.register(DoctorProfile)
 admin.site.register(PatientProfile)
 admin.site.register(AvailabilitySlot)
-admin.site.register(Booking)
\ No newline at end of file
+admin.site.register(Booking)
+admin.site.register(EmailOutbox)
+admin.site.register(OpenSlotCount)
+admin.site.register(WaitlistEntry)
+admin.site.register(CalendarSyncTask)
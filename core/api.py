@@ -0,0 +1,278 @@
+"""
+Versioned JSON API (/api/v1/) for doctors, open slots and bookings.
+
+List endpoints use cursor pagination: responses carry `next` and `previous`
+cursors to pass back as ?after= or ?before=. Every JSON response has an
+ETag, and a matching If-None-Match gets an empty 304. The booking export
+streams NDJSON or CSV rows straight from a server-side cursor.
+"""
+import csv
+import hashlib
+import json
+from bisect import bisect_left, bisect_right
+from datetime import datetime, time
+from functools import wraps
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.views.decorators.http import require_GET
+from .availability import EARLIEST_SLOTS_MAX, find_earliest_slots, next_available_dates
+from .caching import get_open_slots, specialization_spellings
+from .models import User, AvailabilitySlot, Booking
+from .pagination import decode_cursor, encode_cursor, keyset_paginate
+
+API_DEFAULT_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 200
+# Rows fetched per round trip by the streaming export
+EXPORT_CHUNK_SIZE = 2000
+
+EXPORT_FIELDS = (
+    'id', 'booked_at', 'patient_id', 'patient__first_name', 'patient__last_name',
+    'availability_slot__doctor_id', 'availability_slot__doctor__first_name',
+    'availability_slot__doctor__last_name', 'availability_slot__date',
+    'availability_slot__start_time', 'availability_slot__end_time',
+)
+EXPORT_COLUMNS = (
+    'id', 'booked_at', 'patient_id', 'patient_first_name', 'patient_last_name',
+    'doctor_id', 'doctor_first_name', 'doctor_last_name', 'date', 'start_time', 'end_time',
+)
+
+
+def api_login_required(view):
+    """Like login_required, but answers 401 JSON instead of redirecting"""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'error': 'Authentication required'}, status=401)
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+def api_response(request, payload):
+    """
+    Serialize payload with a content-hash ETag. Returns 304 Not Modified when
+    the client's If-None-Match already has this representation.
+    """
+    body = json.dumps(payload, cls=DjangoJSONEncoder, separators=(',', ':'))
+    etag = f'"{hashlib.sha1(body.encode()).hexdigest()}"'
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(body, content_type='application/json')
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def page_size(request):
+    try:
+        size = int(request.GET.get('limit', API_DEFAULT_PAGE_SIZE))
+    except ValueError:
+        size = API_DEFAULT_PAGE_SIZE
+    return max(1, min(size, API_MAX_PAGE_SIZE))
+
+
+def page_payload(page, results):
+    return {'results': results, 'next': page.next_cursor, 'previous': page.prev_cursor}
+
+
+@require_GET
+@api_login_required
+def doctors(request):
+    """Doctors ordered by id, optionally filtered by ?specialization="""
+    queryset = User.objects.filter(role='doctor').select_related('doctor_profile').only(
+        'id', 'first_name', 'last_name', 'doctor_profile__specialization'
+    )
+    specialization = request.GET.get('specialization')
+    if specialization:
+        queryset = queryset.filter(doctor_profile__specialization__iexact=specialization)
+    page = keyset_paginate(
+        queryset, ('id',), page_size(request),
+        after=request.GET.get('after'), before=request.GET.get('before')
+    )
+    next_dates = next_available_dates([doctor.id for doctor in page])
+    return api_response(request, page_payload(page, [
+        {
+            'id': doctor.id,
+            'name': doctor.get_full_name(),
+            'specialization': getattr(getattr(doctor, 'doctor_profile', None), 'specialization', ''),
+            'next_available_date': next_dates.get(doctor.id),
+        }
+        for doctor in page
+    ]))
+
+
+@require_GET
+@api_login_required
+def doctor_slots(request, doctor_id):
+    """
+    A doctor's open future slots in (date, start_time, id) order, served from
+    the cached snapshot, so paging through them costs no queries.
+    """
+    doctor = get_object_or_404(User.objects.only('id'), id=doctor_id, role='doctor')
+    slots = get_open_slots(doctor.id, request.user.id)
+    positions = [(s.date, s.start_time, s.id) for s in slots]
+    size = page_size(request)
+    keys = ('date', 'start_time', 'id')
+    before = decode_cursor(request.GET['before'], AvailabilitySlot, keys) if request.GET.get('before') else None
+    after = decode_cursor(request.GET['after'], AvailabilitySlot, keys) if request.GET.get('after') else None
+    if before is not None:
+        end = bisect_left(positions, tuple(before))
+        start = max(end - size, 0)
+    else:
+        start = bisect_right(positions, tuple(after)) if after is not None else 0
+        end = start + size
+    window = slots[start:end]
+
+    def cursor(slot):
+        return encode_cursor([slot.date, slot.start_time, slot.id])
+
+    return api_response(request, {
+        'results': [
+            {
+                'id': s.id, 'date': s.date, 'start_time': s.start_time,
+                'end_time': s.end_time, 'held_until': s.held_until,
+            }
+            for s in window
+        ],
+        'next': cursor(window[-1]) if window and end < len(slots) else None,
+        'previous': cursor(window[0]) if window and start > 0 else None,
+    })
+
+
+@require_GET
+@api_login_required
+def earliest_slots(request):
+    """
+    The first ?limit= (default 10, max 50) open slots of any doctor with
+    ?specialization= (case-insensitive), starting at ?from= (an ISO date or
+    datetime; default now)
+    """
+    specialization = request.GET.get('specialization', '').strip()
+    if not specialization:
+        return JsonResponse({'error': 'specialization is required'}, status=400)
+    after = None
+    value = request.GET.get('from')
+    if value:
+        try:
+            after = parse_datetime(value)
+            if after is None and parse_date(value):
+                after = datetime.combine(parse_date(value), time.min)
+        except ValueError:
+            after = None
+        if after is None:
+            return JsonResponse({'error': 'from must be an ISO 8601 date or datetime'}, status=400)
+        if timezone.is_naive(after):
+            after = timezone.make_aware(after)
+    try:
+        limit = int(request.GET.get('limit', 10))
+    except ValueError:
+        limit = 10
+    slots = find_earliest_slots(
+        specialization_spellings(specialization), after, min(limit, EARLIEST_SLOTS_MAX), request.user.id
+    )
+    return api_response(request, {'results': [
+        {
+            'id': s.id, 'doctor': {'id': s.doctor.id, 'name': s.doctor.get_full_name()},
+            'date': s.date, 'start_time': s.start_time, 'end_time': s.end_time, 'held_until': s.held_until,
+        }
+        for s in slots
+    ]})
+
+
+def bookings_for(user):
+    """Bookings a user may read: clinic staff see all, others their own"""
+    bookings = Booking.objects.all()
+    if user.is_staff:
+        return bookings
+    if user.role == 'doctor':
+        return bookings.filter(availability_slot__doctor=user)
+    return bookings.filter(patient=user)
+
+
+def query_date(request, name):
+    try:
+        return parse_date(request.GET.get(name, ''))
+    except ValueError:
+        return None
+
+
+def filter_dates(bookings, request):
+    start = query_date(request, 'from')
+    end = query_date(request, 'to')
+    if start:
+        bookings = bookings.filter(availability_slot__date__gte=start)
+    if end:
+        bookings = bookings.filter(availability_slot__date__lte=end)
+    return bookings
+
+
+@require_GET
+@api_login_required
+def bookings(request):
+    """The user's bookings ordered by id, optionally limited by ?from= and ?to= dates"""
+    queryset = filter_dates(bookings_for(request.user), request).select_related(
+        'patient', 'availability_slot__doctor'
+    )
+    page = keyset_paginate(
+        queryset, ('id',), page_size(request),
+        after=request.GET.get('after'), before=request.GET.get('before')
+    )
+    return api_response(request, page_payload(page, [
+        {
+            'id': b.id,
+            'booked_at': b.booked_at,
+            'patient': {'id': b.patient_id, 'name': b.patient.get_full_name()},
+            'doctor': {
+                'id': b.availability_slot.doctor_id,
+                'name': b.availability_slot.doctor.get_full_name(),
+            },
+            'date': b.availability_slot.date,
+            'start_time': b.availability_slot.start_time,
+            'end_time': b.availability_slot.end_time,
+        }
+        for b in page
+    ]))
+
+
+class _Echo:
+    """File-like object whose write() hands the line back to the generator"""
+
+    def write(self, value):
+        return value
+
+
+@require_GET
+@api_login_required
+def bookings_export(request):
+    """
+    Stream every booking the user may read as NDJSON (default) or CSV
+    (?format=csv). Rows come from a server-side cursor in chunks of
+    EXPORT_CHUNK_SIZE, so memory stays flat however many rows there are.
+    """
+    rows = filter_dates(bookings_for(request.user), request).order_by('id').values_list(
+        *EXPORT_FIELDS
+    ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+    if request.GET.get('format') == 'csv':
+        writer = csv.writer(_Echo())
+
+        def lines():
+            yield writer.writerow(EXPORT_COLUMNS)
+            for row in rows:
+                yield writer.writerow(row)
+
+        response = StreamingHttpResponse(lines(), content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename="bookings.csv"'
+    else:
+        encoder = DjangoJSONEncoder(separators=(',', ':'))
+
+        def lines():
+            for row in rows:
+                yield encoder.encode(dict(zip(EXPORT_COLUMNS, row))) + '\n'
+
+        response = StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+    patch_cache_control(response, private=True, no_store=True)
+    return response
@@ -0,0 +1,72 @@
+"""
+Async versions of the read-heavy views, used when ASYNC_VIEWS is enabled and
+the project is served over ASGI (see hospital_system/asgi.py). Data is read
+with the async ORM and cache APIs; only template rendering runs in a thread.
+"""
+from asgiref.sync import sync_to_async
+from django.contrib import messages
+from django.contrib.auth.decorators import login_required
+from django.core.paginator import Paginator
+from django.shortcuts import aget_object_or_404, redirect, render
+from django.utils import timezone
+from .availability import anext_available_dates, aopen_slots_this_week
+from .caching import aget_doctor_directory, aget_open_slots
+from .forms import WaitlistForm
+from .models import User, Booking, WaitlistEntry
+from .pagination import akeyset_paginate
+from .views import (
+    BOOKING_PAGE_KEYS, DOCTOR_DASHBOARD_PAGE_SIZE, DOCTOR_DIRECTORY_PAGE_SIZE, SLOT_PAGE_KEYS,
+    doctor_dashboard_context, doctor_dashboard_queries, search_directory,
+)
+
+arender = sync_to_async(render)
+
+
+@login_required
+async def dashboard(request):
+    user = await request.auser()
+    if user.role == 'doctor':
+        params, window, slots, bookings = doctor_dashboard_queries(request, user)
+        page = await akeyset_paginate(
+            slots, SLOT_PAGE_KEYS, DOCTOR_DASHBOARD_PAGE_SIZE,
+            after=request.GET.get('after'), before=request.GET.get('before')
+        )
+        bookings_page = await akeyset_paginate(
+            bookings, BOOKING_PAGE_KEYS, DOCTOR_DASHBOARD_PAGE_SIZE,
+            after=request.GET.get('bookings_after'), before=request.GET.get('bookings_before')
+        )
+        return await arender(request, 'core/doctor_dashboard.html',
+                             doctor_dashboard_context(request, params, window, page, bookings_page))
+    else:
+        search = request.GET.get('q', '').strip()
+        doctors = search_directory(await aget_doctor_directory(), search)
+        doctors_page = Paginator(doctors, DOCTOR_DIRECTORY_PAGE_SIZE).get_page(request.GET.get('page'))
+        next_dates = await anext_available_dates([d.id for d in doctors_page])
+        bookings = Booking.objects.filter(patient=user).select_related('availability_slot__doctor')
+        waitlist = WaitlistEntry.objects.filter(patient=user, status='waiting').select_related('doctor')
+        return await arender(request, 'core/patient_dashboard.html', {
+            'doctors': [(d, next_dates.get(d.id)) for d in doctors_page],
+            'doctors_page': doctors_page,
+            'search': search,
+            'bookings': [booking async for booking in bookings],
+            'waitlist': [entry async for entry in waitlist],
+            'today': timezone.now().date()
+        })
+
+
+@login_required
+async def view_available_slots(request, doctor_id):
+    user = await request.auser()
+    if user.role != 'patient':
+        messages.error(request, 'Only patients can book appointments')
+        return redirect('dashboard')
+
+    doctor = await aget_object_or_404(User.objects.select_related('doctor_profile'), id=doctor_id, role='doctor')
+    available_slots = await aget_open_slots(doctor.id, user.id)
+
+    return await arender(request, 'core/available_slots.html', {
+        'doctor': doctor,
+        'slots': available_slots,
+        'open_this_week': await aopen_slots_this_week(doctor.id),
+        'waitlist_form': WaitlistForm()
+    })
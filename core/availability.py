@@ -0,0 +1,170 @@
+from datetime import date, timedelta
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Min, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import DoctorProfile, AvailabilitySlot, OpenSlotCount
+
+# Most slots one earliest-slot search returns
+EARLIEST_SLOTS_MAX = 50
+
+
+def unheld(patient_id=None, now=None):
+    """
+    Condition for slots nobody else is holding: never held, hold expired,
+    or held by `patient_id`
+    """
+    condition = Q(held_until__isnull=True) | Q(held_until__lte=now or timezone.now())
+    if patient_id is not None:
+        condition |= Q(held_by_id=patient_id)
+    return condition
+
+
+def adjust_open_slots(doctor_id, day, delta):
+    """
+    Add delta to a doctor's open-slot count for a date, in the caller's
+    transaction. Run it late in the transaction: it locks the counter row.
+    """
+    updated = OpenSlotCount.objects.filter(doctor_id=doctor_id, date=day).update(
+        open_slots=F('open_slots') + delta
+    )
+    if not updated and delta > 0:
+        counter, created = OpenSlotCount.objects.get_or_create(
+            doctor_id=doctor_id, date=day, defaults={'open_slots': delta}
+        )
+        if not created:
+            OpenSlotCount.objects.filter(id=counter.id).update(open_slots=F('open_slots') + delta)
+
+
+def adjust_open_slot_counts(deltas):
+    """
+    Apply several counter changes, {(doctor_id, date): delta}, with one UPDATE.
+    Counter rows are locked in (doctor, date) order first so concurrent
+    multi-slot writers cannot deadlock on them.
+    """
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    match = Q()
+    whens = []
+    for (doctor_id, day), delta in deltas.items():
+        match |= Q(doctor_id=doctor_id, date=day)
+        whens.append(When(doctor_id=doctor_id, date=day, then=Value(delta)))
+    counters = OpenSlotCount.objects.filter(match)
+    found = set(counters.select_for_update().order_by('doctor_id', 'date').values_list('doctor_id', 'date'))
+    if found:
+        counters.update(open_slots=F('open_slots') + Case(*whens, output_field=IntegerField()))
+    for (doctor_id, day), delta in deltas.items():
+        if (doctor_id, day) not in found and delta > 0:
+            adjust_open_slots(doctor_id, day, delta)
+
+
+def refresh_open_slot_counts(doctor_ids=None, start_date=None, end_date=None):
+    """
+    Recompute counters from the slot rows, e.g. after bulk inserts or to repair
+    drift. Limits to the given doctors and date range when provided.
+    """
+    slots = AvailabilitySlot.objects.all()
+    counters = OpenSlotCount.objects.all()
+    if doctor_ids is not None:
+        slots = slots.filter(doctor_id__in=doctor_ids)
+        counters = counters.filter(doctor_id__in=doctor_ids)
+    if start_date:
+        slots = slots.filter(date__gte=start_date)
+        counters = counters.filter(date__gte=start_date)
+    if end_date:
+        slots = slots.filter(date__lte=end_date)
+        counters = counters.filter(date__lte=end_date)
+
+    totals = slots.values('doctor_id', 'date').annotate(
+        open_slots=Count('id', filter=Q(is_booked=False))
+    ).order_by()
+    with transaction.atomic():
+        counters.delete()
+        OpenSlotCount.objects.bulk_create(
+            (OpenSlotCount(doctor_id=row['doctor_id'], date=row['date'], open_slots=row['open_slots'])
+             for row in totals.iterator()),
+            batch_size=1000
+        )
+
+
+def _next_available_rows(doctor_ids):
+    return OpenSlotCount.objects.filter(
+        doctor_id__in=doctor_ids,
+        date__gte=timezone.now().date(),
+        open_slots__gt=0
+    ).values_list('doctor_id').annotate(next_date=Min('date')).order_by()
+
+
+def next_available_dates(doctor_ids):
+    """Map each doctor id to the first future date with an open slot"""
+    return dict(_next_available_rows(doctor_ids))
+
+
+async def anext_available_dates(doctor_ids):
+    return {doctor_id: next_date async for doctor_id, next_date in _next_available_rows(doctor_ids)}
+
+
+def _this_week(doctor_id):
+    today = timezone.now().date()
+    week_end = today + timedelta(days=6 - today.weekday())
+    return OpenSlotCount.objects.filter(doctor_id=doctor_id, date__range=(today, week_end))
+
+
+def open_slots_this_week(doctor_id):
+    """Open slots from today until the end of the current week (Sunday)"""
+    return _this_week(doctor_id).aggregate(total=Sum('open_slots'))['total'] or 0
+
+
+async def aopen_slots_this_week(doctor_id):
+    return (await _this_week(doctor_id).aaggregate(total=Sum('open_slots')))['total'] or 0
+
+
+def _earliest_slots_query(doctors, day, at, now, patient_id, limit, bounded):
+    slots = AvailabilitySlot.objects.filter(
+        unheld(patient_id, now),
+        doctor_id__in=doctors,
+        is_booked=False,
+        date__gte=day,
+    ).exclude(date=day, start_time__lt=at)
+    if bounded:
+        # Each later (doctor, day) with a positive counter has at least one
+        # open slot, so the first `limit` slots fall no later than the
+        # limit-th soonest of them. Today's counters also count slots that
+        # have already started, so they cannot bound anything.
+        open_days = OpenSlotCount.objects.filter(
+            doctor_id__in=doctors, date__gt=day, open_slots__gt=0
+        ).order_by('date').values('date')[limit - 1:limit]
+        slots = slots.filter(date__lte=Coalesce(Subquery(open_days), Value(date.max)))
+    return slots.select_related('doctor').only(
+        'id', 'date', 'start_time', 'end_time', 'held_by_id', 'held_until',
+        'doctor__id', 'doctor__first_name', 'doctor__last_name'
+    ).order_by('date', 'start_time', 'id')[:limit]
+
+
+def find_earliest_slots(specializations, after=None, limit=10, patient_id=None):
+    """
+    The first `limit` open slots starting at or after `after` (default now)
+    with any doctor whose specialization is one of `specializations`, in time
+    order, with their doctors. Slots held for other patients are skipped;
+    held_until is only set on the patient's own live holds.
+
+    One query: the open-slot counters act as a per-doctor next-available
+    pointer and bound the date range, so only the matching doctors' open
+    slots up to that day are read (slot_open_idx), however far ahead the
+    schedules run. Held slots can make that bound too tight; a second,
+    unbounded query covers the rare short result.
+    """
+    now = timezone.now()
+    after = timezone.localtime(max(after or now, now))
+    limit = max(1, min(limit, EARLIEST_SLOTS_MAX))
+    doctors = DoctorProfile.objects.filter(specialization__in=list(specializations)).values('user_id')
+    args = (doctors, after.date(), after.time().replace(microsecond=0), now, patient_id, limit)
+    slots = list(_earliest_slots_query(*args, bounded=True))
+    if len(slots) < limit:
+        slots = list(_earliest_slots_query(*args, bounded=False))
+    for slot in slots:
+        # Only the patient's own live hold is worth showing
+        if slot.held_until and (slot.held_until <= now or slot.held_by_id != patient_id):
+            slot.held_until = None
+    return slots
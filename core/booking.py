@@ -0,0 +1,370 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from .availability import adjust_open_slot_counts, adjust_open_slots, unheld
+from .caching import invalidate_open_slots
+from .calendar_sync import queue_calendar_upserts
+from .email_service import queue_emails
+from .metrics import lock_wait
+from .models import User, AvailabilitySlot, Booking
+from .waitlist import fill_waitlists, offer_slot_on_commit
+
+# Upper bound on slots reserved by one multi-slot booking
+MAX_SLOTS_PER_BOOKING = 20
+
+
+class BookingError(Exception):
+    pass
+
+
+class SlotUnavailable(BookingError):
+    pass
+
+
+class SlotInPast(BookingError):
+    pass
+
+
+def _claim_sql():
+    table = connection.ops.quote_name(AvailabilitySlot._meta.db_table)
+    condition = ('id = %s AND is_booked = %s AND date >= %s '
+                 'AND (held_until IS NULL OR held_until <= %s OR held_by_id = %s)')
+    if connection.features.has_select_for_update_skip_locked:
+        # A slot whose row is locked by another booking in flight is skipped
+        # rather than waited on, so the loser is told at once that it is taken
+        where = f'id = (SELECT id FROM {table} WHERE {condition} FOR UPDATE SKIP LOCKED)'
+    else:
+        where = condition
+    return (f'UPDATE {table} SET is_booked = %s, held_by_id = NULL, held_until = NULL WHERE {where} '
+            f'RETURNING doctor_id, date, start_time, end_time')
+
+
+def claim_slot(slot_id, patient_id=None):
+    """
+    Atomically flip a future open slot to booked with one conditional UPDATE.
+    Returns (doctor_id, date, start_time, end_time) of the claimed slot, or
+    None if it is booked, being booked, held for another patient, in the past
+    or does not exist. Must run inside a transaction.
+    """
+    now = timezone.now()
+    with connection.cursor() as cursor:
+        cursor.execute(_claim_sql(), [True, slot_id, False, now.date(), now, patient_id])
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    # Raw cursors skip the ORM's type conversion (SQLite returns strings)
+    fields = [AvailabilitySlot._meta.get_field(name) for name in ('date', 'start_time', 'end_time')]
+    return (row[0], *(field.to_python(value) for field, value in zip(fields, row[1:])))
+
+
+def book_slot(patient, slot_id):
+    """
+    Book a slot for a patient: claim it, insert the booking, queue the
+    confirmation emails and update the open-slot counter in one short
+    transaction. Raises SlotUnavailable or SlotInPast; returns the Booking.
+    """
+    try:
+        with transaction.atomic():
+            with lock_wait('slot'):
+                claimed = claim_slot(slot_id, patient.id)
+            if claimed is None:
+                raise SlotUnavailable()
+            doctor_id, date, start_time, end_time = claimed
+
+            booking = Booking.objects.create(patient=patient, availability_slot_id=slot_id)
+            doctor = User.objects.only(
+                'first_name', 'last_name', 'email', 'google_calendar_credentials'
+            ).get(id=doctor_id)
+
+            email_data = {
+                'patient_name': patient.get_full_name(),
+                'doctor_name': doctor.get_full_name(),
+                'date': date.strftime('%Y-%m-%d'),
+                'time': start_time.strftime('%H:%M')
+            }
+            queue_emails([
+                {'action': 'BOOKING_CONFIRMATION', 'to': patient.email, 'data': email_data},
+                {'action': 'BOOKING_CONFIRMATION', 'to': doctor.email, 'data': email_data},
+            ])
+            queue_calendar_upserts([(patient, booking.id), (doctor, booking.id)])
+
+            # Last, so the counter row is locked as briefly as possible
+            with lock_wait('open_slot_count'):
+                adjust_open_slots(doctor_id, date, -1)
+            invalidate_open_slots(doctor_id)
+    except IntegrityError:
+        # A stale booking row still points at this slot
+        raise SlotUnavailable()
+    except SlotUnavailable:
+        # Only the failure path pays for finding out why
+        slot_date = AvailabilitySlot.objects.filter(id=slot_id, is_booked=False).values_list(
+            'date', flat=True
+        ).first()
+        if slot_date and slot_date < timezone.now().date():
+            raise SlotInPast()
+        raise
+
+    booking.availability_slot = AvailabilitySlot(
+        id=slot_id, doctor=doctor, date=date, start_time=start_time,
+        end_time=end_time, is_booked=True
+    )
+    return booking
+
+
+def book_slots(patient, slot_ids):
+    """
+    Book several slots for a patient in one transaction, all or nothing.
+    Slots are locked in id order so overlapping requests cannot deadlock, the
+    bookings are inserted together, and the patient and each doctor get one
+    summary email. Raises SlotUnavailable, SlotInPast or BookingError; returns
+    the bookings in appointment order.
+    """
+    slot_ids = sorted(set(slot_ids))
+    if not slot_ids:
+        raise SlotUnavailable()
+    if len(slot_ids) > MAX_SLOTS_PER_BOOKING:
+        raise BookingError(f'At most {MAX_SLOTS_PER_BOOKING} slots can be booked at once')
+
+    now = timezone.now()
+    today = now.date()
+    try:
+        with transaction.atomic():
+            with lock_wait('slot'):
+                slots = list(
+                    AvailabilitySlot.objects.select_for_update()
+                    .filter(unheld(patient.id, now), id__in=slot_ids, is_booked=False, date__gte=today)
+                    .only('id', 'doctor_id', 'date', 'start_time', 'end_time')
+                    .order_by('id')
+                )
+            if len(slots) != len(slot_ids):
+                raise SlotUnavailable()
+            # The row count re-checks the claim where row locks are unsupported
+            claimed = AvailabilitySlot.objects.filter(
+                unheld(patient.id, now), id__in=slot_ids, is_booked=False
+            ).update(is_booked=True, held_by=None, held_until=None)
+            if claimed != len(slot_ids):
+                raise SlotUnavailable()
+
+            bookings = Booking.objects.bulk_create(
+                [Booking(patient=patient, availability_slot=slot) for slot in slots]
+            )
+            doctors = User.objects.only('first_name', 'last_name', 'email', 'google_calendar_credentials').in_bulk(
+                {slot.doctor_id for slot in slots}
+            )
+            deltas = {}
+            for slot in slots:
+                slot.is_booked = True
+                slot.doctor = doctors[slot.doctor_id]
+                deltas[slot.doctor_id, slot.date] = deltas.get((slot.doctor_id, slot.date), 0) - 1
+            bookings.sort(key=lambda b: (b.availability_slot.date, b.availability_slot.start_time))
+
+            appointments = [
+                {
+                    'doctor_name': b.availability_slot.doctor.get_full_name(),
+                    'date': b.availability_slot.date.strftime('%Y-%m-%d'),
+                    'time': b.availability_slot.start_time.strftime('%H:%M')
+                }
+                for b in bookings
+            ]
+            patient_name = patient.get_full_name()
+            summaries = [{
+                'action': 'BOOKING_SUMMARY', 'to': patient.email,
+                'data': {'patient_name': patient_name, 'appointments': appointments}
+            }]
+            for doctor in doctors.values():
+                summaries.append({
+                    'action': 'BOOKING_SUMMARY', 'to': doctor.email,
+                    'data': {
+                        'patient_name': patient_name,
+                        'appointments': [
+                            a for a, b in zip(appointments, bookings) if b.availability_slot.doctor_id == doctor.id
+                        ]
+                    }
+                })
+            queue_emails(summaries)
+            queue_calendar_upserts(
+                (user, b.id) for b in bookings for user in (patient, b.availability_slot.doctor)
+            )
+
+            with lock_wait('open_slot_count'):
+                adjust_open_slot_counts(deltas)
+            invalidate_open_slots(*doctors)
+    except IntegrityError:
+        raise SlotUnavailable()
+    except SlotUnavailable:
+        if AvailabilitySlot.objects.filter(id__in=slot_ids, is_booked=False, date__lt=today).exists():
+            raise SlotInPast()
+        raise
+    return bookings
+
+
+def release_slot(slot):
+    """
+    Mark a booked slot open again in the caller's transaction, update its
+    counter and cache, and offer it to the waitlist once committed.
+    Returns whether the slot was released (False if it was already open).
+    """
+    if not AvailabilitySlot.objects.filter(id=slot.id, is_booked=True).update(is_booked=False):
+        return False
+    slot.is_booked = False
+    with lock_wait('open_slot_count'):
+        adjust_open_slots(slot.doctor_id, slot.date, 1)
+    invalidate_open_slots(slot.doctor_id)
+    offer_slot_on_commit(slot.id)
+    return True
+
+
+def _appointment_data(booking, slot):
+    return {
+        'patient_name': booking.patient.get_full_name(),
+        'doctor_name': slot.doctor.get_full_name(),
+        'date': slot.date.strftime('%Y-%m-%d'),
+        'time': slot.start_time.strftime('%H:%M')
+    }
+
+
+def cancel_booking(user, booking_id):
+    """
+    Cancel an upcoming booking held by the patient, or with the doctor, in
+    one transaction: the booking is deleted, the slot released and both
+    parties emailed. Raises BookingError or SlotInPast; returns the freed slot.
+    """
+    with transaction.atomic():
+        with lock_wait('booking'):
+            booking = (
+                Booking.objects.select_for_update(of=('self',))
+                .select_related('patient', 'availability_slot__doctor')
+                .filter(Q(patient=user) | Q(availability_slot__doctor=user), id=booking_id)
+                .first()
+            )
+        if booking is None:
+            raise BookingError('Booking not found')
+        slot = booking.availability_slot
+        if slot.date < timezone.now().date():
+            raise SlotInPast()
+
+        email_data = _appointment_data(booking, slot)
+        # Releasing first leaves nothing for the post_delete safety net to do
+        release_slot(slot)
+        booking.delete()
+        queue_emails([
+            {'action': 'BOOKING_CANCELLED', 'to': booking.patient.email, 'data': email_data},
+            {'action': 'BOOKING_CANCELLED', 'to': slot.doctor.email, 'data': email_data},
+        ])
+    return slot
+
+
+def reschedule_booking(patient, booking_id, new_slot_id):
+    """
+    Move a patient's upcoming booking to another open slot with the same
+    doctor in one transaction. The booking row is locked first, then both
+    slots in id order, so concurrent reschedules and bookings cannot
+    deadlock. Raises SlotUnavailable, SlotInPast or BookingError; returns
+    the updated Booking.
+    """
+    now = timezone.now()
+    today = now.date()
+    try:
+        with transaction.atomic():
+            with lock_wait('booking'):
+                booking = (
+                    Booking.objects.select_for_update(of=('self',))
+                    .select_related('patient', 'availability_slot__doctor')
+                    .filter(patient=patient, id=booking_id)
+                    .first()
+                )
+            if booking is None:
+                raise BookingError('Booking not found')
+            old_slot = booking.availability_slot
+            if old_slot.date < today:
+                raise SlotInPast()
+            if old_slot.id == new_slot_id:
+                return booking
+
+            with lock_wait('slot'):
+                slots = {
+                    slot.id: slot for slot in AvailabilitySlot.objects.select_for_update()
+                    .filter(id__in=sorted((old_slot.id, new_slot_id)))
+                    .only('id', 'doctor_id', 'date', 'start_time', 'end_time', 'is_booked', 'held_by_id', 'held_until')
+                    .order_by('id')
+                }
+            new_slot = slots.get(new_slot_id)
+            if new_slot is None or new_slot.is_booked:
+                raise SlotUnavailable()
+            if new_slot.held_until and new_slot.held_until > now and new_slot.held_by_id != patient.id:
+                raise SlotUnavailable()
+            if new_slot.date < today:
+                raise SlotInPast()
+            if new_slot.doctor_id != old_slot.doctor_id:
+                raise BookingError('Appointments can only be moved to another slot with the same doctor')
+            # The row count re-checks the claim where row locks are unsupported
+            if not AvailabilitySlot.objects.filter(
+                unheld(patient.id, now), id=new_slot_id, is_booked=False
+            ).update(is_booked=True, held_by=None, held_until=None):
+                raise SlotUnavailable()
+            AvailabilitySlot.objects.filter(id=old_slot.id).update(is_booked=False)
+            Booking.objects.filter(id=booking.id).update(availability_slot=new_slot_id)
+
+            new_slot.is_booked = True
+            new_slot.doctor = old_slot.doctor
+            booking.availability_slot = new_slot
+            deltas = {(old_slot.doctor_id, old_slot.date): 1}
+            deltas[new_slot.doctor_id, new_slot.date] = deltas.get((new_slot.doctor_id, new_slot.date), 0) - 1
+            with lock_wait('open_slot_count'):
+                adjust_open_slot_counts(deltas)
+            invalidate_open_slots(old_slot.doctor_id)
+
+            email_data = _appointment_data(booking, new_slot)
+            email_data['previous_date'] = old_slot.date.strftime('%Y-%m-%d')
+            email_data['previous_time'] = old_slot.start_time.strftime('%H:%M')
+            queue_emails([
+                {'action': 'BOOKING_RESCHEDULED', 'to': booking.patient.email, 'data': email_data},
+                {'action': 'BOOKING_RESCHEDULED', 'to': old_slot.doctor.email, 'data': email_data},
+            ])
+            queue_calendar_upserts([(booking.patient, booking.id), (old_slot.doctor, booking.id)])
+            offer_slot_on_commit(old_slot.id)
+    except IntegrityError:
+        # A stale booking row still points at the new slot
+        raise SlotUnavailable()
+    return booking
+
+
+def hold_slot(patient, slot_id, minutes=None):
+    """
+    Reserve an open future slot for a patient for SLOT_HOLD_MINUTES so nobody
+    else can book it meanwhile. A patient holds one slot at a time; holding a
+    new one releases the previous hold. Returns the held slot with its doctor,
+    or None if the slot is booked, held by someone else or gone.
+    """
+    now = timezone.now()
+    held_until = now + timedelta(minutes=minutes or settings.SLOT_HOLD_MINUTES)
+    with transaction.atomic():
+        if not AvailabilitySlot.objects.filter(
+            unheld(patient.id, now), id=slot_id, is_booked=False, date__gte=now.date()
+        ).update(held_by=patient, held_until=held_until):
+            return None
+        previous = AvailabilitySlot.objects.filter(held_by=patient).exclude(id=slot_id)
+        previous_doctors = list(previous.values_list('doctor_id', flat=True))
+        if previous_doctors:
+            previous.update(held_by=None, held_until=None)
+        slot = AvailabilitySlot.objects.select_related('doctor').get(id=slot_id)
+        invalidate_open_slots(slot.doctor_id, *previous_doctors)
+    return slot
+
+
+def release_expired_holds():
+    """
+    Clear every lapsed hold with one UPDATE and offer those slots to the
+    waitlist. Lapsed holds already stop blocking bookings; this keeps the
+    hold index small. Returns the number of holds released.
+    """
+    with transaction.atomic():
+        expired = AvailabilitySlot.objects.filter(held_until__lte=timezone.now())
+        doctor_ids = set(expired.order_by().values_list('doctor_id', flat=True).distinct())
+        if not doctor_ids:
+            return 0
+        released = expired.update(held_by=None, held_until=None)
+        transaction.on_commit(lambda: fill_waitlists(doctor_ids))
+    return released
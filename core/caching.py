@@ -0,0 +1,237 @@
+import asyncio
+import time
+from collections import namedtuple
+from datetime import date, datetime, time as dtime, timezone as dt_timezone
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from .models import User, AvailabilitySlot
+
+# Safety net only: the directory is invalidated by signals whenever it changes
+DOCTOR_DIRECTORY_TIMEOUT = 60 * 60
+DOCTOR_DIRECTORY_VERSION_KEY = 'doctor-directory:version'
+
+DirectoryEntry = namedtuple('DirectoryEntry', ['id', 'name', 'specialization'])
+
+# Open-slot listings change on every booking, so keep snapshots short-lived
+OPEN_SLOTS_TIMEOUT = 30
+# Single-flight: how long one worker may own a recomputation, and how long
+# the others wait for its result before querying the database themselves
+OPEN_SLOTS_LOCK_TIMEOUT = 5
+# Bumped whenever the snapshot tuple layout changes
+OPEN_SLOTS_FORMAT = 2
+OPEN_SLOTS_WAIT_SECONDS = 1.0
+OPEN_SLOTS_POLL_SECONDS = 0.05
+
+SlotEntry = namedtuple('SlotEntry', ['id', 'date', 'start_time', 'end_time', 'held_until'], defaults=[None])
+
+
+def _fresh_version():
+    # A version key can be evicted while entries cached under its old values
+    # live on; a clock-based seed never lands back on one of those values
+    return time.time_ns()
+
+
+def _version(key):
+    version = cache.get(key)
+    if version is None:
+        # add() so concurrent workers agree on the first version
+        fresh = _fresh_version()
+        cache.add(key, fresh, timeout=None)
+        version = cache.get(key, fresh)
+    return version
+
+
+async def _aversion(key):
+    version = await cache.aget(key)
+    if version is None:
+        fresh = _fresh_version()
+        await cache.aadd(key, fresh, timeout=None)
+        version = await cache.aget(key, fresh)
+    return version
+
+
+def _bump_version_on_commit(key):
+    def bump():
+        try:
+            cache.incr(key)
+        except ValueError:
+            # The version key was evicted; start a series no stale entry uses
+            cache.add(key, _fresh_version(), timeout=None)
+    transaction.on_commit(bump)
+
+
+def _directory_rows():
+    return User.objects.filter(role='doctor').order_by('last_name', 'first_name', 'id').values_list(
+        'id', 'first_name', 'last_name', 'doctor_profile__specialization'
+    )
+
+
+def _directory_entry(id, first_name, last_name, specialization):
+    return DirectoryEntry(id, f'{first_name} {last_name}'.strip(), specialization or '')
+
+
+def load_doctor_directory():
+    """Read every doctor's id, name and specialization from the database"""
+    return [_directory_entry(*row) for row in _directory_rows()]
+
+
+async def aload_doctor_directory():
+    return [_directory_entry(*row) async for row in _directory_rows()]
+
+
+def get_doctor_directory():
+    """
+    Return the doctor directory, from the cache when possible.
+    Keys carry a version number that invalidation bumps, so every worker
+    sharing the cache switches to fresh data at the same time.
+    """
+    key = f'doctor-directory:v{_version(DOCTOR_DIRECTORY_VERSION_KEY)}'
+    directory = cache.get(key)
+    if directory is None:
+        directory = load_doctor_directory()
+        cache.set(key, directory, DOCTOR_DIRECTORY_TIMEOUT)
+    return directory
+
+
+async def aget_doctor_directory():
+    """Async get_doctor_directory for async views"""
+    key = f'doctor-directory:v{await _aversion(DOCTOR_DIRECTORY_VERSION_KEY)}'
+    directory = await cache.aget(key)
+    if directory is None:
+        directory = await aload_doctor_directory()
+        await cache.aset(key, directory, DOCTOR_DIRECTORY_TIMEOUT)
+    return directory
+
+
+def specializations():
+    """Every specialization in the doctor directory, sorted case-insensitively"""
+    return sorted({d.specialization for d in get_doctor_directory() if d.specialization}, key=str.lower)
+
+
+def specialization_spellings(name):
+    """The directory's spellings of a specialization, matched case-insensitively"""
+    wanted = name.strip().lower()
+    return [s for s in specializations() if s.lower() == wanted]
+
+
+def invalidate_doctor_directory():
+    """
+    Bump the directory version once the current transaction commits.
+    Call this after bulk writes, which do not send model signals.
+    """
+    _bump_version_on_commit(DOCTOR_DIRECTORY_VERSION_KEY)
+
+
+def _seconds(t):
+    return t.hour * 3600 + t.minute * 60 + t.second
+
+
+def _time(seconds):
+    return dtime(seconds // 3600, seconds % 3600 // 60, seconds % 60)
+
+
+def _open_slot_rows(doctor_id):
+    return AvailabilitySlot.objects.filter(
+        doctor_id=doctor_id,
+        is_booked=False,
+        date__gte=timezone.now().date()
+    ).order_by('date', 'start_time').values_list(
+        'id', 'date', 'start_time', 'end_time', 'held_until', 'held_by_id'
+    )
+
+
+def _snapshot_row(id, day, start_time, end_time, held_until, held_by_id):
+    return (id, day.toordinal(), _seconds(start_time), _seconds(end_time),
+            int(held_until.timestamp()) if held_until else 0, held_by_id or 0)
+
+
+def load_open_slots(doctor_id):
+    """
+    Read a doctor's open future slots as compact tuples of ints:
+    (id, date ordinal, start second-of-day, end second-of-day,
+     hold expiry as a POSIX timestamp or 0, holding patient id or 0)
+    """
+    return [_snapshot_row(*row) for row in _open_slot_rows(doctor_id)]
+
+
+async def aload_open_slots(doctor_id):
+    return [_snapshot_row(*row) async for row in _open_slot_rows(doctor_id)]
+
+
+def get_open_slots(doctor_id, patient_id=None):
+    """
+    Return a doctor's open future slots, from a short-lived cached snapshot.
+    On a miss only one worker rebuilds the snapshot; the rest wait briefly for
+    it instead of all hitting the database at once. Slots currently held for
+    anyone but `patient_id` are left out; holds lapse without invalidation.
+    """
+    key = _open_slots_key(doctor_id, _version(f'open-slots:{doctor_id}:version'))
+    snapshot = cache.get(key)
+    if snapshot is None:
+        lock_key = f'{key}:lock'
+        if cache.add(lock_key, 1, OPEN_SLOTS_LOCK_TIMEOUT):
+            try:
+                snapshot = load_open_slots(doctor_id)
+                cache.set(key, snapshot, OPEN_SLOTS_TIMEOUT)
+            finally:
+                cache.delete(lock_key)
+        else:
+            deadline = time.monotonic() + OPEN_SLOTS_WAIT_SECONDS
+            while snapshot is None and time.monotonic() < deadline:
+                time.sleep(OPEN_SLOTS_POLL_SECONDS)
+                snapshot = cache.get(key)
+            if snapshot is None:
+                snapshot = load_open_slots(doctor_id)
+
+    return _slot_entries(snapshot, patient_id)
+
+
+def _open_slots_key(doctor_id, version):
+    return f'open-slots:{doctor_id}:f{OPEN_SLOTS_FORMAT}:v{version}'
+
+
+def _slot_entries(snapshot, patient_id):
+    # The snapshot may have been taken before midnight
+    now = timezone.now()
+    today = now.date().toordinal()
+    timestamp = now.timestamp()
+    return [
+        SlotEntry(
+            id, date.fromordinal(day), _time(start), _time(end),
+            datetime.fromtimestamp(held_until, dt_timezone.utc) if held_until > timestamp else None
+        )
+        for id, day, start, end, held_until, held_by_id in snapshot
+        if day >= today and (held_until <= timestamp or held_by_id == patient_id)
+    ]
+
+
+async def aget_open_slots(doctor_id, patient_id=None):
+    """Async get_open_slots for async views, with the same single-flight rebuild"""
+    key = _open_slots_key(doctor_id, await _aversion(f'open-slots:{doctor_id}:version'))
+    snapshot = await cache.aget(key)
+    if snapshot is None:
+        lock_key = f'{key}:lock'
+        if await cache.aadd(lock_key, 1, OPEN_SLOTS_LOCK_TIMEOUT):
+            try:
+                snapshot = await aload_open_slots(doctor_id)
+                await cache.aset(key, snapshot, OPEN_SLOTS_TIMEOUT)
+            finally:
+                await cache.adelete(lock_key)
+        else:
+            deadline = time.monotonic() + OPEN_SLOTS_WAIT_SECONDS
+            while snapshot is None and time.monotonic() < deadline:
+                await asyncio.sleep(OPEN_SLOTS_POLL_SECONDS)
+                snapshot = await cache.aget(key)
+            if snapshot is None:
+                snapshot = await aload_open_slots(doctor_id)
+    return _slot_entries(snapshot, patient_id)
+
+
+def invalidate_open_slots(*doctor_ids):
+    """
+    Drop cached open-slot snapshots once the current transaction commits.
+    Call this after bulk writes and queryset updates, which send no signals.
+    """
+    for doctor_id in set(doctor_ids):
+        _bump_version_on_commit(f'open-slots:{doctor_id}:version')
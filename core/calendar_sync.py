@@ -0,0 +1,581 @@
+"""
+Background sync of bookings to Google Calendar.
+
+Booking code queues CalendarSyncTask rows in its own transaction, and only
+for people who have connected a calendar. The sync_calendars worker applies
+them later, outside any booking transaction:
+
+  * tasks are claimed in batches and grouped per user; each user's calls go
+    out as Calendar API batch requests of up to CALENDAR_BATCH_LIMIT calls,
+    CALENDAR_SYNC_THREADS users at a time
+  * access tokens are refreshed once and cached per user until they expire
+  * every user (in practice, every busy doctor) gets CALENDAR_SYNC_RATE_PER_USER
+    calls per second across all workers; the rest wait for the next second
+  * pull_calendar_changes reads each calendar incrementally with a sync
+    token, clears event ids whose events were deleted in Google, and re-pushes
+    appointments whose times were edited there (the booking is authoritative)
+
+Event ids are derived from the booking and user, so a create that timed out
+and is retried cannot duplicate the event.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+from email.parser import BytesParser
+from email.policy import HTTP
+from zoneinfo import ZoneInfo
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from requests.adapters import HTTPAdapter
+from .email_service import OUTBOX_MAX_ATTEMPTS, outbox_backoff
+from .models import User, Booking, CalendarSyncState, CalendarSyncTask
+
+# Most calls the Calendar API accepts in one batch request
+CALENDAR_BATCH_LIMIT = 50
+CALENDAR_EVENTS_PATH = '/calendar/v3/calendars/primary/events'
+CALENDAR_BATCH_PATH = '/batch/calendar/v3'
+CALENDAR_CONNECT_TIMEOUT = float(os.getenv('CALENDAR_CONNECT_TIMEOUT', '3.05'))
+CALENDAR_READ_TIMEOUT = float(os.getenv('CALENDAR_READ_TIMEOUT', '30'))
+# Users whose calendars one worker updates at the same time
+CALENDAR_SYNC_THREADS = int(os.getenv('CALENDAR_SYNC_THREADS', '8'))
+# How long a worker owns claimed tasks before another worker may retry them
+CALENDAR_CLAIM_SECONDS = 120
+# Refresh access tokens this many seconds before Google expires them
+TOKEN_EXPIRY_MARGIN_SECONDS = 60
+GOOGLE_TOKEN_URI = 'https://oauth2.googleapis.com/token'
+# Private extended property that ties an event to its booking
+BOOKING_PROPERTY = 'hms_booking'
+
+
+class CalendarSyncError(Exception):
+    pass
+
+
+class CalendarAuthError(CalendarSyncError):
+    """The user's refresh token was rejected; they need to reconnect"""
+
+
+def event_id(booking_id, user_id):
+    # Calendar event ids may only use the characters a-v and 0-9
+    return f'hms{booking_id}u{user_id}'
+
+
+def _connected(user):
+    return bool(user.google_calendar_credentials)
+
+
+def queue_calendar_upserts(entries):
+    """
+    Queue event creates/updates for (user, booking_id) pairs, skipping people
+    without a connected calendar, so the users must have
+    google_calendar_credentials loaded. Call inside the booking's
+    transaction; costs one INSERT, and nothing when nobody is connected.
+    """
+    tasks = [
+        CalendarSyncTask(user_id=user.id, booking_id=booking_id, action='upsert')
+        for user, booking_id in entries
+        if _connected(user)
+    ]
+    if tasks:
+        CalendarSyncTask.objects.bulk_create(tasks)
+
+
+def queue_calendar_deletes(booking, doctor_id, skip_user_id=None):
+    """
+    Queue deletion of a removed booking's events that were already synced.
+    skip_user_id is a user being deleted along with the booking.
+    """
+    tasks = [
+        CalendarSyncTask(user_id=user_id, booking_id=booking.id, action='delete', event_id=stored)
+        for user_id, stored in (
+            (booking.patient_id, booking.patient_calendar_event_id),
+            (doctor_id, booking.doctor_calendar_event_id),
+        )
+        if stored and user_id is not None and user_id != skip_user_id
+    ]
+    if tasks:
+        CalendarSyncTask.objects.bulk_create(tasks)
+
+
+class CalendarClient:
+    """Pooled keep-alive HTTP client for the Calendar API and the OAuth token endpoint"""
+
+    def __init__(self, api_url=None, connect_timeout=CALENDAR_CONNECT_TIMEOUT,
+                 read_timeout=CALENDAR_READ_TIMEOUT, pool_size=CALENDAR_SYNC_THREADS):
+        self._api_url = api_url
+        self.timeout = (connect_timeout, read_timeout)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @property
+    def api_url(self):
+        return (self._api_url or settings.GOOGLE_CALENDAR_API_URL).rstrip('/')
+
+    def refresh_token(self, credentials):
+        """Exchange a refresh token for an access token; returns (token, expires_in)"""
+        try:
+            response = self.session.post(credentials.get('token_uri') or GOOGLE_TOKEN_URI, data={
+                'grant_type': 'refresh_token',
+                'refresh_token': credentials.get('refresh_token', ''),
+                'client_id': credentials.get('client_id', ''),
+                'client_secret': credentials.get('client_secret', ''),
+            }, timeout=self.timeout)
+        except requests.RequestException as e:
+            raise CalendarSyncError(str(e)) from e
+        if response.status_code in (400, 401):
+            raise CalendarAuthError(f'Token refresh rejected: {response.text[:200]}')
+        if response.status_code != 200:
+            raise CalendarSyncError(f'Token endpoint returned HTTP {response.status_code}')
+        payload = response.json()
+        return payload['access_token'], int(payload.get('expires_in', 3600))
+
+    def batch(self, token, calls):
+        """
+        Send up to CALENDAR_BATCH_LIMIT calls, [(method, path, body), ...], as
+        one multipart batch request. Returns [(status, body), ...] in order.
+        """
+        boundary = f'batch_{uuid.uuid4().hex}'
+        parts = []
+        for n, (method, path, body) in enumerate(calls):
+            inner = f'{method} {path} HTTP/1.1\r\n'
+            if body is not None:
+                inner += f'Content-Type: application/json\r\n\r\n{json.dumps(body)}'
+            else:
+                inner += '\r\n'
+            parts.append(
+                f'--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <item{n}>\r\n\r\n{inner}\r\n'
+            )
+        payload = ''.join(parts) + f'--{boundary}--\r\n'
+        try:
+            response = self.session.post(
+                self.api_url + CALENDAR_BATCH_PATH, data=payload.encode(), timeout=self.timeout,
+                headers={'Authorization': f'Bearer {token}',
+                         'Content-Type': f'multipart/mixed; boundary={boundary}'},
+            )
+        except requests.RequestException as e:
+            raise CalendarSyncError(str(e)) from e
+        if response.status_code == 401:
+            raise CalendarAuthError('Access token rejected')
+        if response.status_code != 200:
+            raise CalendarSyncError(f'Batch request returned HTTP {response.status_code}')
+        return _parse_batch_response(response.headers.get('Content-Type', ''), response.content, len(calls))
+
+    def list_events(self, token, params):
+        """One page of events.list; returns (status, body)"""
+        try:
+            response = self.session.get(
+                self.api_url + CALENDAR_EVENTS_PATH, params=params, timeout=self.timeout,
+                headers={'Authorization': f'Bearer {token}'},
+            )
+        except requests.RequestException as e:
+            raise CalendarSyncError(str(e)) from e
+        if response.status_code == 401:
+            raise CalendarAuthError('Access token rejected')
+        return response.status_code, (response.json() if response.content else {})
+
+    def close(self):
+        self.session.close()
+
+
+def _parse_batch_response(content_type, content, expected):
+    message = BytesParser(policy=HTTP).parsebytes(
+        f'Content-Type: {content_type}\r\n\r\n'.encode() + content
+    )
+    results = {}
+    for part in message.iter_parts():
+        content_id = part.get('Content-ID', '')
+        raw = (part.get_payload(decode=True) or b'').replace(b'\r\n', b'\n')
+        head, _, body = raw.partition(b'\n\n')
+        status_line = head.split(b'\n', 1)[0]
+        status = int(status_line.split()[1])
+        # Content-ID is "<response-itemN>"
+        index = int(content_id.strip('<>').rsplit('item', 1)[1])
+        results[index] = (status, json.loads(body) if body.strip() else {})
+    if len(results) != expected:
+        raise CalendarSyncError('Incomplete batch response')
+    return [results[n] for n in range(expected)]
+
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_calendar_client():
+    """Return this process's shared CalendarClient, creating it after fork if needed"""
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _client_lock:
+            if _client is None or _client_pid != pid:
+                _client = CalendarClient()
+                _client_pid = pid
+    return _client
+
+
+def _token_key(user_id):
+    return f'gcal-token:{user_id}'
+
+
+def access_token(user, save=True):
+    """
+    A valid access token for the user's calendar, from the cache when
+    possible. Refreshed tokens are cached until shortly before they expire
+    and stored in the user's credentials, so restarts and other workers reuse
+    them; with save=False the caller saves the updated credentials.
+    """
+    token = cache.get(_token_key(user.id))
+    if token:
+        return token
+    credentials = user.google_calendar_credentials or {}
+    expiry = parse_datetime(credentials.get('expiry') or '')
+    if expiry and timezone.is_naive(expiry):
+        expiry = timezone.make_aware(expiry, dt_timezone.utc)
+    now = timezone.now()
+    if credentials.get('token') and expiry and expiry - now > timedelta(seconds=TOKEN_EXPIRY_MARGIN_SECONDS):
+        token, lifetime = credentials['token'], (expiry - now).total_seconds()
+    else:
+        token, lifetime = get_calendar_client().refresh_token(credentials)
+        expiry = now + timedelta(seconds=lifetime)
+        credentials = {**credentials, 'token': token, 'expiry': expiry.isoformat()}
+        user.google_calendar_credentials = credentials
+        if save:
+            User.objects.filter(id=user.id).update(google_calendar_credentials=credentials)
+    cache.set(_token_key(user.id), token, max(int(lifetime) - TOKEN_EXPIRY_MARGIN_SECONDS, 1))
+    return token
+
+
+def take_quota(user_id, wanted):
+    """
+    Reserve up to `wanted` Calendar API calls from the user's per-second
+    allowance, shared by all workers through the cache. Returns how many
+    were granted.
+    """
+    limit = settings.CALENDAR_SYNC_RATE_PER_USER
+    key = f'gcal-rate:{user_id}:{int(time.time())}'
+    cache.add(key, 0, timeout=2)
+    try:
+        used = cache.incr(key, wanted)
+    except ValueError:
+        cache.add(key, wanted, timeout=2)
+        used = wanted
+    granted = max(0, min(wanted, limit - (used - wanted)))
+    if granted < wanted:
+        # Give back what was not granted
+        cache.decr(key, wanted - granted)
+    return granted
+
+
+def event_body(booking, user_id):
+    slot = booking.availability_slot
+    zone = ZoneInfo(settings.TIME_ZONE)
+    if slot.doctor_id == user_id:
+        summary = f'Appointment with {booking.patient.get_full_name() or booking.patient.username}'
+    else:
+        summary = f'Appointment with Dr. {slot.doctor.get_full_name() or slot.doctor.username}'
+    return {
+        'id': event_id(booking.id, user_id),
+        'summary': summary,
+        'start': {'dateTime': datetime.combine(slot.date, slot.start_time, zone).isoformat(),
+                  'timeZone': settings.TIME_ZONE},
+        'end': {'dateTime': datetime.combine(slot.date, slot.end_time, zone).isoformat(),
+                'timeZone': settings.TIME_ZONE},
+        'extendedProperties': {'private': {BOOKING_PROPERTY: str(booking.id)}},
+    }
+
+
+def _event_field(booking, user_id):
+    if booking.availability_slot.doctor_id == user_id:
+        return 'doctor_calendar_event_id'
+    return 'patient_calendar_event_id'
+
+
+def claim_calendar_batch(batch_size):
+    """Claim up to batch_size due tasks, the same way claim_outbox_batch does"""
+    now = timezone.now()
+    with transaction.atomic():
+        batch = list(
+            CalendarSyncTask.objects.select_for_update(skip_locked=True)
+            .filter(status='pending', next_attempt_at__lte=now)
+            .order_by('next_attempt_at', 'id')[:batch_size]
+        )
+        if batch:
+            CalendarSyncTask.objects.filter(id__in=[t.id for t in batch]).update(
+                next_attempt_at=now + timedelta(seconds=CALENDAR_CLAIM_SECONDS)
+            )
+    return batch
+
+
+class _Outcome:
+    """Collects task results and booking event-id changes for one sync run"""
+
+    def __init__(self):
+        self.done = []
+        self.deferred = []
+        self.retry = {}
+        self.event_ids = {}
+        self.refreshed = []
+
+    def fail(self, task, error):
+        self.retry[task.id] = (task, str(error))
+
+    def merge(self, other):
+        self.done.extend(other.done)
+        self.deferred.extend(other.deferred)
+        self.retry.update(other.retry)
+        self.event_ids.update(other.event_ids)
+        self.refreshed.extend(other.refreshed)
+
+
+def sync_calendar_batch(batch_size=200):
+    """
+    Apply one batch of due calendar tasks. Returns a (synced, deferred,
+    retried, failed) tuple: deferred tasks were over their user's rate limit
+    and run again a second later, retried ones back off exponentially, and
+    failed ones have run out of attempts.
+    """
+    tasks = claim_calendar_batch(batch_size)
+    if not tasks:
+        return 0, 0, 0, 0
+    by_user = defaultdict(list)
+    for task in tasks:
+        by_user[task.user_id].append(task)
+    users = User.objects.only('id', 'google_calendar_credentials').in_bulk(list(by_user))
+    bookings = Booking.objects.select_related('patient', 'availability_slot__doctor').in_bulk(
+        [task.booking_id for task in tasks if task.action == 'upsert']
+    )
+
+    outcome = _Outcome()
+    work = []
+    for user_id, user_tasks in by_user.items():
+        user = users.get(user_id)
+        if user is None or not _connected(user):
+            # Disconnected since the task was queued
+            outcome.done.extend(user_tasks)
+            continue
+        granted = take_quota(user_id, len(user_tasks))
+        outcome.deferred.extend(user_tasks[granted:])
+        if granted:
+            work.append((user, user_tasks[:granted]))
+    if work:
+        # Users' calendars are independent, so their requests overlap; the
+        # threads only make HTTP calls and all writes happen in _apply
+        with ThreadPoolExecutor(max_workers=min(CALENDAR_SYNC_THREADS, len(work))) as pool:
+            for result in pool.map(lambda item: _sync_user(*item, bookings), work):
+                outcome.merge(result)
+    return _apply(outcome)
+
+
+def _sync_user(user, tasks, bookings):
+    outcome = _Outcome()
+    credentials = user.google_calendar_credentials
+    calls = []
+    upserted = set()
+    for task in tasks:
+        if task.action == 'delete':
+            calls.append((task, ('DELETE', f'{CALENDAR_EVENTS_PATH}/{task.event_id}', None)))
+            continue
+        booking = bookings.get(task.booking_id)
+        if booking is None:
+            # Cancelled before it was synced; its delete task has nothing to do
+            outcome.done.append(task)
+            continue
+        if booking.id in upserted:
+            # Queued twice (booked, then rescheduled); one call covers both
+            outcome.done.append(task)
+            continue
+        upserted.add(booking.id)
+        stored = getattr(booking, _event_field(booking, user.id))
+        body = event_body(booking, user.id)
+        if stored:
+            calls.append((task, ('PUT', f'{CALENDAR_EVENTS_PATH}/{stored}', body)))
+        else:
+            calls.append((task, ('POST', CALENDAR_EVENTS_PATH, body)))
+
+    for start in range(0, len(calls), CALENDAR_BATCH_LIMIT):
+        chunk = calls[start:start + CALENDAR_BATCH_LIMIT]
+        try:
+            results = get_calendar_client().batch(access_token(user, save=False), [call for _, call in chunk])
+        except CalendarSyncError as e:
+            if isinstance(e, CalendarAuthError):
+                cache.delete(_token_key(user.id))
+            for task, _ in chunk:
+                outcome.fail(task, e)
+            continue
+        for (task, (method, _, body)), (status, response) in zip(chunk, results):
+            _record(task, method, body, status, response, user.id, bookings, outcome)
+    if user.google_calendar_credentials is not credentials:
+        outcome.refreshed.append(user)
+    return outcome
+
+
+def _record(task, method, body, status, response, user_id, bookings, outcome):
+    if task.action == 'delete':
+        # 404/410: already gone, which is what we wanted
+        if status in (200, 204, 404, 410):
+            outcome.done.append(task)
+        else:
+            outcome.fail(task, f'HTTP {status}: {response}')
+        return
+    booking = bookings[task.booking_id]
+    field = _event_field(booking, user_id)
+    if status in (200, 201) or (method == 'POST' and status == 409):
+        # 409: an earlier attempt already created it; the next run updates it
+        outcome.event_ids[booking.id, field] = (user_id, body['id'])
+        if status == 409:
+            outcome.fail(task, 'Event already existed; updating it')
+        else:
+            outcome.done.append(task)
+    elif method == 'PUT' and status == 404:
+        # Never existed under the stored id: create it on the next run
+        outcome.event_ids[booking.id, field] = (user_id, '')
+        outcome.fail(task, 'Stored event not found; recreating it')
+    else:
+        outcome.fail(task, f'HTTP {status}: {response}')
+
+
+def _apply(outcome):
+    now = timezone.now()
+    with transaction.atomic():
+        if outcome.refreshed:
+            User.objects.bulk_update(outcome.refreshed, ['google_calendar_credentials'])
+        if outcome.event_ids:
+            existing = Booking.objects.select_for_update().in_bulk(
+                list({booking_id for booking_id, _ in outcome.event_ids})
+            )
+            orphans = []
+            for (booking_id, field), (user_id, value) in outcome.event_ids.items():
+                booking = existing.get(booking_id)
+                if booking is not None:
+                    setattr(booking, field, value)
+                elif value:
+                    # Cancelled while its event was being created
+                    orphans.append(CalendarSyncTask(
+                        user_id=user_id, booking_id=booking_id, action='delete', event_id=value
+                    ))
+            if existing:
+                Booking.objects.bulk_update(
+                    list(existing.values()), ['doctor_calendar_event_id', 'patient_calendar_event_id']
+                )
+            if orphans:
+                CalendarSyncTask.objects.bulk_create(orphans)
+        if outcome.done:
+            CalendarSyncTask.objects.filter(id__in=[t.id for t in outcome.done]).update(
+                status='done', attempts=F('attempts') + 1, last_error=''
+            )
+        if outcome.deferred:
+            CalendarSyncTask.objects.filter(id__in=[t.id for t in outcome.deferred]).update(
+                next_attempt_at=now + timedelta(seconds=1)
+            )
+        retried = failed = 0
+        for task, error in outcome.retry.values():
+            attempts = task.attempts + 1
+            status = 'failed' if attempts >= OUTBOX_MAX_ATTEMPTS else 'pending'
+            failed += status == 'failed'
+            retried += status == 'pending'
+            CalendarSyncTask.objects.filter(id=task.id).update(
+                status=status, attempts=attempts, last_error=error[:1000],
+                next_attempt_at=now + timedelta(seconds=outbox_backoff(attempts)),
+            )
+    return len(outcome.done), len(outcome.deferred), retried, failed
+
+
+def pull_calendar_changes(user):
+    """
+    Read what changed in the user's calendar since the last pull, using the
+    stored sync token (a full listing the first time, or when Google expires
+    the token). Appointment events deleted in Google lose their stored id;
+    ones whose times were edited there are queued to be pushed back.
+    Returns the number of booking events that needed attention.
+    """
+    state, _ = CalendarSyncState.objects.get_or_create(user=user)
+    client = get_calendar_client()
+    params = {'syncToken': state.sync_token} if state.sync_token else {'showDeleted': 'true'}
+    changes = {}
+    while True:
+        if not take_quota(user.id, 1):
+            time.sleep(1)
+            continue
+        status, page = client.list_events(access_token(user), params)
+        if status == 410:
+            # Sync token expired: start over with a full listing
+            params, changes = {'showDeleted': 'true'}, {}
+            continue
+        if status != 200:
+            raise CalendarSyncError(f'events.list returned HTTP {status}')
+        for event in page.get('items', []):
+            booking_id = event.get('extendedProperties', {}).get('private', {}).get(BOOKING_PROPERTY)
+            if booking_id and booking_id.isdigit():
+                changes[int(booking_id)] = event
+        if page.get('nextPageToken'):
+            params = {**params, 'pageToken': page['nextPageToken']}
+            continue
+        next_sync_token = page.get('nextSyncToken', '')
+        break
+
+    handled = 0
+    with transaction.atomic():
+        bookings = Booking.objects.select_related('patient', 'availability_slot__doctor').in_bulk(list(changes))
+        cleared, stale = [], []
+        for booking_id, event in changes.items():
+            booking = bookings.get(booking_id)
+            if booking is None:
+                continue
+            field = _event_field(booking, user.id)
+            if getattr(booking, field) != event.get('id'):
+                continue
+            if event.get('status') == 'cancelled':
+                setattr(booking, field, '')
+                cleared.append(booking)
+            elif _moved(event, event_body(booking, user.id)):
+                stale.append(booking)
+        if cleared:
+            Booking.objects.bulk_update(cleared, ['doctor_calendar_event_id', 'patient_calendar_event_id'])
+        if stale:
+            CalendarSyncTask.objects.bulk_create([
+                CalendarSyncTask(user_id=user.id, booking_id=booking.id, action='upsert') for booking in stale
+            ])
+        handled = len(cleared) + len(stale)
+        state.sync_token = next_sync_token
+        state.pulled_at = timezone.now()
+        state.save(update_fields=['sync_token', 'pulled_at'])
+    return handled
+
+
+def _moved(event, expected):
+    for key in ('start', 'end'):
+        actual = parse_datetime(event.get(key, {}).get('dateTime') or '')
+        if actual is None or actual != parse_datetime(expected[key]['dateTime']):
+            return True
+    return False
+
+
+def pull_all_calendars():
+    """
+    Pull changes for every connected calendar. Returns (handled, failures),
+    failures being (user_id, error) pairs for calendars that could not be read.
+    """
+    handled, failures = 0, []
+    users = User.objects.filter(google_calendar_credentials__isnull=False).only('id', 'google_calendar_credentials')
+    for user in users.iterator(chunk_size=500):
+        if not _connected(user):
+            continue
+        try:
+            handled += pull_calendar_changes(user)
+        except CalendarSyncError as e:
+            if isinstance(e, CalendarAuthError):
+                cache.delete(_token_key(user.id))
+            failures.append((user.id, str(e)))
+    return handled, failures
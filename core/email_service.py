@@ -1,22 +1,459 @@
+import asyncio
+import logging
+import random
 import requests
 import os
+import threading
+import time
+import weakref
+import httpx
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from .metrics import record_email
+from .models import EmailOutbox
+
+logger = logging.getLogger(__name__)
 
 SERVERLESS_EMAIL_URL = os.getenv('SERVERLESS_EMAIL_URL', 'http://localhost:3000/dev/send-email')
 
-def send_email(action, to_email, data):
+# HTTP client tuning for calls to the email service
+EMAIL_CONNECT_TIMEOUT = float(os.getenv('EMAIL_CONNECT_TIMEOUT', '3.05'))
+EMAIL_READ_TIMEOUT = float(os.getenv('EMAIL_READ_TIMEOUT', '10'))
+EMAIL_POOL_SIZE = int(os.getenv('EMAIL_POOL_SIZE', '10'))
+EMAIL_MAX_RETRIES = int(os.getenv('EMAIL_MAX_RETRIES', '2'))
+EMAIL_RETRY_BACKOFF = float(os.getenv('EMAIL_RETRY_BACKOFF', '0.2'))
+EMAIL_RETRY_JITTER = float(os.getenv('EMAIL_RETRY_JITTER', '0.2'))
+# Consecutive failures that open the circuit, and how long it stays open
+EMAIL_BREAKER_THRESHOLD = int(os.getenv('EMAIL_BREAKER_THRESHOLD', '5'))
+EMAIL_BREAKER_RESET_SECONDS = float(os.getenv('EMAIL_BREAKER_RESET_SECONDS', '30'))
+
+# Outbox retry policy: exponential backoff capped at one hour
+OUTBOX_BACKOFF_BASE_SECONDS = 30
+OUTBOX_BACKOFF_MAX_SECONDS = 3600
+OUTBOX_MAX_ATTEMPTS = 8
+# How long a worker owns a claimed row before another worker may retry it
+OUTBOX_CLAIM_SECONDS = 120
+
+
+class EmailDeliveryError(Exception):
+    pass
+
+
+class CircuitOpenError(EmailDeliveryError):
+    pass
+
+
+class CircuitBreaker:
     """
-    Send email via serverless function
-    action: 'SIGNUP_WELCOME' or 'BOOKING_CONFIRMATION'
+    Fail fast once the email service has failed `threshold` times in a row.
+    After `reset_timeout` seconds one trial call is let through (half-open);
+    its outcome closes the circuit again or re-opens it.
+    """
+
+    def __init__(self, threshold, reset_timeout):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_in_flight or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def abandon_trial(self):
+        """Free the half-open trial slot after a call that ended without an outcome"""
+        with self._lock:
+            self._trial_in_flight = False
+
+
+class BaseEmailClient:
+    """Circuit breaker and latency/failure counters shared by the email clients"""
+
+    def __init__(self, url, breaker_threshold, breaker_reset):
+        self.url = url
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset)
+        self._lock = threading.Lock()
+        self.counters = {
+            'requests': 0,
+            'failures': 0,
+            'short_circuited': 0,
+            'latency_seconds_total': 0.0,
+            'latency_seconds_max': 0.0,
+        }
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self.counters[key] += amount
+
+    def _record(self, elapsed, failed):
+        with self._lock:
+            self.counters['requests'] += 1
+            self.counters['latency_seconds_total'] += elapsed
+            self.counters['latency_seconds_max'] = max(self.counters['latency_seconds_max'], elapsed)
+            if failed:
+                self.counters['failures'] += 1
+        record_email(elapsed, failed)
+
+    def stats(self):
+        with self._lock:
+            snapshot = dict(self.counters)
+        snapshot['circuit'] = self.breaker.state
+        return snapshot
+
+    def _before_call(self):
+        if not self.breaker.allow():
+            self._count('short_circuited')
+            raise CircuitOpenError('Email service circuit is open')
+
+    def _after_error(self, elapsed, error):
+        self._record(elapsed, failed=True)
+        self.breaker.record_failure()
+        raise EmailDeliveryError(str(error)) from error
+
+    def _after_response(self, elapsed, status_code):
+        failed = status_code != 200
+        self._record(elapsed, failed=failed)
+        # Client errors mean a bad payload, not an unhealthy service
+        if status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        if failed:
+            raise EmailDeliveryError(f"Email service returned HTTP {status_code}")
+
+
+class EmailClient(BaseEmailClient):
+    """
+    Long-lived HTTP client for the email service: a pooled keep-alive session
+    with connect retries (exponential backoff plus jitter), a circuit breaker
+    and latency/failure counters.
+    """
+
+    def __init__(self, url=SERVERLESS_EMAIL_URL,
+                 connect_timeout=EMAIL_CONNECT_TIMEOUT, read_timeout=EMAIL_READ_TIMEOUT,
+                 pool_size=EMAIL_POOL_SIZE, max_retries=EMAIL_MAX_RETRIES,
+                 breaker_threshold=EMAIL_BREAKER_THRESHOLD,
+                 breaker_reset=EMAIL_BREAKER_RESET_SECONDS):
+        super().__init__(url, breaker_threshold, breaker_reset)
+        self.timeout = (connect_timeout, read_timeout)
+        # Sends are not idempotent, so only retry when the request never
+        # reached the function: connect errors, throttling or gateway errors
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=0,
+            status=max_retries,
+            status_forcelist=(429, 502, 503),
+            allowed_methods=frozenset({'POST'}),
+            backoff_factor=EMAIL_RETRY_BACKOFF,
+            backoff_jitter=EMAIL_RETRY_JITTER,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size,
+                              max_retries=retry, pool_block=False)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def post(self, payload):
+        """POST a payload and return the response, raising EmailDeliveryError on failure"""
+        self._before_call()
+        start = time.perf_counter()
+        try:
+            response = self.session.post(self.url, json=payload, timeout=self.timeout)
+        except requests.RequestException as e:
+            self._after_error(time.perf_counter() - start, e)
+        except BaseException:
+            # Not a verdict on the service, but a half-open breaker must not
+            # wait forever for this trial's outcome
+            self.breaker.abandon_trial()
+            raise
+        self._after_response(time.perf_counter() - start, response.status_code)
+        return response
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncEmailClient(BaseEmailClient):
+    """
+    Non-blocking counterpart of EmailClient for async views, built on
+    httpx.AsyncClient: a keep-alive pool, connect retries in the transport,
+    and retries of 429/502/503 with jittered exponential backoff.
+    """
+
+    def __init__(self, url=SERVERLESS_EMAIL_URL,
+                 connect_timeout=EMAIL_CONNECT_TIMEOUT, read_timeout=EMAIL_READ_TIMEOUT,
+                 pool_size=EMAIL_POOL_SIZE, max_retries=EMAIL_MAX_RETRIES,
+                 breaker_threshold=EMAIL_BREAKER_THRESHOLD,
+                 breaker_reset=EMAIL_BREAKER_RESET_SECONDS):
+        super().__init__(url, breaker_threshold, breaker_reset)
+        self.max_retries = max_retries
+        # httpx transports only retry failed connects, which is what we want
+        # for non-idempotent sends
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            transport=httpx.AsyncHTTPTransport(retries=max_retries),
+        )
+
+    async def post(self, payload):
+        """POST a payload and return the response, raising EmailDeliveryError on failure"""
+        self._before_call()
+        start = time.perf_counter()
+        try:
+            for attempt in range(self.max_retries + 1):
+                response = await self.client.post(self.url, json=payload)
+                if response.status_code not in (429, 502, 503) or attempt == self.max_retries:
+                    break
+                await asyncio.sleep(
+                    EMAIL_RETRY_BACKOFF * (2 ** attempt) + random.uniform(0, EMAIL_RETRY_JITTER)
+                )
+        except httpx.HTTPError as e:
+            self._after_error(time.perf_counter() - start, e)
+        except BaseException:
+            # Including cancellation: free the half-open trial slot
+            self.breaker.abandon_trial()
+            raise
+        self._after_response(time.perf_counter() - start, response.status_code)
+        return response
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_email_client():
+    """Return this process's shared EmailClient, creating it after fork if needed"""
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _client_lock:
+            if _client is None or _client_pid != pid:
+                _client = EmailClient()
+                _client_pid = pid
+    return _client
+
+
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_email_client():
+    """Return the AsyncEmailClient for the running event loop"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = AsyncEmailClient()
+    return client
+
+
+def deliver_email(action, to_email, data):
+    """
+    Send email via serverless function, raising EmailDeliveryError on failure
     """
     payload = {
         'action': action,
         'to': to_email,
         'data': data
     }
-    
+    get_email_client().post(payload)
+
+
+def deliver_emails(messages):
+    """
+    Send several emails in one call to the serverless batch endpoint.
+    messages: list of {'action', 'to', 'data'} dicts
+    Returns a list with None for each delivered message and an error string
+    for each rejected one. Raises EmailDeliveryError if the call itself fails.
+    """
+    response = get_email_client().post({'messages': messages})
+    try:
+        results = response.json().get('results', [])
+    except ValueError as e:
+        raise EmailDeliveryError('Email service returned an invalid batch response') from e
+    if len(results) != len(messages):
+        raise EmailDeliveryError('Email service returned an incomplete batch result')
+    return [None if r.get('status') == 'sent' else r.get('error', 'Not sent') for r in results]
+
+
+def send_email(action, to_email, data):
+    """
+    Send email via serverless function
+    action: 'SIGNUP_WELCOME', 'BOOKING_CONFIRMATION', 'BOOKING_SUMMARY',
+            'BOOKING_CANCELLED' or 'BOOKING_RESCHEDULED'
+    """
+    try:
+        deliver_email(action, to_email, data)
+        return True
+    except Exception as e:
+        logger.warning("Email service error: %s", e)
+        return False
+
+
+async def adeliver_email(action, to_email, data):
+    """Async deliver_email for async views; raises EmailDeliveryError on failure"""
+    await get_async_email_client().post({
+        'action': action,
+        'to': to_email,
+        'data': data
+    })
+
+
+async def asend_email(action, to_email, data):
+    """Async send_email: never raises, returns whether the email was sent"""
+    try:
+        await adeliver_email(action, to_email, data)
+        return True
+    except Exception as e:
+        logger.warning("Email service error: %s", e)
+        return False
+
+
+def send_emails(messages):
+    """
+    Send a group of emails (e.g. patient and doctor confirmations) in one call
+    Returns True only if every message was delivered
+    """
     try:
-        response = requests.post(SERVERLESS_EMAIL_URL, json=payload, timeout=10)
-        return response.status_code == 200
+        errors = deliver_emails(messages)
     except Exception as e:
-        print(f"Email service error: {e}")
-        return False
\ No newline at end of file
+        logger.warning("Email service error: %s", e)
+        return False
+    for message, error in zip(messages, errors):
+        if error:
+            logger.warning("Email to %s failed: %s", message['to'], error)
+    return not any(errors)
+
+
+def queue_email(action, to_email, data):
+    """
+    Record an email in the outbox. Call this inside the caller's transaction so
+    the email is only sent if the surrounding work commits.
+    """
+    return EmailOutbox.objects.create(action=action, to_email=to_email, data=data)
+
+
+def queue_emails(messages):
+    """
+    Record several emails, [{'action', 'to', 'data'}, ...], with one INSERT
+    in the caller's transaction.
+    """
+    return EmailOutbox.objects.bulk_create([
+        EmailOutbox(action=m['action'], to_email=m['to'], data=m.get('data', {})) for m in messages
+    ])
+
+
+def outbox_backoff(attempts):
+    """Seconds to wait before retrying a message that has failed `attempts` times."""
+    return min(OUTBOX_BACKOFF_BASE_SECONDS * (2 ** (attempts - 1)), OUTBOX_BACKOFF_MAX_SECONDS)
+
+
+def claim_outbox_batch(batch_size):
+    """
+    Claim up to batch_size due messages. Claimed rows are pushed forward by
+    OUTBOX_CLAIM_SECONDS so concurrent workers skip them, and a crashed worker's
+    rows become due again once the claim lapses.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        batch = list(
+            EmailOutbox.objects.select_for_update(skip_locked=True)
+            .filter(status='pending', next_attempt_at__lte=now)
+            .order_by('next_attempt_at', 'id')[:batch_size]
+        )
+        if batch:
+            EmailOutbox.objects.filter(id__in=[m.id for m in batch]).update(
+                next_attempt_at=now + timedelta(seconds=OUTBOX_CLAIM_SECONDS)
+            )
+    return batch
+
+
+def process_outbox(batch_size=50, max_attempts=OUTBOX_MAX_ATTEMPTS):
+    """
+    Deliver one batch of due outbox messages with a single batch call.
+    While the circuit is open nothing is sent, so the batch is put back
+    until the breaker lets a trial call through, without using an attempt.
+    Returns a (sent, retried, failed) tuple.
+    """
+    batch = claim_outbox_batch(batch_size)
+    if not batch:
+        return 0, 0, 0
+
+    try:
+        errors = deliver_emails([
+            {'action': m.action, 'to': m.to_email, 'data': m.data} for m in batch
+        ])
+    except CircuitOpenError as e:
+        EmailOutbox.objects.filter(id__in=[m.id for m in batch]).update(
+            last_error=str(e),
+            next_attempt_at=timezone.now() + timedelta(seconds=EMAIL_BREAKER_RESET_SECONDS),
+        )
+        return 0, len(batch), 0
+    except Exception as e:
+        errors = [str(e)] * len(batch)
+
+    now = timezone.now()
+    sent_ids = [m.id for m, error in zip(batch, errors) if error is None]
+    if sent_ids:
+        EmailOutbox.objects.filter(id__in=sent_ids).update(
+            status='sent',
+            attempts=F('attempts') + 1,
+            last_error='',
+            sent_at=now,
+        )
+
+    retried = failed = 0
+    for message, error in zip(batch, errors):
+        if error is None:
+            continue
+        attempts = message.attempts + 1
+        if attempts >= max_attempts:
+            status = 'failed'
+            failed += 1
+        else:
+            status = 'pending'
+            retried += 1
+        EmailOutbox.objects.filter(id=message.id).update(
+            status=status,
+            attempts=attempts,
+            last_error=error[:1000],
+            next_attempt_at=now + timedelta(seconds=outbox_backoff(attempts)),
+        )
+    return len(sent_ids), retried, failed
@@ -1,22 +1,35 @@
 from django import forms
 from django.contrib.auth.forms import UserCreationForm
+from django.contrib.auth.hashers import identify_hasher
+from .accounts import create_account, taken_fields, username_taken_message
 from .models import User, DoctorProfile, PatientProfile, AvailabilitySlot
 from django.utils import timezone
 from django.core.exceptions import ValidationError
+from .scheduling import WEEKDAY_CHOICES
 
-class DoctorSignUpForm(UserCreationForm):
+class SignUpForm(UserCreationForm):
+    """
+    Shared signup form. Username and email are checked together in one query
+    (core.accounts.taken_fields), and the database's unique constraints catch
+    signups that race past the check. Subclasses set `role` and define
+    profile(), returning the unsaved profile built from cleaned_data.
+    """
+    role = None
+    
     email = forms.EmailField(
         required=True,
         help_text='Enter a valid email address'
     )
     first_name = forms.CharField(max_length=30, required=True)
     last_name = forms.CharField(max_length=30, required=True)
-    specialization = forms.CharField(max_length=100, required=True)
-    phone = forms.CharField(max_length=15, required=False)
+    
+    # email is a plain form field so model validation does not query its
+    # unique index again; save() copies it onto the user
+    field_order = ('username', 'email', 'first_name', 'last_name', 'password1', 'password2')
     
     class Meta:
         model = User
-        fields = ('username', 'email', 'first_name', 'last_name', 'password1', 'password2')
+        fields = ('username', 'first_name', 'last_name')
         help_texts = {
             'username': 'Required. 150 characters or fewer. Letters, numbers and @/./+/-/_ only.',
         }
@@ -36,89 +49,68 @@ class DoctorSignUpForm(UserCreationForm):
         }
     
     def clean_username(self):
-        username = self.cleaned_data.get('username')
-        if User.objects.filter(username=username).exists():
-            raise ValidationError('This username is already taken. Try: ' + username + str(User.objects.count() + 1))
-        return username
+        # Checked together with the email in clean()
+        return self.cleaned_data.get('username')
+    
+    def clean(self):
+        cleaned_data = super().clean()
+        username = cleaned_data.get('username')
+        email = cleaned_data.get('email')
+        
+        if email:
+            # Lets the password similarity validator compare against it
+            self.instance.email = email
+        
+        if username and email:
+            taken = taken_fields(username, email)
+            if 'username' in taken:
+                self.add_error('username', username_taken_message(username))
+            if 'email' in taken:
+                self.add_error('email', 'An account with this email already exists.')
+        
+        return cleaned_data
     
-    def clean_email(self):
-        email = self.cleaned_data.get('email')
-        if User.objects.filter(email=email).exists():
-            raise ValidationError('An account with this email already exists.')
-        return email
+    def validate_unique(self):
+        # clean() has already checked the username in the same query as the email
+        pass
     
     def save(self, commit=True):
+        """Create the user and profile; raises SignupConflict if a concurrent signup won"""
         user = super().save(commit=False)
-        user.role = 'doctor'
+        user.role = self.role
         user.email = self.cleaned_data['email']
         if commit:
-            user.save()
-            DoctorProfile.objects.create(
-                user=user,
-                specialization=self.cleaned_data['specialization'],
-                phone=self.cleaned_data.get('phone', '')
-            )
+            create_account(user, self.profile())
         return user
 
 
-class PatientSignUpForm(UserCreationForm):
-    email = forms.EmailField(
-        required=True,
-        help_text='Enter a valid email address'
-    )
-    first_name = forms.CharField(max_length=30, required=True)
-    last_name = forms.CharField(max_length=30, required=True)
+class DoctorSignUpForm(SignUpForm):
+    role = 'doctor'
+    
+    specialization = forms.CharField(max_length=100, required=True)
+    phone = forms.CharField(max_length=15, required=False)
+    
+    def profile(self):
+        return DoctorProfile(
+            specialization=self.cleaned_data['specialization'],
+            phone=self.cleaned_data.get('phone', '')
+        )
+
+
+class PatientSignUpForm(SignUpForm):
+    role = 'patient'
+    
     date_of_birth = forms.DateField(
         required=False,
         widget=forms.DateInput(attrs={'type': 'date'})
     )
     phone = forms.CharField(max_length=15, required=False)
     
-    class Meta:
-        model = User
-        fields = ('username', 'email', 'first_name', 'last_name', 'password1', 'password2')
-        help_texts = {
-            'username': 'Required. 150 characters or fewer. Letters, numbers and @/./+/-/_ only.',
-        }
-    
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        # Customize error messages
-        self.fields['username'].error_messages = {
-            'unique': 'This username is already taken. Please choose a different one.',
-            'invalid': 'Username can only contain letters, numbers and @/./+/-/_ characters.',
-            'required': 'Username is required.',
-        }
-        self.fields['email'].error_messages = {
-            'unique': 'An account with this email already exists.',
-            'invalid': 'Please enter a valid email address.',
-            'required': 'Email is required.',
-        }
-    
-    def clean_username(self):
-        username = self.cleaned_data.get('username')
-        if User.objects.filter(username=username).exists():
-            raise ValidationError('This username is already taken. Try: ' + username + str(User.objects.count() + 1))
-        return username
-    
-    def clean_email(self):
-        email = self.cleaned_data.get('email')
-        if User.objects.filter(email=email).exists():
-            raise ValidationError('An account with this email already exists.')
-        return email
-    
-    def save(self, commit=True):
-        user = super().save(commit=False)
-        user.role = 'patient'
-        user.email = self.cleaned_data['email']
-        if commit:
-            user.save()
-            PatientProfile.objects.create(
-                user=user,
-                date_of_birth=self.cleaned_data.get('date_of_birth'),
-                phone=self.cleaned_data.get('phone', '')
-            )
-        return user
+    def profile(self):
+        return PatientProfile(
+            date_of_birth=self.cleaned_data.get('date_of_birth'),
+            phone=self.cleaned_data.get('phone', '')
+        )
 
 
 class AvailabilitySlotForm(forms.ModelForm):
@@ -136,6 +128,10 @@ class AvailabilitySlotForm(forms.ModelForm):
         model = AvailabilitySlot
         fields = ['date', 'start_time', 'end_time']
     
+    def __init__(self, *args, doctor=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.doctor = doctor
+    
     def clean(self):
         cleaned_data = super().clean()
         date = cleaned_data.get('date')
@@ -148,4 +144,211 @@ class AvailabilitySlotForm(forms.ModelForm):
         if start_time and end_time and start_time >= end_time:
             raise forms.ValidationError("End time must be after start time.")
         
-        return cleaned_data
\ No newline at end of file
+        if self.doctor and date and start_time and end_time:
+            overlapping = AvailabilitySlot.objects.filter(
+                doctor=self.doctor,
+                date=date,
+                start_time__lt=end_time,
+                end_time__gt=start_time
+            ).first()
+            if overlapping:
+                raise forms.ValidationError(
+                    f"This slot overlaps your existing slot "
+                    f"{overlapping.start_time:%H:%M}-{overlapping.end_time:%H:%M} on {date}."
+                )
+        
+        return cleaned_data
+
+
+class RecurringAvailabilityForm(forms.Form):
+    SLOT_LENGTH_CHOICES = (
+        (10, '10 minutes'),
+        (15, '15 minutes'),
+        (20, '20 minutes'),
+        (30, '30 minutes'),
+        (45, '45 minutes'),
+        (60, '60 minutes'),
+    )
+    MAX_RANGE_DAYS = 366
+    
+    start_date = forms.DateField(
+        widget=forms.DateInput(attrs={'type': 'date', 'min': timezone.now().date()})
+    )
+    end_date = forms.DateField(
+        widget=forms.DateInput(attrs={'type': 'date', 'min': timezone.now().date()})
+    )
+    weekdays = forms.TypedMultipleChoiceField(
+        choices=WEEKDAY_CHOICES,
+        coerce=int,
+        initial=[0, 1, 2, 3, 4],
+        widget=forms.CheckboxSelectMultiple
+    )
+    day_start = forms.TimeField(
+        widget=forms.TimeInput(attrs={'type': 'time'})
+    )
+    day_end = forms.TimeField(
+        widget=forms.TimeInput(attrs={'type': 'time'})
+    )
+    slot_minutes = forms.TypedChoiceField(
+        choices=SLOT_LENGTH_CHOICES,
+        coerce=int,
+        initial=15,
+        label='Slot length'
+    )
+    
+    def clean(self):
+        cleaned_data = super().clean()
+        start_date = cleaned_data.get('start_date')
+        end_date = cleaned_data.get('end_date')
+        day_start = cleaned_data.get('day_start')
+        day_end = cleaned_data.get('day_end')
+        
+        if start_date and start_date < timezone.now().date():
+            raise forms.ValidationError("Cannot create slots in the past.")
+        
+        if start_date and end_date:
+            if end_date < start_date:
+                raise forms.ValidationError("End date must not be before start date.")
+            if (end_date - start_date).days >= self.MAX_RANGE_DAYS:
+                raise forms.ValidationError(f"Schedules can cover at most {self.MAX_RANGE_DAYS} days.")
+        
+        if day_start and day_end and day_start >= day_end:
+            raise forms.ValidationError("Day end time must be after day start time.")
+        
+        return cleaned_data
+
+
+class SlotWindowForm(forms.Form):
+    from_date = forms.DateField(
+        required=False,
+        label='From',
+        widget=forms.DateInput(attrs={'type': 'date'})
+    )
+    to_date = forms.DateField(
+        required=False,
+        label='To',
+        widget=forms.DateInput(attrs={'type': 'date'})
+    )
+    
+    def clean(self):
+        cleaned_data = super().clean()
+        from_date = cleaned_data.get('from_date')
+        to_date = cleaned_data.get('to_date')
+        
+        if from_date and to_date and to_date < from_date:
+            raise forms.ValidationError("'To' date must not be before 'From' date.")
+        
+        return cleaned_data
+
+
+class WaitlistForm(forms.Form):
+    MAX_RANGE_DAYS = 90
+    
+    start_date = forms.DateField(
+        label='Earliest date',
+        widget=forms.DateInput(attrs={'type': 'date', 'min': timezone.now().date()})
+    )
+    end_date = forms.DateField(
+        label='Latest date',
+        widget=forms.DateInput(attrs={'type': 'date', 'min': timezone.now().date()})
+    )
+    
+    def clean(self):
+        cleaned_data = super().clean()
+        start_date = cleaned_data.get('start_date')
+        end_date = cleaned_data.get('end_date')
+        
+        if start_date and start_date < timezone.now().date():
+            raise forms.ValidationError("Cannot wait for dates in the past.")
+        
+        if start_date and end_date:
+            if end_date < start_date:
+                raise forms.ValidationError("Latest date must not be before earliest date.")
+            if (end_date - start_date).days >= self.MAX_RANGE_DAYS:
+                raise forms.ValidationError(f"You can wait for at most {self.MAX_RANGE_DAYS} days.")
+        
+        return cleaned_data
+
+
+class UserImportForm(forms.Form):
+    """
+    Validates one row of a bulk user import (see core.importing). Uniqueness
+    is checked by the importer, one query per chunk, not per row. Doctor rows
+    may carry a recurring schedule: weekdays ("0,1,2,3,4"), day_start, day_end
+    and slot_minutes.
+    """
+    username = forms.CharField(max_length=150, validators=[User.username_validator])
+    email = forms.EmailField()
+    first_name = forms.CharField(max_length=30)
+    last_name = forms.CharField(max_length=30)
+    role = forms.ChoiceField(choices=User.ROLE_CHOICES)
+    password = forms.CharField(required=False, strip=False)
+    password_hash = forms.CharField(required=False, max_length=128)
+    specialization = forms.CharField(max_length=100, required=False)
+    phone = forms.CharField(max_length=15, required=False)
+    date_of_birth = forms.DateField(required=False)
+    weekdays = forms.CharField(required=False)
+    day_start = forms.TimeField(required=False)
+    day_end = forms.TimeField(required=False)
+    slot_minutes = forms.TypedChoiceField(
+        choices=RecurringAvailabilityForm.SLOT_LENGTH_CHOICES, coerce=int, required=False, empty_value=None
+    )
+    
+    SCHEDULE_FIELDS = ('weekdays', 'day_start', 'day_end', 'slot_minutes')
+    
+    def clean_password_hash(self):
+        password_hash = self.cleaned_data.get('password_hash')
+        if password_hash:
+            try:
+                identify_hasher(password_hash)
+            except ValueError:
+                raise ValidationError('Not a recognised password hash.')
+        return password_hash
+    
+    def clean_weekdays(self):
+        weekdays = self.data.get('weekdays')
+        if weekdays in (None, ''):
+            return None
+        if isinstance(weekdays, str):
+            weekdays = weekdays.split(',')
+        try:
+            weekdays = sorted({int(day) for day in weekdays})
+        except (TypeError, ValueError):
+            raise ValidationError('Weekdays must be numbers, Monday=0.')
+        if not weekdays or weekdays[0] < 0 or weekdays[-1] > 6:
+            raise ValidationError('Weekdays must be between 0 (Monday) and 6 (Sunday).')
+        return tuple(weekdays)
+    
+    def clean(self):
+        cleaned_data = super().clean()
+        role = cleaned_data.get('role')
+        schedule = [cleaned_data.get(field) for field in self.SCHEDULE_FIELDS]
+        
+        if role == 'doctor' and not cleaned_data.get('specialization'):
+            self.add_error('specialization', 'Doctors need a specialization.')
+        
+        if cleaned_data.get('password') and cleaned_data.get('password_hash'):
+            raise forms.ValidationError("Give either a password or a password hash, not both.")
+        
+        if any(value is not None for value in schedule):
+            if role != 'doctor':
+                raise forms.ValidationError("Only doctors can have a schedule.")
+            if any(value is None for value in schedule):
+                raise forms.ValidationError("A schedule needs weekdays, day_start, day_end and slot_minutes.")
+            if cleaned_data['day_start'] >= cleaned_data['day_end']:
+                raise forms.ValidationError("Day end time must be after day start time.")
+        
+        return cleaned_data
+
+
+class EarliestSlotsForm(forms.Form):
+    specialization = forms.ChoiceField()
+    after = forms.DateField(
+        label='From',
+        required=False,
+        widget=forms.DateInput(attrs={'type': 'date'})
+    )
+    
+    def __init__(self, *args, specializations=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['specialization'].choices = [(s, s) for s in specializations]
@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+
+class TunablePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    PBKDF2-SHA256 with the iteration count taken from
+    settings.PASSWORD_HASH_ITERATIONS (Django's default when 0). Hashes keep the standard
+    pbkdf2_sha256 format, so existing passwords verify unchanged; when the
+    count changes, Django rehashes each password at the new cost on the
+    user's next successful login (must_update compares iterations).
+    """
+
+    @property
+    def iterations(self):
+        return settings.PASSWORD_HASH_ITERATIONS or PBKDF2PasswordHasher.iterations
@@ -0,0 +1,180 @@
+"""
+Bulk import of doctors and patients from CSV or NDJSON.
+
+Rows are read lazily and handled in chunks of IMPORT_BATCH_SIZE: each row is
+validated with UserImportForm, usernames and emails are checked against the
+database with one query per chunk, and users, profiles and welcome emails
+are written with bulk INSERTs in one transaction per chunk. Memory is bounded
+by the chunk size, not the file size.
+"""
+import csv
+import json
+from collections import defaultdict
+from itertools import islice
+from django.contrib.auth.hashers import make_password
+from django.db import IntegrityError, transaction
+from .accounts import matching_accounts
+from .caching import invalidate_doctor_directory
+from .email_service import queue_emails
+from .forms import UserImportForm
+from .models import User, DoctorProfile, PatientProfile
+from .scheduling import generate_availability
+
+# Rows validated and inserted per transaction
+IMPORT_BATCH_SIZE = 1000
+# Row errors kept for the report; later ones are only counted
+MAX_REPORTED_ERRORS = 100
+
+
+class ImportResult:
+    """Counts and the first MAX_REPORTED_ERRORS (line, message) row errors of an import"""
+
+    def __init__(self):
+        self.created = 0
+        self.skipped = 0
+        self.slots_created = 0
+        self.errors = []
+
+    def error(self, line, message):
+        self.skipped += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+
+def read_rows(stream, fmt):
+    """
+    Yield (line_number, row) for each record of a CSV (with a header row) or
+    NDJSON stream. Unparseable NDJSON lines are yielded with row=None.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            # Empty cells mean "not given", the same as a missing NDJSON key
+            yield reader.line_num, {key: value for key, value in row.items() if value not in ('', None)}
+        return
+    for number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield number, row if isinstance(row, dict) else None
+
+
+def import_users(rows, role=None, schedule_dates=None, send_welcome=True, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Create users and their profiles from (line_number, row) pairs.
+    role fills in rows without a role column. With schedule_dates, a
+    (start_date, end_date) pair, doctors whose row has a schedule get
+    availability slots generated for that range once all users are in.
+    Returns an ImportResult.
+    """
+    result = ImportResult()
+    schedules = defaultdict(list)
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, batch_size))
+        if not chunk:
+            break
+        _import_chunk(chunk, role, send_welcome, result, schedules)
+
+    if schedule_dates and schedules:
+        start_date, end_date = schedule_dates
+        for (weekdays, day_start, day_end, slot_minutes), doctor_ids in schedules.items():
+            created, _ = generate_availability(
+                doctor_ids, start_date, end_date, weekdays, day_start, day_end, slot_minutes
+            )
+            result.slots_created += created
+    return result
+
+
+def _validate_chunk(chunk, role, result):
+    rows = {}
+    emails = set()
+    for line, row in chunk:
+        if row is None:
+            result.error(line, 'Not a JSON object')
+            continue
+        if role and not row.get('role'):
+            row = {**row, 'role': role}
+        form = UserImportForm(row)
+        if not form.is_valid():
+            errors = '; '.join(f'{field}: {" ".join(messages)}' for field, messages in form.errors.items())
+            result.error(line, errors)
+            continue
+        data = form.cleaned_data
+        email = data['email'].lower()
+        if data['username'] in rows or email in emails:
+            result.error(line, 'Duplicate username or email earlier in the file')
+            continue
+        rows[data['username']] = (line, data)
+        emails.add(email)
+
+    # One query per chunk for usernames and emails that are already taken
+    taken = matching_accounts(rows, emails)
+    taken_names, taken_emails = set(), set()
+    for username, email in taken:
+        taken_names.add(username)
+        taken_emails.add(email)
+
+    valid = []
+    for username, (line, data) in rows.items():
+        if username in taken_names:
+            result.error(line, f'Username {username} already exists')
+        elif data['email'].lower() in taken_emails:
+            result.error(line, f'An account with {data["email"]} already exists')
+        else:
+            valid.append((line, data))
+    return valid
+
+
+def _import_chunk(chunk, role, send_welcome, result, schedules):
+    valid = _validate_chunk(chunk, role, result)
+    if not valid:
+        return
+    users = [
+        User(
+            username=data['username'], email=data['email'], role=data['role'],
+            first_name=data['first_name'], last_name=data['last_name'],
+            # Without a password the account is unusable until one is set
+            password=data['password_hash'] or make_password(data['password'] or None),
+        )
+        for _, data in valid
+    ]
+    try:
+        with transaction.atomic():
+            User.objects.bulk_create(users)
+            if users[0].pk is None:
+                # Backends that cannot return ids from a bulk INSERT
+                ids = dict(User.objects.filter(username__in=[u.username for u in users]).values_list('username', 'id'))
+                for user in users:
+                    user.pk = ids[user.username]
+            DoctorProfile.objects.bulk_create([
+                DoctorProfile(user=user, specialization=data['specialization'], phone=data['phone'])
+                for user, (_, data) in zip(users, valid) if data['role'] == 'doctor'
+            ])
+            PatientProfile.objects.bulk_create([
+                PatientProfile(user=user, date_of_birth=data['date_of_birth'], phone=data['phone'])
+                for user, (_, data) in zip(users, valid) if data['role'] == 'patient'
+            ])
+            if any(data['role'] == 'doctor' for _, data in valid):
+                # bulk_create sends no signals
+                invalidate_doctor_directory()
+            if send_welcome:
+                queue_emails([
+                    {'action': 'SIGNUP_WELCOME', 'to': user.email,
+                     'data': {'name': user.get_full_name(), 'role': user.get_role_display()}}
+                    for user in users
+                ])
+    except IntegrityError:
+        # A signup raced the uniqueness check; nothing in this chunk was kept
+        for line, _ in valid:
+            result.error(line, 'Conflicted with a concurrent signup; run the import again for this row')
+        return
+
+    result.created += len(users)
+    for user, (_, data) in zip(users, valid):
+        if data['weekdays'] is not None:
+            key = tuple(data[field] for field in UserImportForm.SCHEDULE_FIELDS)
+            schedules[key].append(user.pk)
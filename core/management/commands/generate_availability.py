@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+from core.forms import RecurringAvailabilityForm
+from core.models import User
+from core.scheduling import generate_availability, SLOT_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Generate recurring availability slots for one or more doctors'
+
+    def add_arguments(self, parser):
+        doctors = parser.add_mutually_exclusive_group(required=True)
+        doctors.add_argument('--doctor', type=int, action='append', dest='doctor_ids',
+                             help='Doctor user id (repeatable)')
+        doctors.add_argument('--all-doctors', action='store_true')
+        parser.add_argument('--start-date', required=True, help='YYYY-MM-DD')
+        parser.add_argument('--end-date', required=True, help='YYYY-MM-DD')
+        parser.add_argument('--weekdays', default='0,1,2,3,4',
+                            help='Comma separated weekday numbers, Monday=0')
+        parser.add_argument('--day-start', default='09:00')
+        parser.add_argument('--day-end', default='17:00')
+        parser.add_argument('--slot-minutes', type=int, default=15)
+        parser.add_argument('--batch-size', type=int, default=SLOT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        form = RecurringAvailabilityForm({
+            'start_date': options['start_date'],
+            'end_date': options['end_date'],
+            'weekdays': options['weekdays'].split(','),
+            'day_start': options['day_start'],
+            'day_end': options['day_end'],
+            'slot_minutes': options['slot_minutes'],
+        })
+        if not form.is_valid():
+            raise CommandError(form.errors.as_text())
+
+        doctors = User.objects.filter(role='doctor')
+        if not options['all_doctors']:
+            doctors = doctors.filter(id__in=options['doctor_ids'])
+        doctor_ids = list(doctors.values_list('id', flat=True))
+        if not doctor_ids:
+            raise CommandError('No matching doctors found')
+
+        created, skipped = generate_availability(
+            doctor_ids, batch_size=options['batch_size'], **form.cleaned_data
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"{created} slots created, {skipped} skipped for {len(doctor_ids)} doctors"
+        ))
@@ -0,0 +1,48 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from core.importing import IMPORT_BATCH_SIZE, import_users, read_rows
+
+
+class Command(BaseCommand):
+    help = 'Bulk import doctors and patients from a CSV or NDJSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV (with a header row) or NDJSON file; "-" reads stdin')
+        parser.add_argument('--format', choices=['csv', 'ndjson'],
+                            help='Defaults to the file extension (.csv, otherwise NDJSON)')
+        parser.add_argument('--role', choices=['doctor', 'patient'],
+                            help='Role for rows without a role column')
+        parser.add_argument('--schedule-start', help='YYYY-MM-DD; generate doctor schedules from this date')
+        parser.add_argument('--schedule-end', help='YYYY-MM-DD; last date of generated schedules')
+        parser.add_argument('--no-welcome-email', action='store_true')
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('csv' if path.lower().endswith('.csv') else 'ndjson')
+
+        schedule_dates = None
+        if options['schedule_start'] or options['schedule_end']:
+            schedule_dates = (parse_date(options['schedule_start'] or ''), parse_date(options['schedule_end'] or ''))
+            if None in schedule_dates or schedule_dates[1] < schedule_dates[0]:
+                raise CommandError('--schedule-start and --schedule-end must both be dates, in order')
+
+        try:
+            stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        except OSError as e:
+            raise CommandError(str(e))
+        with stream:
+            result = import_users(
+                read_rows(stream, fmt), role=options['role'], schedule_dates=schedule_dates,
+                send_welcome=not options['no_welcome_email'], batch_size=options['batch_size']
+            )
+
+        for line, message in sorted(result.errors):
+            self.stderr.write(f'line {line}: {message}')
+        if result.skipped > len(result.errors):
+            self.stderr.write(f'... and {result.skipped - len(result.errors)} more')
+        self.stdout.write(self.style.SUCCESS(
+            f'{result.created} users created, {result.skipped} rows skipped, '
+            f'{result.slots_created} slots created'
+        ))
@@ -0,0 +1,27 @@
+import time
+from django.core.management.base import BaseCommand
+from core.email_service import process_outbox, OUTBOX_MAX_ATTEMPTS
+
+
+class Command(BaseCommand):
+    help = 'Deliver queued emails from the outbox, retrying failures with exponential backoff'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--max-attempts', type=int, default=OUTBOX_MAX_ATTEMPTS)
+        parser.add_argument('--interval', type=float, default=2.0,
+                            help='Seconds to sleep when the outbox is empty')
+        parser.add_argument('--once', action='store_true',
+                            help='Drain everything that is currently due, then exit')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        while True:
+            sent, retried, failed = process_outbox(batch_size, options['max_attempts'])
+            processed = sent + retried + failed
+            if processed:
+                self.stdout.write(f"Sent {sent}, retrying {retried}, failed {failed}")
+            if processed < batch_size:
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
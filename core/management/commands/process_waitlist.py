@@ -0,0 +1,21 @@
+import time
+from django.core.management.base import BaseCommand
+from core.waitlist import fill_waitlists
+
+
+class Command(BaseCommand):
+    help = 'Assign open slots to waiting patients, e.g. after bulk slot generation or imports'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--doctor', type=int, action='append', dest='doctor_ids',
+                            help='Doctor user id (repeatable); defaults to every doctor with a waitlist')
+        parser.add_argument('--interval', type=float,
+                            help='Keep running, draining the queues every INTERVAL seconds')
+
+    def handle(self, *args, **options):
+        while True:
+            assigned = fill_waitlists(options['doctor_ids'])
+            self.stdout.write(self.style.SUCCESS(f'{assigned} waitlisted patients booked'))
+            if options['interval'] is None:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from core.availability import refresh_open_slot_counts
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the per-doctor per-day open slot counters from the slot table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--doctor', type=int, action='append', dest='doctor_ids',
+                            help='Doctor user id (repeatable); defaults to all doctors')
+
+    def handle(self, *args, **options):
+        refresh_open_slot_counts(options['doctor_ids'])
+        self.stdout.write(self.style.SUCCESS('Open slot counters rebuilt'))
@@ -0,0 +1,22 @@
+import time
+from django.core.management.base import BaseCommand
+from core.booking import release_expired_holds
+
+
+class Command(BaseCommand):
+    help = 'Release lapsed slot holds in bulk and offer the slots to waiting patients'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=30.0,
+                            help='Seconds between sweeps')
+        parser.add_argument('--once', action='store_true',
+                            help='Sweep once, then exit')
+
+    def handle(self, *args, **options):
+        while True:
+            released = release_expired_holds()
+            if released:
+                self.stdout.write(f"Released {released} expired holds")
+            if options['once']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+from core.models import User
+from core.seeding import SEED_BATCH_SIZE, SEED_DAY_START, seed_load
+
+
+class Command(BaseCommand):
+    help = 'Generate synthetic doctors, patients, slots and bookings for load testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--doctors', type=int, default=1000)
+        parser.add_argument('--patients', type=int, default=100000)
+        parser.add_argument('--days', type=int, default=30, help='Days of future slots, from today')
+        parser.add_argument('--past-days', type=int, default=30, help='Days of past slots (booking history)')
+        parser.add_argument('--slots-per-day', type=int, default=16)
+        parser.add_argument('--slot-minutes', type=int, default=30)
+        parser.add_argument('--booked', type=float, default=0.6, help='Fraction of slots booked')
+        parser.add_argument('--prefix', default='load', help='Username prefix of the generated users')
+        parser.add_argument('--password', default='load-test-password', help='Password of every generated user')
+        parser.add_argument('--seed', type=int, default=1, help='Random seed')
+        parser.add_argument('--batch-size', type=int, default=SEED_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        if not 0 <= options['booked'] <= 1:
+            raise CommandError('--booked must be between 0 and 1')
+        if min(options['doctors'], options['patients'], options['days'], options['past_days']) < 0:
+            raise CommandError('Counts must not be negative')
+        if options['slots_per_day'] < 0 or options['slot_minutes'] < 1:
+            raise CommandError('--slots-per-day must not be negative and --slot-minutes must be positive')
+        minutes_left = 24 * 60 - (SEED_DAY_START.hour * 60 + SEED_DAY_START.minute)
+        # A slot ending at midnight would end at 00:00, before it starts
+        if options['slots_per_day'] * options['slot_minutes'] >= minutes_left:
+            raise CommandError(
+                f'{options["slots_per_day"]} slots of {options["slot_minutes"]} minutes from '
+                f'{SEED_DAY_START:%H:%M} reach midnight'
+            )
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=f'{prefix}-').exists():
+            raise CommandError(f'Users named "{prefix}-..." already exist; pass another --prefix')
+
+        def progress(result):
+            self.stdout.write(
+                f'{result.patients} patients, {result.slots} slots, {result.bookings} bookings', ending='\r'
+            )
+
+        result = seed_load(
+            doctors=options['doctors'], patients=options['patients'], days=options['days'],
+            past_days=options['past_days'], slots_per_day=options['slots_per_day'],
+            slot_minutes=options['slot_minutes'], booked=options['booked'], prefix=prefix,
+            password=options['password'], rng_seed=options['seed'], batch_size=options['batch_size'],
+            progress=progress if options['verbosity'] > 0 else None,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'{result.doctors} doctors, {result.patients} patients, {result.slots} slots '
+            f'and {result.bookings} bookings created'
+        ))
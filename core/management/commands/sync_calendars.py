@@ -0,0 +1,38 @@
+import time
+from django.core.management.base import BaseCommand
+from core.calendar_sync import pull_all_calendars, sync_calendar_batch
+
+
+class Command(BaseCommand):
+    help = 'Push queued booking changes to Google Calendar and pull back edits made there'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--interval', type=float, default=2.0,
+                            help='Seconds to sleep when nothing is due')
+        parser.add_argument('--pull-interval', type=float, default=300.0,
+                            help='Seconds between incremental pulls of every connected calendar')
+        parser.add_argument('--no-pull', action='store_true',
+                            help='Only push queued changes')
+        parser.add_argument('--once', action='store_true',
+                            help='Push everything that is currently due (and pull once), then exit')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        next_pull = time.monotonic()
+        while True:
+            if not options['no_pull'] and time.monotonic() >= next_pull:
+                handled, failures = pull_all_calendars()
+                for user_id, error in failures:
+                    self.stderr.write(f"Pull failed for user {user_id}: {error}")
+                if handled:
+                    self.stdout.write(f"Pulled {handled} changed appointment events")
+                next_pull = time.monotonic() + options['pull_interval']
+            synced, deferred, retried, failed = sync_calendar_batch(batch_size)
+            processed = synced + deferred + retried + failed
+            if processed:
+                self.stdout.write(f"Synced {synced}, deferred {deferred}, retrying {retried}, failed {failed}")
+            if processed < batch_size:
+                if options['once'] and not deferred:
+                    break
+                time.sleep(1 if deferred else options['interval'])
@@ -0,0 +1,238 @@
+"""
+In-process request, query and booking metrics.
+
+Histograms and counters live in this process and are rendered in the
+Prometheus text format by the /metrics view; with several worker processes
+each one reports its own numbers, so scrape every worker (or sum them).
+
+MetricsMiddleware opens a RequestTimings for each request. The database
+execute wrapper, the email client and lock_wait() add to it, so the
+middleware can record per-view totals and send them back in a
+Server-Timing header.
+"""
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from math import inf
+from time import perf_counter
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+LOCK_WAIT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+REGISTRY = []
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _snapshot(self):
+        with self._lock:
+            return [(labels, self._copy(series)) for labels, series in sorted(self._series.items())]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        for labels, series in self._snapshot():
+            pairs = list(zip(self.labelnames, labels))
+            for suffix, extra, value in self._samples(series):
+                lines.append(f'{self.name}{suffix}{_format_labels(pairs + extra)} {_format_value(value)}')
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._series[labels] = self._series.get(labels, 0) + amount
+
+    def value(self, *labels):
+        with self._lock:
+            return self._series.get(labels, 0)
+
+    def _copy(self, series):
+        return series
+
+    def _samples(self, series):
+        yield '', [], series
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        # Bucket i counts values in (buckets[i - 1], buckets[i]]; the last is +Inf
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def count(self, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            return sum(series[0]) if series else 0
+
+    def _copy(self, series):
+        return list(series[0]), series[1]
+
+    def _samples(self, series):
+        counts, total = series
+        cumulative = 0
+        for bound, count in zip(self.buckets + (inf,), counts):
+            cumulative += count
+            yield '_bucket', [('le', _format_value(float(bound)))], cumulative
+        yield '_sum', [], total
+        yield '_count', [], cumulative
+
+
+def render_metrics():
+    """Every registered metric in the Prometheus text exposition format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+REQUEST_LATENCY = Histogram(
+    'hms_request_duration_seconds', 'Time to produce a response, by view, method and status',
+    ('view', 'method', 'status')
+)
+REQUEST_EXCEPTIONS = Counter(
+    'hms_request_exceptions_total', 'Exceptions raised by views, by view and exception class',
+    ('view', 'exception')
+)
+REQUEST_DB_QUERIES = Histogram(
+    'hms_request_db_queries', 'Database queries run per request, by view', ('view',),
+    buckets=QUERY_COUNT_BUCKETS
+)
+REQUEST_DB_TIME = Histogram(
+    'hms_request_db_duration_seconds', 'Time spent in database queries per request, by view', ('view',)
+)
+EMAIL_LATENCY = Histogram(
+    'hms_email_request_duration_seconds', 'Latency of calls to the email service, by outcome', ('outcome',)
+)
+LOCK_WAIT = Histogram(
+    'hms_booking_lock_wait_seconds',
+    'Time booking transactions spend on statements that take row locks, by locked row',
+    ('lock',), buckets=LOCK_WAIT_BUCKETS
+)
+
+
+class RequestTimings:
+    """What one request has spent so far on the database, row locks and email"""
+    __slots__ = ('db_queries', 'db_seconds', 'lock_seconds', 'email_seconds')
+
+    def __init__(self):
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self.lock_seconds = 0.0
+        self.email_seconds = 0.0
+
+    def server_timing(self, total_seconds):
+        """The Server-Timing header value, in milliseconds"""
+        entries = [
+            f'total;dur={total_seconds * 1000:.2f}',
+            f'db;dur={self.db_seconds * 1000:.2f};desc="{self.db_queries} queries"',
+        ]
+        if self.lock_seconds:
+            entries.append(f'lock;dur={self.lock_seconds * 1000:.2f}')
+        if self.email_seconds:
+            entries.append(f'email;dur={self.email_seconds * 1000:.2f}')
+        return ', '.join(entries)
+
+
+# The timings of the request being served in this context, if any. Context
+# variables follow the request into sync_to_async threads.
+_current = ContextVar('hms_request_timings', default=None)
+
+
+def start_request():
+    """Begin collecting timings for a request; returns (timings, token for end_request)"""
+    timings = RequestTimings()
+    return timings, _current.set(timings)
+
+
+def end_request(token):
+    _current.reset(token)
+
+
+def time_query(execute, sql, params, many, context):
+    """
+    Database execute wrapper (installed on every connection) that adds each
+    query's time to the current request. Outside requests it only calls through.
+    """
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.db_queries += 1
+        timings.db_seconds += perf_counter() - start
+
+
+def install_query_timer(sender, connection, **kwargs):
+    """connection_created receiver: put time_query on the connection once"""
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+@contextmanager
+def lock_wait(lock):
+    """
+    Time a statement that takes row locks (SELECT ... FOR UPDATE, or a
+    conditional UPDATE). Under contention nearly all of it is the wait.
+    """
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = perf_counter() - start
+        LOCK_WAIT.observe(elapsed, lock)
+        timings = _current.get()
+        if timings is not None:
+            timings.lock_seconds += elapsed
+
+
+def record_email(elapsed, failed):
+    EMAIL_LATENCY.observe(elapsed, 'error' if failed else 'ok')
+    timings = _current.get()
+    if timings is not None:
+        timings.email_seconds += elapsed
@@ -0,0 +1,65 @@
+from time import perf_counter
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from .metrics import (
+    REQUEST_DB_QUERIES, REQUEST_DB_TIME, REQUEST_EXCEPTIONS, REQUEST_LATENCY, end_request, start_request,
+)
+
+# Anything else is recorded as "other", so clients cannot mint new series
+KNOWN_METHODS = frozenset({'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'})
+
+
+def _view_name(request):
+    match = request.resolver_match
+    return match.view_name if match else 'unmatched'
+
+
+class MetricsMiddleware:
+    """
+    Record each request's latency and its database queries and time, by
+    view, and report them (plus row-lock and email time) in a Server-Timing
+    header. Put it first in MIDDLEWARE so it also times the others. For
+    streaming responses the latency ends when streaming starts.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.server_timing = settings.METRICS_SERVER_TIMING
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        start = perf_counter()
+        timings, token = start_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            end_request(token)
+        return self.finish(request, response, timings, perf_counter() - start)
+
+    async def __acall__(self, request):
+        start = perf_counter()
+        timings, token = start_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            end_request(token)
+        return self.finish(request, response, timings, perf_counter() - start)
+
+    def process_exception(self, request, exception):
+        REQUEST_EXCEPTIONS.inc(_view_name(request), type(exception).__name__)
+
+    def finish(self, request, response, timings, elapsed):
+        view = _view_name(request)
+        method = request.method if request.method in KNOWN_METHODS else 'other'
+        REQUEST_LATENCY.observe(elapsed, view, method, str(response.status_code))
+        REQUEST_DB_QUERIES.observe(timings.db_queries, view)
+        REQUEST_DB_TIME.observe(timings.db_seconds, view)
+        if self.server_timing:
+            response['Server-Timing'] = timings.server_timing(elapsed)
+        return response
@@ -0,0 +1,37 @@
+from django.db import migrations
+
+CONSTRAINT_NAME = 'availabilityslot_no_overlap'
+
+
+def add_overlap_constraint(apps, schema_editor):
+    # Range types and GiST exclusion constraints are PostgreSQL features; other
+    # backends rely on the application-level checks in core.forms/core.scheduling
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+    schema_editor.execute(
+        f'ALTER TABLE core_availabilityslot ADD CONSTRAINT {CONSTRAINT_NAME} '
+        'EXCLUDE USING gist ('
+        'doctor_id WITH =, '
+        'tsrange(date + start_time, date + end_time) WITH &&'
+        ')'
+    )
+
+
+def remove_overlap_constraint(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        f'ALTER TABLE core_availabilityslot DROP CONSTRAINT IF EXISTS {CONSTRAINT_NAME}'
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_email_outbox'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_overlap_constraint, remove_overlap_constraint),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 6.0.1 on 2026-10-18 10:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_availabilityslot_no_overlap'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='availabilityslot',
+            index=models.Index(fields=['doctor', 'date', 'start_time', 'id'], include=('end_time', 'is_booked'), name='slot_doctor_date_cover_idx'),
+        ),
+    ]
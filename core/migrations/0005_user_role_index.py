@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-18 11:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_availabilityslot_dashboard_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='role',
+            field=models.CharField(choices=[('doctor', 'Doctor'), ('patient', 'Patient')], db_index=True, max_length=10),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 6.0.1 on 2026-10-18 12:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def populate_open_slot_counts(apps, schema_editor):
+    AvailabilitySlot = apps.get_model('core', 'AvailabilitySlot')
+    OpenSlotCount = apps.get_model('core', 'OpenSlotCount')
+    totals = AvailabilitySlot.objects.values('doctor_id', 'date').annotate(
+        open_slots=Count('id', filter=Q(is_booked=False))
+    ).order_by()
+    OpenSlotCount.objects.bulk_create(
+        (OpenSlotCount(doctor_id=row['doctor_id'], date=row['date'], open_slots=row['open_slots'])
+         for row in totals.iterator()),
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_user_role_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OpenSlotCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('open_slots', models.IntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['date'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='availabilityslot',
+            index=models.Index(condition=models.Q(('is_booked', False)), fields=['doctor', 'date', 'start_time'], name='slot_open_idx'),
+        ),
+        migrations.AddField(
+            model_name='openslotcount',
+            name='doctor',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='open_slot_counts', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterUniqueTogether(
+            name='openslotcount',
+            unique_together={('doctor', 'date')},
+        ),
+        migrations.RunPython(populate_open_slot_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 6.0.1 on 2026-10-18 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_calendar_sync'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='doctorprofile',
+            name='specialization',
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+        migrations.AddIndex(
+            model_name='openslotcount',
+            index=models.Index(condition=models.Q(('open_slots__gt', 0)), fields=['date', 'doctor'], name='open_count_date_idx'),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from django.db.models.functions import Lower
 from django.utils import timezone
 
 class User(AbstractUser):
@@ -7,16 +8,28 @@ class User(AbstractUser):
         ('doctor', 'Doctor'),
         ('patient', 'Patient'),
     )
-    role = models.CharField(max_length=10, choices=ROLE_CHOICES)
+    role = models.CharField(max_length=10, choices=ROLE_CHOICES, db_index=True)
     google_calendar_credentials = models.JSONField(null=True, blank=True)
     
+    class Meta(AbstractUser.Meta):
+        constraints = [
+            # One account per email address, whatever its case; blank emails
+            # (e.g. users made with createsuperuser) are exempt
+            models.UniqueConstraint(
+                Lower('email'),
+                condition=~models.Q(email=''),
+                name='user_email_ci_unique'
+            ),
+        ]
+    
     def __str__(self):
         return f"{self.username} ({self.role})"
 
 
 class DoctorProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='doctor_profile')
-    specialization = models.CharField(max_length=100)
+    # Indexed for the earliest-slot search by specialization
+    specialization = models.CharField(max_length=100, db_index=True)
     phone = models.CharField(max_length=15, blank=True)
     
     def __str__(self):
@@ -38,10 +51,38 @@ class AvailabilitySlot(models.Model):
     start_time = models.TimeField()
     end_time = models.TimeField()
     is_booked = models.BooleanField(default=False)
+    # A short reservation for a patient between picking a slot and booking it
+    held_by = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, blank=True, related_name='held_slots'
+    )
+    held_until = models.DateTimeField(null=True, blank=True)
     
     class Meta:
         unique_together = ('doctor', 'date', 'start_time')
         ordering = ['date', 'start_time']
+        indexes = [
+            # Serves the doctor dashboard's keyset pages; on PostgreSQL the
+            # included columns make it an index-only scan
+            models.Index(
+                fields=['doctor', 'date', 'start_time', 'id'],
+                include=['end_time', 'is_booked'],
+                name='slot_doctor_date_cover_idx'
+            ),
+            # Open-slot listings and bookings only ever look at unbooked slots
+            models.Index(
+                fields=['doctor', 'date', 'start_time'],
+                condition=models.Q(is_booked=False),
+                name='slot_open_idx'
+            ),
+            # Lets the sweeper find expired holds without scanning slots
+            models.Index(
+                fields=['held_until'],
+                condition=models.Q(held_until__isnull=False),
+                name='slot_hold_expiry_idx'
+            ),
+        ]
+        # On PostgreSQL, migration 0003 also adds a GiST exclusion constraint
+        # (availabilityslot_no_overlap) so a doctor's slots can never overlap
     
     def __str__(self):
         return f"{self.doctor.get_full_name()} - {self.date} {self.start_time}-{self.end_time}"
@@ -51,6 +92,31 @@ class AvailabilitySlot(models.Model):
         return not self.is_booked and timezone.now().date() <= self.date
 
 
+class OpenSlotCount(models.Model):
+    """
+    Number of unbooked slots a doctor has on a date, maintained alongside
+    AvailabilitySlot writes so availability summaries never scan slot rows.
+    """
+    doctor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='open_slot_counts')
+    date = models.DateField()
+    open_slots = models.IntegerField(default=0)
+    
+    class Meta:
+        unique_together = ('doctor', 'date')
+        ordering = ['date']
+        indexes = [
+            # Days with anything open, soonest first: bounds the earliest-slot search
+            models.Index(
+                fields=['date', 'doctor'],
+                condition=models.Q(open_slots__gt=0),
+                name='open_count_date_idx'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.doctor.get_full_name()} - {self.date}: {self.open_slots} open"
+
+
 class Booking(models.Model):
     patient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='bookings')
     availability_slot = models.OneToOneField(AvailabilitySlot, on_delete=models.CASCADE)
@@ -59,4 +125,119 @@ class Booking(models.Model):
     patient_calendar_event_id = models.CharField(max_length=255, blank=True)
     
     def __str__(self):
-        return f"{self.patient.get_full_name()} with {self.availability_slot.doctor.get_full_name()}"
\ No newline at end of file
+        return f"{self.patient.get_full_name()} with {self.availability_slot.doctor.get_full_name()}"
+
+class WaitlistEntry(models.Model):
+    """
+    A patient waiting for any open slot with a doctor between two dates.
+    Waiting entries form a per-doctor queue ordered by created_at.
+    """
+    STATUS_CHOICES = (
+        ('waiting', 'Waiting'),
+        ('assigned', 'Assigned'),
+        ('cancelled', 'Cancelled'),
+    )
+    patient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='waitlist_entries')
+    doctor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='waitlisted_by')
+    start_date = models.DateField()
+    end_date = models.DateField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='waiting')
+    booking = models.OneToOneField(Booking, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['created_at', 'id']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['patient', 'doctor'],
+                condition=models.Q(status='waiting'),
+                name='waitlist_one_waiting_per_doctor'
+            ),
+        ]
+        indexes = [
+            # The queue: a doctor's waiting entries in arrival order
+            models.Index(
+                fields=['doctor', 'created_at', 'id'],
+                condition=models.Q(status='waiting'),
+                name='waitlist_queue_idx'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.patient.get_full_name()} waiting for {self.doctor.get_full_name()} ({self.status})"
+
+class EmailOutbox(models.Model):
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    )
+    action = models.CharField(max_length=50)
+    to_email = models.EmailField()
+    data = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_status_due_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.action} to {self.to_email} ({self.status})"
+
+
+class CalendarSyncTask(models.Model):
+    """
+    A pending change to one user's Google Calendar, queued in the same
+    transaction as the booking change and applied later by sync_calendars.
+    Upserts read the booking's current state when they run; deletes carry
+    the event id because the booking is gone by then.
+    """
+    ACTION_CHOICES = (
+        ('upsert', 'Create or update'),
+        ('delete', 'Delete'),
+    )
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='calendar_tasks')
+    # Not a foreign key: delete tasks outlive their booking
+    booking_id = models.BigIntegerField()
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    event_id = models.CharField(max_length=255, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(
+                fields=['next_attempt_at', 'id'],
+                condition=models.Q(status='pending'),
+                name='calendar_task_due_idx'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.action} booking {self.booking_id} for {self.user_id} ({self.status})"
+
+
+class CalendarSyncState(models.Model):
+    """Incremental-pull position (Calendar API sync token) for one user's calendar"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='calendar_sync_state')
+    sync_token = models.CharField(max_length=1024, blank=True)
+    pulled_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"Calendar sync state for {self.user_id}"
@@ -0,0 +1,120 @@
+import base64
+import json
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class KeysetPage:
+    """One page of a keyset-paginated queryset with cursors to its neighbours"""
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.prev_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def _field(model, key):
+    """The model field a key names, following relations in "a__b" paths"""
+    *relations, name = key.split('__')
+    for relation in relations:
+        model = model._meta.get_field(relation).related_model
+    return model._meta.get_field(name)
+
+
+def _value(item, key):
+    for attr in key.split('__'):
+        item = getattr(item, attr)
+    return item
+
+
+def encode_cursor(values):
+    raw = json.dumps([str(v) for v in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, model, keys):
+    """Decode a cursor into python values for `keys`, or None if it is malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list) or len(values) != len(keys):
+            return None
+        return [_field(model, key).to_python(value) for key, value in zip(keys, values)]
+    except (ValueError, TypeError, ValidationError):
+        return None
+
+
+def _seek(keys, values, op):
+    """
+    Rows strictly after (op='gt') or before (op='lt') `values` in `keys` order.
+    The leading-key bound is added on its own so the database can turn it into
+    an index range condition instead of filtering every earlier row.
+    """
+    condition = Q()
+    for i, key in enumerate(keys):
+        prefix = {k: v for k, v in zip(keys[:i], values[:i])}
+        prefix[f'{key}__{op}'] = values[i]
+        condition |= Q(**prefix)
+    return Q(**{f'{keys[0]}__{op}e': values[0]}) & condition
+
+
+def _page_query(queryset, keys, page_size, after, before):
+    model = queryset.model
+    after_values = decode_cursor(after, model, keys) if after else None
+    before_values = decode_cursor(before, model, keys) if before else None
+
+    if before_values is not None:
+        query = queryset.filter(_seek(keys, before_values, 'lt')).order_by(*[f'-{key}' for key in keys])
+        return query[:page_size + 1], before_values, after_values
+    if after_values is not None:
+        queryset = queryset.filter(_seek(keys, after_values, 'gt'))
+    return queryset.order_by(*keys)[:page_size + 1], before_values, after_values
+
+
+def _page(rows, keys, page_size, before_values, after_values):
+    if before_values is not None:
+        has_more = len(rows) > page_size
+        items = rows[:page_size][::-1]
+        has_before, has_after = has_more, True
+    else:
+        items = rows[:page_size]
+        has_before, has_after = after_values is not None, len(rows) > page_size
+
+    def cursor(item):
+        return encode_cursor([_value(item, key) for key in keys])
+
+    return KeysetPage(
+        items,
+        next_cursor=cursor(items[-1]) if items and has_after else None,
+        prev_cursor=cursor(items[0]) if items and has_before else None,
+    )
+
+
+def keyset_paginate(queryset, keys, page_size, after=None, before=None):
+    """
+    Paginate `queryset` ordered ascending by `keys`, the last of which must be
+    unique (normally 'id'). Keys may follow relations ('availability_slot__date'). Pass the `after` or `before` cursor of a previous
+    page to move forwards or backwards. Cost is independent of page depth.
+    """
+    query, before_values, after_values = _page_query(queryset, keys, page_size, after, before)
+    return _page(list(query), keys, page_size, before_values, after_values)
+
+
+async def akeyset_paginate(queryset, keys, page_size, after=None, before=None):
+    """Async keyset_paginate for async views"""
+    query, before_values, after_values = _page_query(queryset, keys, page_size, after, before)
+    return _page([row async for row in query], keys, page_size, before_values, after_values)
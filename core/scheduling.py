@@ -0,0 +1,133 @@
+from bisect import bisect_left, insort
+from collections import defaultdict
+from datetime import datetime, timedelta
+from itertools import islice
+from django.db import transaction
+from .availability import refresh_open_slot_counts
+from .caching import invalidate_open_slots
+from .models import AvailabilitySlot
+
+# Rows per INSERT when generating recurring availability
+SLOT_BATCH_SIZE = 1000
+
+WEEKDAY_CHOICES = (
+    (0, 'Monday'),
+    (1, 'Tuesday'),
+    (2, 'Wednesday'),
+    (3, 'Thursday'),
+    (4, 'Friday'),
+    (5, 'Saturday'),
+    (6, 'Sunday'),
+)
+
+
+class SlotIndex:
+    """
+    Sorted per-(doctor, date) interval lists for in-memory overlap checks.
+    Intervals in the index never overlap, so a new interval only has to be
+    compared with its neighbours: each check is one binary search.
+    """
+
+    def __init__(self):
+        self._days = defaultdict(list)
+
+    @classmethod
+    def for_doctors(cls, doctor_ids, start_date, end_date):
+        """Build an index of the existing slots of the given doctors in a date range"""
+        index = cls()
+        rows = AvailabilitySlot.objects.filter(
+            doctor_id__in=doctor_ids, date__range=(start_date, end_date)
+        ).order_by('doctor_id', 'date', 'start_time').values_list(
+            'doctor_id', 'date', 'start_time', 'end_time'
+        )
+        for doctor_id, date, start_time, end_time in rows.iterator(chunk_size=SLOT_BATCH_SIZE):
+            # Rows arrive sorted, so appending keeps every list ordered
+            index._days[doctor_id, date].append((start_time, end_time))
+        return index
+
+    def overlaps(self, doctor_id, date, start_time, end_time):
+        intervals = self._days.get((doctor_id, date))
+        if not intervals:
+            return False
+        i = bisect_left(intervals, (start_time, end_time))
+        if i > 0 and intervals[i - 1][1] > start_time:
+            return True
+        return i < len(intervals) and intervals[i][0] < end_time
+
+    def add(self, doctor_id, date, start_time, end_time):
+        """Insert an interval if it does not overlap; return whether it was added"""
+        if self.overlaps(doctor_id, date, start_time, end_time):
+            return False
+        insort(self._days[doctor_id, date], (start_time, end_time))
+        return True
+
+
+def expand_schedule(start_date, end_date, weekdays, day_start, day_end, slot_minutes):
+    """
+    Yield (date, start_time, end_time) for every slot of a recurring schedule.
+    weekdays: iterable of ints, Monday=0 ... Sunday=6
+    Slots that would run past day_end are not generated.
+    """
+    weekdays = set(weekdays)
+    length = timedelta(minutes=slot_minutes)
+    # Pre-compute one day's slot times; every matching date reuses them
+    times = []
+    anchor = datetime.combine(start_date, day_start)
+    day_limit = datetime.combine(start_date, day_end)
+    while anchor + length <= day_limit:
+        times.append((anchor.time(), (anchor + length).time()))
+        anchor += length
+
+    day = start_date
+    while day <= end_date:
+        if day.weekday() in weekdays:
+            for start_time, end_time in times:
+                yield day, start_time, end_time
+        day += timedelta(days=1)
+
+
+def generate_availability(doctor_ids, start_date, end_date, weekdays, day_start, day_end,
+                          slot_minutes, batch_size=SLOT_BATCH_SIZE):
+    """
+    Create AvailabilitySlot rows for each doctor from a recurring schedule.
+    Slots that overlap an existing slot of the same doctor are skipped, and
+    the rest are inserted in batches, one transaction per doctor so a large
+    run never holds locks across doctors. New slots reach waiting patients
+    through the process_waitlist worker.
+    Returns a (created, skipped) tuple; skipped counts existing and
+    overlapping slots alike.
+    """
+    counts = {'overlapping': 0, 'attempted': 0}
+
+    def slots(doctor_id):
+        # One query per doctor keeps memory bounded to a single schedule
+        index = SlotIndex.for_doctors([doctor_id], start_date, end_date)
+        for date, start_time, end_time in expand_schedule(
+            start_date, end_date, weekdays, day_start, day_end, slot_minutes
+        ):
+            if index.add(doctor_id, date, start_time, end_time):
+                yield AvailabilitySlot(doctor_id=doctor_id, date=date,
+                                       start_time=start_time, end_time=end_time)
+            else:
+                counts['overlapping'] += 1
+
+    created = 0
+    for doctor_id in doctor_ids:
+        existing = AvailabilitySlot.objects.filter(doctor_id=doctor_id, date__range=(start_date, end_date))
+        with transaction.atomic():
+            before = existing.count()
+            rows = slots(doctor_id)
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                # Overlaps are filtered above; the constraints still catch rows
+                # written concurrently by another request
+                AvailabilitySlot.objects.bulk_create(batch, ignore_conflicts=True)
+                counts['attempted'] += len(batch)
+            added = existing.count() - before
+            if added:
+                refresh_open_slot_counts([doctor_id], start_date, end_date)
+                invalidate_open_slots(doctor_id)
+        created += added
+    return created, counts['attempted'] + counts['overlapping'] - created
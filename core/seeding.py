@@ -0,0 +1,139 @@
+"""
+Synthetic data for load testing: doctors, patients, slots and bookings.
+
+Everything is written with bulk INSERTs, doctors in chunks of
+SEED_DOCTOR_CHUNK with one transaction per chunk, so memory stays bounded
+however many slots are generated. All users share one password hash
+(hashing millions of passwords would take hours), no emails are queued and
+no calendars are connected. The same rng seed gives the same data.
+"""
+import random
+from datetime import datetime, time, timedelta
+from itertools import islice
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+from .availability import refresh_open_slot_counts
+from .caching import invalidate_doctor_directory
+from .models import User, DoctorProfile, PatientProfile, AvailabilitySlot, Booking
+
+# Rows per INSERT
+SEED_BATCH_SIZE = 5000
+# Doctors whose slots and bookings are written per transaction
+SEED_DOCTOR_CHUNK = 50
+# Each day's slots run back to back from this time
+SEED_DAY_START = time(8)
+
+# (specialization, relative share of doctors): a few common ones, a long tail
+SPECIALIZATIONS = (
+    ('General Practice', 30), ('Pediatrics', 12), ('Internal Medicine', 10), ('Cardiology', 8),
+    ('Dermatology', 6), ('Orthopedics', 6), ('Gynecology', 6), ('Psychiatry', 5),
+    ('Ophthalmology', 4), ('Neurology', 3), ('Endocrinology', 3), ('Gastroenterology', 3),
+    ('Urology', 2), ('Oncology', 1), ('Rheumatology', 1),
+)
+FIRST_NAMES = ('Alex', 'Sam', 'Maria', 'John', 'Aisha', 'Wei', 'Elena', 'Omar', 'Priya', 'Lucas',
+               'Fatima', 'Noah', 'Yuki', 'Chen', 'Sofia', 'David', 'Amara', 'Ivan', 'Lena', 'Raj')
+LAST_NAMES = ('Smith', 'Garcia', 'Khan', 'Nguyen', 'Müller', 'Rossi', 'Kowalski', 'Silva', 'Patel',
+              'Johnson', 'Kim', 'Okafor', 'Haddad', 'Novak', 'Tanaka', 'Cohen', 'Larsen', 'Brown')
+
+
+class SeedResult:
+    def __init__(self):
+        self.doctors = 0
+        self.patients = 0
+        self.slots = 0
+        self.bookings = 0
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def _create_users(prefix, role, numbers, password_hash, rng):
+    """Insert the users "<prefix>-<role>-<n>" for each n; returns their ids"""
+    users = User.objects.bulk_create([
+        User(
+            username=f'{prefix}-{role}-{n}', email=f'{prefix}-{role}-{n}@example.com',
+            first_name=rng.choice(FIRST_NAMES), last_name=rng.choice(LAST_NAMES),
+            role=role, password=password_hash,
+        )
+        for n in numbers
+    ])
+    return [user.id for user in users]
+
+
+def seed_load(doctors=1000, patients=100000, days=30, past_days=30, slots_per_day=16, slot_minutes=30,
+              booked=0.6, prefix='load', password='load-test-password', rng_seed=1,
+              batch_size=SEED_BATCH_SIZE, progress=None):
+    """
+    Create `doctors` doctors, each with `slots_per_day` slots of
+    `slot_minutes` from SEED_DAY_START on every day from `past_days` ago through
+    `days` ahead, and `patients` patients who hold bookings for a `booked`
+    fraction of those slots (past ones included). Usernames are
+    "<prefix>-doctor-<n>" and "<prefix>-patient-<n>", all with `password`.
+    progress, if given, is called with the SeedResult after each chunk.
+    Returns a SeedResult.
+    """
+    rng = random.Random(rng_seed)
+    result = SeedResult()
+    password_hash = make_password(password)
+    names, weights = zip(*SPECIALIZATIONS)
+    today = timezone.localdate()
+
+    doctor_ids = []
+    for numbers in _chunks(range(doctors), batch_size):
+        with transaction.atomic():
+            ids = _create_users(prefix, 'doctor', numbers, password_hash, rng)
+            DoctorProfile.objects.bulk_create([
+                DoctorProfile(user_id=user_id, specialization=specialization)
+                for user_id, specialization in zip(ids, rng.choices(names, weights, k=len(ids)))
+            ])
+        doctor_ids.extend(ids)
+        result.doctors = len(doctor_ids)
+    invalidate_doctor_directory()
+
+    patient_ids = []
+    for numbers in _chunks(range(patients), batch_size):
+        with transaction.atomic():
+            ids = _create_users(prefix, 'patient', numbers, password_hash, rng)
+            PatientProfile.objects.bulk_create([
+                PatientProfile(user_id=user_id, date_of_birth=today - timedelta(days=rng.randint(365, 90 * 365)))
+                for user_id in ids
+            ])
+        patient_ids.extend(ids)
+        result.patients = len(patient_ids)
+        if progress:
+            progress(result)
+
+    dates = [today + timedelta(days=offset) for offset in range(-past_days, days)]
+    if not dates:
+        return result
+    opening = datetime.combine(today, SEED_DAY_START)
+    times = [
+        ((opening + timedelta(minutes=slot_minutes * n)).time(),
+         (opening + timedelta(minutes=slot_minutes * (n + 1))).time())
+        for n in range(slots_per_day)
+    ]
+    for chunk in _chunks(doctor_ids, SEED_DOCTOR_CHUNK):
+        with transaction.atomic():
+            slots = AvailabilitySlot.objects.bulk_create(
+                [
+                    AvailabilitySlot(doctor_id=doctor_id, date=day, start_time=start_time, end_time=end_time,
+                                     is_booked=bool(patient_ids) and rng.random() < booked)
+                    for doctor_id in chunk for day in dates for start_time, end_time in times
+                ],
+                batch_size=batch_size
+            )
+            bookings = Booking.objects.bulk_create(
+                (Booking(availability_slot_id=slot.id, patient_id=rng.choice(patient_ids))
+                 for slot in slots if slot.is_booked),
+                batch_size=batch_size
+            )
+            refresh_open_slot_counts(chunk, dates[0], dates[-1])
+        result.slots += len(slots)
+        result.bookings += len(bookings)
+        if progress:
+            progress(result)
+    return result
@@ -0,0 +1,70 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .availability import adjust_open_slots
+from .booking import release_slot
+from .caching import invalidate_doctor_directory, invalidate_open_slots
+from .calendar_sync import queue_calendar_deletes
+from .models import User, DoctorProfile, AvailabilitySlot, Booking
+from .waitlist import offer_slot_on_commit
+
+# User fields shown in the doctor directory
+DIRECTORY_USER_FIELDS = {'first_name', 'last_name', 'role'}
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    # Logins only touch last_login; new patients never appear in the directory
+    if update_fields is not None and not DIRECTORY_USER_FIELDS.intersection(update_fields):
+        return
+    if created and instance.role != 'doctor':
+        return
+    invalidate_doctor_directory()
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    if instance.role == 'doctor':
+        invalidate_doctor_directory()
+
+
+@receiver(post_save, sender=DoctorProfile)
+@receiver(post_delete, sender=DoctorProfile)
+def doctor_profile_changed(sender, instance, **kwargs):
+    invalidate_doctor_directory()
+
+
+@receiver(post_save, sender=AvailabilitySlot)
+def availability_slot_saved(sender, instance, created, **kwargs):
+    if created and not instance.is_booked:
+        # Every save() path counts its new slot, as deletes uncount them below
+        adjust_open_slots(instance.doctor_id, instance.date, 1)
+    invalidate_open_slots(instance.doctor_id)
+    if not instance.is_booked:
+        offer_slot_on_commit(instance.id)
+
+
+@receiver(post_delete, sender=AvailabilitySlot)
+def availability_slot_deleted(sender, instance, **kwargs):
+    if not instance.is_booked:
+        adjust_open_slots(instance.doctor_id, instance.date, -1)
+    invalidate_open_slots(instance.doctor_id)
+
+
+@receiver(post_delete, sender=Booking)
+def booking_deleted(sender, instance, origin=None, **kwargs):
+    if instance.doctor_calendar_event_id or instance.patient_calendar_event_id:
+        try:
+            doctor_id = instance.availability_slot.doctor_id
+        except AvailabilitySlot.DoesNotExist:
+            doctor_id = None
+        # A deleted user's calendar is no longer ours to clean up
+        queue_calendar_deletes(instance, doctor_id, origin.pk if isinstance(origin, User) else None)
+    # Bookings removed outside cancel_booking (admin, deleted patients) must
+    # not leave their slot marked booked, unless the slot itself is going
+    if isinstance(origin, AvailabilitySlot) or getattr(origin, 'model', None) is AvailabilitySlot:
+        return
+    try:
+        slot = instance.availability_slot
+    except AvailabilitySlot.DoesNotExist:
+        return
+    release_slot(slot)
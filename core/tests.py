@@ -1,3 +1,1426 @@
-from django.test import TestCase
+import contextlib
+import importlib
+import io
+import re
+import json
+import smtplib
+from datetime import time, timedelta
+from unittest import mock
+import httpx
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Sum
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import clear_url_caches, resolve, reverse
+from django.utils import timezone
+from .accounts import SignupConflict, matching_accounts
+from .availability import find_earliest_slots, next_available_dates, open_slots_this_week
+from .booking import (
+    book_slot, book_slots, cancel_booking, hold_slot, release_expired_holds, reschedule_booking, BookingError,
+    SlotInPast, SlotUnavailable,
+)
+from .caching import (
+    DOCTOR_DIRECTORY_VERSION_KEY, get_doctor_directory, get_open_slots, invalidate_doctor_directory,
+    invalidate_open_slots,
+)
+from .calendar_sync import event_id, pull_calendar_changes, sync_calendar_batch
+from .email_service import (
+    AsyncEmailClient, CircuitBreaker, CircuitOpenError, EmailClient, EmailDeliveryError,
+    EMAIL_BREAKER_RESET_SECONDS, OUTBOX_CLAIM_SECONDS, OUTBOX_MAX_ATTEMPTS, claim_outbox_batch,
+    process_outbox, queue_emails,
+)
+from .forms import AvailabilitySlotForm, PatientSignUpForm
+from .importing import import_users, read_rows
+from .metrics import EMAIL_LATENCY, LOCK_WAIT, REQUEST_DB_QUERIES, REQUEST_LATENCY, Histogram, REGISTRY
+from .models import (
+    User, DoctorProfile, AvailabilitySlot, Booking, CalendarSyncTask, EmailOutbox, OpenSlotCount, WaitlistEntry,
+)
+from .scheduling import generate_availability
+from .views import DOCTOR_DASHBOARD_PAGE_SIZE
+from .waitlist import fill_waitlist, join_waitlist, offer_slot
+from benchmarks.stub_calendar import StubCalendarServer
+from email_service import handler as email_handler
 
-# Create your tests here.
+
+class QueryCountTests(TestCase):
+    """
+    Views must issue a constant number of queries however much data exists.
+    Each test measures a request, adds more rows, and measures it again.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.tomorrow = timezone.now().date() + timedelta(days=1)
+        self.patient = User.objects.create(
+            username='patient', role='patient', first_name='Pat', last_name='Ient',
+            email='patient@example.com'
+        )
+        self.doctor = self.make_doctor('doctor')
+        self.doctor_count = 0
+
+    def make_doctor(self, username):
+        doctor = User.objects.create(
+            username=username, role='doctor', first_name='Doc', last_name=username,
+            email=f'{username}@example.com'
+        )
+        DoctorProfile.objects.create(user=doctor, specialization='Cardiology')
+        return doctor
+
+    def make_slots(self, doctor, count, day_offset=0):
+        invalidate_open_slots(doctor.id)
+        return AvailabilitySlot.objects.bulk_create([
+            AvailabilitySlot(
+                doctor=doctor,
+                date=self.tomorrow + timedelta(days=day_offset + i // 8),
+                start_time=time(9 + i % 8),
+                end_time=time(10 + i % 8),
+            )
+            for i in range(count)
+        ])
+
+    def book(self, slots):
+        Booking.objects.bulk_create([Booking(patient=self.patient, availability_slot=s) for s in slots])
+        AvailabilitySlot.objects.filter(id__in=[s.id for s in slots]).update(is_booked=True)
+        invalidate_open_slots(*[s.doctor_id for s in slots])
+
+    def add_doctors(self, count):
+        for _ in range(count):
+            self.doctor_count += 1
+            doctor = self.make_doctor(f'extra{self.doctor_count}')
+            self.book(self.make_slots(doctor, 2))
+
+    def count_queries(self, user, method, url):
+        self.client.force_login(user)
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url)
+        self.assertIn(response.status_code, (200, 302))
+        return len(queries)
+
+    def assertConstantQueries(self, user, method, url, grow):
+        before = self.count_queries(user, method, url)
+        # Run on_commit hooks so caches are invalidated as they would be in production
+        with self.captureOnCommitCallbacks(execute=True):
+            grow()
+        after = self.count_queries(user, method, url)
+        self.assertEqual(before, after, f'{method.upper()} {url} went from {before} to {after} queries')
+
+    def test_patient_dashboard(self):
+        self.add_doctors(2)
+        self.assertConstantQueries(
+            self.patient, 'get', reverse('dashboard'), lambda: self.add_doctors(10)
+        )
+
+    def test_doctor_dashboard(self):
+        self.book(self.make_slots(self.doctor, 4))
+
+        def grow():
+            slots = self.make_slots(self.doctor, 80, day_offset=10)
+            self.book(slots[:20])
+
+        self.assertConstantQueries(self.doctor, 'get', reverse('dashboard'), grow)
+
+    def test_available_slots(self):
+        self.make_slots(self.doctor, 4)
+        url = reverse('view_available_slots', args=[self.doctor.id])
+        self.assertConstantQueries(
+            self.patient, 'get', url, lambda: self.make_slots(self.doctor, 80, day_offset=10)
+        )
+
+    def test_book_appointment(self):
+        first, second = self.make_slots(self.doctor, 2)
+        before = self.count_queries(self.patient, 'post', reverse('book_appointment', args=[first.id]))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_doctors(10)
+            self.make_slots(self.doctor, 40, day_offset=10)
+        after = self.count_queries(self.patient, 'post', reverse('book_appointment', args=[second.id]))
+        self.assertEqual(before, after)
+        self.assertTrue(Booking.objects.filter(availability_slot=second, patient=self.patient).exists())
+
+
+class DoctorDashboardPagingTests(TestCase):
+
+    def setUp(self):
+        self.doctor = User.objects.create(username='doc', role='doctor')
+        self.patient = User.objects.create(username='patient', role='patient')
+        day = timezone.now().date() + timedelta(days=1)
+        generate_availability([self.doctor.id], day, day + timedelta(days=6), range(7), time(9), time(17), 60)
+        slots = list(AvailabilitySlot.objects.filter(doctor=self.doctor).order_by('date', 'start_time'))
+        self.booked = slots[:DOCTOR_DASHBOARD_PAGE_SIZE + 5]
+        Booking.objects.bulk_create([Booking(patient=self.patient, availability_slot=s) for s in self.booked])
+        AvailabilitySlot.objects.filter(id__in=[s.id for s in self.booked]).update(is_booked=True)
+        self.client.force_login(self.doctor)
+
+    def follow(self, response, param):
+        match = re.search(rf'href="\?([^"]*\b{param}=[^"&]+)"', response.content.decode())
+        self.assertIsNotNone(match, f'no {param} link')
+        return self.client.get(reverse('dashboard') + '?' + match.group(1).replace('&amp;', '&'))
+
+    def test_pages_through_appointments(self):
+        first = self.client.get(reverse('dashboard'))
+        self.assertEqual([b.availability_slot_id for b in first.context['bookings_page']],
+                         [s.id for s in self.booked[:DOCTOR_DASHBOARD_PAGE_SIZE]])
+        self.assertNotIn('bookings_before=', first.content.decode())
+
+        second = self.follow(first, 'bookings_after')
+        self.assertEqual([b.availability_slot_id for b in second.context['bookings_page']],
+                         [s.id for s in self.booked[DOCTOR_DASHBOARD_PAGE_SIZE:]])
+        self.assertFalse(second.context['bookings_page'].has_next)
+        # The slot list stays on its first page
+        self.assertEqual(list(second.context['page']), list(first.context['page']))
+
+        back = self.follow(second, 'bookings_before')
+        self.assertEqual(list(back.context['bookings_page']), list(first.context['bookings_page']))
+
+    def test_slot_and_appointment_cursors_are_independent(self):
+        first = self.client.get(reverse('dashboard'))
+        appointments = self.follow(first, 'bookings_after')
+        slots = self.follow(appointments, 'after')
+        self.assertEqual(slots.context['page'].items[0].start_time, time(11))
+        self.assertEqual(list(slots.context['bookings_page']), list(appointments.context['bookings_page']))
+        self.assertEqual(list(self.follow(slots, 'before').context['page']), list(first.context['page']))
+
+
+class DoctorDirectoryCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.patient = User.objects.create(username='patient', role='patient')
+        self.doctor = User.objects.create(username='doc', role='doctor', first_name='Ann', last_name='Lee')
+        self.profile = DoctorProfile.objects.create(user=self.doctor, specialization='Cardiology')
+        self.client.force_login(self.patient)
+
+    def test_steady_state_makes_no_directory_queries(self):
+        self.client.get(reverse('dashboard'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('dashboard'))
+        self.assertContains(response, 'Cardiology')
+        directory_queries = [q['sql'] for q in queries if 'core_doctorprofile' in q['sql']]
+        self.assertEqual(directory_queries, [])
+
+    def test_profile_change_invalidates_directory(self):
+        self.assertEqual(get_doctor_directory()[0].specialization, 'Cardiology')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.profile.specialization = 'Neurology'
+            self.profile.save()
+        self.assertEqual(get_doctor_directory()[0].specialization, 'Neurology')
+
+    def test_new_doctor_invalidates_directory(self):
+        self.assertEqual(len(get_doctor_directory()), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.create(username='doc2', role='doctor', first_name='Bo', last_name='Kim')
+        self.assertEqual(len(get_doctor_directory()), 2)
+
+    def test_evicted_version_does_not_revive_stale_entries(self):
+        self.assertEqual(get_doctor_directory()[0].specialization, 'Cardiology')
+        DoctorProfile.objects.filter(id=self.profile.id).update(specialization='Neurology')
+        cache.delete(DOCTOR_DIRECTORY_VERSION_KEY)
+        self.assertEqual(get_doctor_directory()[0].specialization, 'Neurology')
+
+    def test_bump_after_eviction_starts_a_new_series(self):
+        get_doctor_directory()
+        DoctorProfile.objects.filter(id=self.profile.id).update(specialization='Neurology')
+        cache.delete(DOCTOR_DIRECTORY_VERSION_KEY)
+        with self.captureOnCommitCallbacks(execute=True):
+            invalidate_doctor_directory()
+        self.assertEqual(get_doctor_directory()[0].specialization, 'Neurology')
+
+    def test_login_does_not_invalidate_directory(self):
+        get_doctor_directory()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.client.force_login(self.doctor)
+        self.assertEqual(callbacks, [])
+
+
+class OpenSlotsCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.doctor = User.objects.create(username='doc', role='doctor')
+        self.patient = User.objects.create(username='patient', role='patient')
+        self.slot = AvailabilitySlot.objects.create(
+            doctor=self.doctor, date=timezone.now().date() + timedelta(days=1),
+            start_time=time(9), end_time=time(10)
+        )
+
+    def test_snapshot_is_served_from_cache(self):
+        get_open_slots(self.doctor.id)
+        with self.assertNumQueries(0):
+            slots = get_open_slots(self.doctor.id)
+        self.assertEqual([(s.id, s.start_time, s.end_time) for s in slots], [(self.slot.id, time(9), time(10))])
+
+    def test_booking_invalidates_snapshot(self):
+        self.assertEqual(len(get_open_slots(self.doctor.id)), 1)
+        self.client.force_login(self.patient)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('book_appointment', args=[self.slot.id]))
+        self.assertEqual(get_open_slots(self.doctor.id), [])
+
+    def test_new_slot_invalidates_snapshot(self):
+        self.assertEqual(len(get_open_slots(self.doctor.id)), 1)
+        self.client.force_login(self.doctor)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('create_availability'), {
+                'date': self.slot.date.isoformat(), 'start_time': '11:00', 'end_time': '12:00'
+            })
+        self.assertEqual(len(get_open_slots(self.doctor.id)), 2)
+
+
+class OpenSlotCountTests(TestCase):
+
+    def setUp(self):
+        self.doctor = User.objects.create(username='doc', role='doctor')
+        self.patient = User.objects.create(username='patient', role='patient')
+        self.day = timezone.now().date() + timedelta(days=1)
+
+    def count(self, day=None):
+        counter = OpenSlotCount.objects.filter(doctor=self.doctor, date=day or self.day).first()
+        return counter.open_slots if counter else 0
+
+    def test_create_and_book_keep_counter_in_step(self):
+        self.client.force_login(self.doctor)
+        for start, end in (('09:00', '10:00'), ('10:00', '11:00')):
+            self.client.post(reverse('create_availability'), {
+                'date': self.day.isoformat(), 'start_time': start, 'end_time': end
+            })
+        self.assertEqual(self.count(), 2)
+
+        self.client.force_login(self.patient)
+        slot = AvailabilitySlot.objects.filter(doctor=self.doctor).first()
+        self.client.post(reverse('book_appointment', args=[slot.id]))
+        self.assertEqual(self.count(), 1)
+        self.assertEqual(next_available_dates([self.doctor.id]), {self.doctor.id: self.day})
+
+    def test_bulk_generation_refreshes_counters(self):
+        created, skipped = generate_availability(
+            [self.doctor.id], self.day, self.day + timedelta(days=1), range(7), time(9), time(10), 15
+        )
+        self.assertEqual((created, skipped), (8, 0))
+        self.assertEqual(self.count(), 4)
+        self.assertEqual(self.count(self.day + timedelta(days=1)), 4)
+
+    def test_generation_commits_each_doctor_separately(self):
+        other = User.objects.create(username='other', role='doctor')
+        with mock.patch('core.scheduling.refresh_open_slot_counts', side_effect=[None, RuntimeError]):
+            with self.assertRaises(RuntimeError):
+                generate_availability([self.doctor.id, other.id], self.day, self.day, range(7), time(9), time(10), 30)
+        self.assertEqual(AvailabilitySlot.objects.filter(doctor=self.doctor).count(), 2)
+        self.assertFalse(AvailabilitySlot.objects.filter(doctor=other).exists())
+
+    def test_recurring_view_reports_skipped_overlaps(self):
+        AvailabilitySlot.objects.create(doctor=self.doctor, date=self.day, start_time=time(9, 15), end_time=time(9, 45))
+        self.client.force_login(self.doctor)
+        response = self.client.post(reverse('create_recurring_availability'), {
+            'start_date': self.day.isoformat(), 'end_date': self.day.isoformat(), 'weekdays': range(7),
+            'day_start': '09:00', 'day_end': '11:00', 'slot_minutes': 30,
+        }, follow=True)
+        self.assertContains(response, '2 availability slots created, 2 skipped (existing or overlapping)')
+
+    def test_deleting_open_slot_decrements_counter(self):
+        generate_availability([self.doctor.id], self.day, self.day, range(7), time(9), time(10), 30)
+        AvailabilitySlot.objects.filter(doctor=self.doctor).first().delete()
+        self.assertEqual(self.count(), 1)
+
+    def test_orm_created_slot_is_counted_and_uncounted(self):
+        slot = AvailabilitySlot.objects.create(doctor=self.doctor, date=self.day, start_time=time(9), end_time=time(10))
+        AvailabilitySlot.objects.create(doctor=self.doctor, date=self.day, start_time=time(10), end_time=time(11))
+        self.assertEqual(self.count(), 2)
+        self.assertEqual(next_available_dates([self.doctor.id]), {self.doctor.id: self.day})
+        slot.delete()
+        self.assertEqual(self.count(), 1)
+
+    def test_open_slots_this_week_ignores_later_weeks(self):
+        today = timezone.now().date()
+        next_monday = today + timedelta(days=7 - today.weekday())
+        generate_availability([self.doctor.id], today, next_monday, range(7), time(23), time(23, 30), 30)
+        self.assertEqual(open_slots_this_week(self.doctor.id), (next_monday - today).days)
+
+
+class BookingEngineTests(TestCase):
+
+    def setUp(self):
+        self.doctor = User.objects.create(username='doc', role='doctor', email='doc@example.com')
+        self.patient = User.objects.create(username='patient', role='patient', email='pat@example.com')
+        self.other = User.objects.create(username='other', role='patient')
+        self.slot = AvailabilitySlot.objects.create(
+            doctor=self.doctor, date=timezone.now().date() + timedelta(days=1),
+            start_time=time(9), end_time=time(10)
+        )
+
+    def test_books_open_slot(self):
+        booking = book_slot(self.patient, self.slot.id)
+        self.slot.refresh_from_db()
+        self.assertTrue(self.slot.is_booked)
+        self.assertEqual(booking.availability_slot.doctor, self.doctor)
+        self.assertEqual(booking.availability_slot.start_time, time(9))
+
+    def test_second_booking_is_rejected(self):
+        book_slot(self.patient, self.slot.id)
+        with self.assertRaises(SlotUnavailable):
+            book_slot(self.other, self.slot.id)
+        self.assertEqual(Booking.objects.filter(availability_slot=self.slot).count(), 1)
+
+    def test_past_slot_is_rejected(self):
+        AvailabilitySlot.objects.filter(id=self.slot.id).update(date=timezone.now().date() - timedelta(days=1))
+        with self.assertRaises(SlotInPast):
+            book_slot(self.patient, self.slot.id)
+
+    def test_missing_slot_is_rejected(self):
+        with self.assertRaises(SlotUnavailable):
+            book_slot(self.patient, self.slot.id + 1000)
+
+    def make_series(self, count, start_time=time(9)):
+        return AvailabilitySlot.objects.bulk_create([
+            AvailabilitySlot(
+                doctor=self.doctor, date=timezone.now().date() + timedelta(weeks=i + 1),
+                start_time=start_time, end_time=time(start_time.hour + 1)
+            )
+            for i in range(count)
+        ])
+
+    def test_books_series_with_one_summary_email(self):
+        series = self.make_series(3)
+        bookings = book_slots(self.patient, [s.id for s in reversed(series)])
+        self.assertEqual([b.availability_slot.id for b in bookings], [s.id for s in series])
+        self.assertEqual(AvailabilitySlot.objects.filter(doctor=self.doctor, is_booked=True).count(), 3)
+        self.assertEqual(
+            sorted(EmailOutbox.objects.values_list('action', 'to_email')),
+            [('BOOKING_SUMMARY', 'doc@example.com'), ('BOOKING_SUMMARY', 'pat@example.com')]
+        )
+
+    def test_series_is_all_or_nothing(self):
+        series = self.make_series(3)
+        book_slot(self.other, series[1].id)
+        with self.assertRaises(SlotUnavailable):
+            book_slots(self.patient, [s.id for s in series])
+        self.assertFalse(Booking.objects.filter(patient=self.patient).exists())
+        self.assertEqual(AvailabilitySlot.objects.filter(doctor=self.doctor, is_booked=True).count(), 1)
+
+    def test_series_cost_does_not_grow_with_length(self):
+        one, twelve = self.make_series(1), self.make_series(12, start_time=time(11))
+        with CaptureQueriesContext(connection) as single:
+            book_slots(self.patient, [one[0].id])
+        with CaptureQueriesContext(connection) as series:
+            book_slots(self.patient, [s.id for s in twelve])
+        self.assertEqual(len(single), len(series))
+
+
+class CancelRescheduleTests(TestCase):
+
+    def setUp(self):
+        self.doctor = User.objects.create(username='doc', role='doctor', email='doc@example.com')
+        self.patient = User.objects.create(username='patient', role='patient', email='pat@example.com')
+        self.other = User.objects.create(username='other', role='patient', email='other@example.com')
+        self.day = timezone.now().date() + timedelta(days=1)
+        generate_availability([self.doctor.id], self.day, self.day, range(7), time(9), time(12), 60)
+        self.first, self.second, self.third = AvailabilitySlot.objects.filter(doctor=self.doctor)
+        self.booking = book_slot(self.patient, self.first.id)
+
+    def open_count(self):
+        return OpenSlotCount.objects.get(doctor=self.doctor, date=self.day).open_slots
+
+    def test_cancel_releases_slot(self):
+        cancel_booking(self.patient, self.booking.id)
+        self.first.refresh_from_db()
+        self.assertFalse(self.first.is_booked)
+        self.assertFalse(Booking.objects.exists())
+        self.assertEqual(self.open_count(), 3)
+        self.assertEqual(EmailOutbox.objects.filter(action='BOOKING_CANCELLED').count(), 2)
+
+    def test_doctor_can_cancel_but_other_patients_cannot(self):
+        with self.assertRaises(BookingError):
+            cancel_booking(self.other, self.booking.id)
+        cancel_booking(self.doctor, self.booking.id)
+        self.assertFalse(Booking.objects.exists())
+
+    def test_cancel_offers_slot_to_waitlist(self):
+        join_waitlist(self.other, self.doctor.id, self.day, self.day)
+        book_slots(self.patient, [self.second.id, self.third.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            cancel_booking(self.patient, self.booking.id)
+        self.assertEqual(Booking.objects.get(availability_slot=self.first).patient, self.other)
+
+    def test_admin_delete_releases_slot(self):
+        Booking.objects.filter(id=self.booking.id).delete()
+        self.first.refresh_from_db()
+        self.assertFalse(self.first.is_booked)
+        self.assertEqual(self.open_count(), 3)
+
+    def test_reschedule_moves_booking(self):
+        booking = reschedule_booking(self.patient, self.booking.id, self.third.id)
+        self.assertEqual(booking.availability_slot.id, self.third.id)
+        self.assertEqual(
+            list(AvailabilitySlot.objects.filter(is_booked=True).values_list('id', flat=True)), [self.third.id]
+        )
+        self.assertEqual(Booking.objects.get().availability_slot_id, self.third.id)
+        self.assertEqual(self.open_count(), 2)
+        self.assertEqual(EmailOutbox.objects.filter(action='BOOKING_RESCHEDULED').count(), 2)
+
+    def test_reschedule_to_booked_slot_changes_nothing(self):
+        book_slot(self.other, self.second.id)
+        with self.assertRaises(SlotUnavailable):
+            reschedule_booking(self.patient, self.booking.id, self.second.id)
+        self.assertEqual(Booking.objects.get(patient=self.patient).availability_slot_id, self.first.id)
+        self.assertEqual(self.open_count(), 1)
+
+
+    def test_reschedule_onto_stale_booking_is_unavailable(self):
+        Booking.objects.create(patient=self.other, availability_slot=self.second)
+        AvailabilitySlot.objects.filter(id=self.second.id).update(is_booked=False)
+        with self.assertRaises(SlotUnavailable):
+            reschedule_booking(self.patient, self.booking.id, self.second.id)
+        self.assertEqual(Booking.objects.get(patient=self.patient).availability_slot_id, self.first.id)
+        self.assertTrue(AvailabilitySlot.objects.get(id=self.first.id).is_booked)
+
+    def test_reschedule_view_requires_a_slot(self):
+        self.client.force_login(self.patient)
+        response = self.client.post(reverse('reschedule_appointment', args=[self.booking.id]), {'slot_id': 'x'})
+        self.assertContains(response, 'Select a new slot')
+        self.assertEqual(Booking.objects.get(patient=self.patient).availability_slot_id, self.first.id)
+
+
+class SlotHoldTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.doctor = User.objects.create(username='doc', role='doctor', email='doc@example.com')
+        self.patient = User.objects.create(username='patient', role='patient', email='pat@example.com')
+        self.other = User.objects.create(username='other', role='patient', email='other@example.com')
+        self.slot = AvailabilitySlot.objects.create(
+            doctor=self.doctor, date=timezone.now().date() + timedelta(days=1),
+            start_time=time(9), end_time=time(10)
+        )
+
+    def expire(self, slot):
+        AvailabilitySlot.objects.filter(id=slot.id).update(held_until=timezone.now() - timedelta(seconds=1))
+
+    def test_held_slot_is_reserved_for_holder(self):
+        self.assertIsNotNone(hold_slot(self.patient, self.slot.id))
+        self.assertIsNone(hold_slot(self.other, self.slot.id))
+        with self.assertRaises(SlotUnavailable):
+            book_slot(self.other, self.slot.id)
+        book_slot(self.patient, self.slot.id)
+        self.slot.refresh_from_db()
+        self.assertEqual((self.slot.is_booked, self.slot.held_by, self.slot.held_until), (True, None, None))
+
+    def test_held_slot_is_hidden_from_other_patients(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            hold_slot(self.patient, self.slot.id)
+        self.assertEqual(get_open_slots(self.doctor.id, self.other.id), [])
+        self.assertIsNotNone(get_open_slots(self.doctor.id, self.patient.id)[0].held_until)
+
+    def test_expired_hold_no_longer_blocks(self):
+        hold_slot(self.patient, self.slot.id)
+        self.expire(self.slot)
+        self.assertEqual(len(get_open_slots(self.doctor.id, self.other.id)), 1)
+        book_slot(self.other, self.slot.id)
+
+    def test_new_hold_replaces_previous(self):
+        second = AvailabilitySlot.objects.create(
+            doctor=self.doctor, date=self.slot.date, start_time=time(11), end_time=time(12)
+        )
+        hold_slot(self.patient, self.slot.id)
+        hold_slot(self.patient, second.id)
+        self.assertEqual(list(AvailabilitySlot.objects.filter(held_by=self.patient)), [second])
+
+    def test_sweeper_releases_expired_holds_in_one_update(self):
+        hold_slot(self.patient, self.slot.id)
+        self.expire(self.slot)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(release_expired_holds(), 1)
+        self.assertEqual(len([q for q in queries if q['sql'].startswith('UPDATE')]), 1)
+        self.slot.refresh_from_db()
+        self.assertIsNone(self.slot.held_until)
+
+    def test_hold_then_confirm_views(self):
+        self.client.force_login(self.patient)
+        response = self.client.post(reverse('hold_appointment', args=[self.slot.id]))
+        self.assertRedirects(response, reverse('confirm_appointment', args=[self.slot.id]))
+        self.assertContains(self.client.get(response.url), 'Confirm Booking')
+        self.client.post(reverse('book_appointment', args=[self.slot.id]))
+        self.assertTrue(Booking.objects.filter(availability_slot=self.slot, patient=self.patient).exists())
+
+
+class WaitlistTests(TestCase):
+
+    def setUp(self):
+        self.doctor = User.objects.create(username='doc', role='doctor', email='doc@example.com')
+        self.first = User.objects.create(username='first', role='patient', email='first@example.com')
+        self.second = User.objects.create(username='second', role='patient', email='second@example.com')
+        self.day = timezone.now().date() + timedelta(days=2)
+
+    def add_slot(self, start_time=time(9)):
+        return AvailabilitySlot.objects.create(
+            doctor=self.doctor, date=self.day, start_time=start_time, end_time=time(start_time.hour + 1)
+        )
+
+    def test_new_slot_goes_to_first_waiter(self):
+        join_waitlist(self.first, self.doctor.id, self.day, self.day)
+        join_waitlist(self.second, self.doctor.id, self.day, self.day)
+        with self.captureOnCommitCallbacks(execute=True):
+            slot = self.add_slot()
+        booking = Booking.objects.get(availability_slot=slot)
+        self.assertEqual(booking.patient, self.first)
+        self.assertEqual(WaitlistEntry.objects.get(patient=self.first).status, 'assigned')
+        self.assertEqual(WaitlistEntry.objects.get(patient=self.second).status, 'waiting')
+
+    def test_slot_outside_range_is_not_assigned(self):
+        join_waitlist(self.first, self.doctor.id, self.day + timedelta(days=1), self.day + timedelta(days=3))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_slot()
+        self.assertFalse(Booking.objects.exists())
+
+    def test_joining_with_open_slot_books_it(self):
+        slot = self.add_slot()
+        with self.captureOnCommitCallbacks(execute=True):
+            join_waitlist(self.first, self.doctor.id, self.day, self.day)
+        self.assertTrue(Booking.objects.filter(availability_slot=slot, patient=self.first).exists())
+
+    def test_cancelled_slot_goes_to_first_covering_waiter(self):
+        slot = self.add_slot()
+        booking = book_slot(self.second, slot.id)
+        join_waitlist(self.first, self.doctor.id, self.day + timedelta(days=1), self.day + timedelta(days=3))
+        other = User.objects.create(username='other', role='patient', email='other@example.com')
+        join_waitlist(other, self.doctor.id, self.day, self.day)
+        with self.captureOnCommitCallbacks(execute=True):
+            cancel_booking(self.second, booking.id)
+        self.assertEqual(Booking.objects.get().patient, other)
+        self.assertEqual(WaitlistEntry.objects.get(patient=self.first).status, 'waiting')
+
+    def test_offer_only_assigns_that_slot(self):
+        earlier = self.add_slot(time(8))
+        later = self.add_slot(time(10))
+        WaitlistEntry.objects.create(patient=self.first, doctor=self.doctor, start_date=self.day, end_date=self.day)
+        self.assertEqual(offer_slot(later.id).availability_slot_id, later.id)
+        earlier.refresh_from_db()
+        self.assertFalse(earlier.is_booked)
+
+    def test_offer_nobody_covers_costs_two_queries(self):
+        slot = self.add_slot()
+        join_waitlist(self.first, self.doctor.id, self.day + timedelta(days=1), self.day + timedelta(days=3))
+        with self.assertNumQueries(2):
+            self.assertIsNone(offer_slot(slot.id))
+
+    def test_bulk_generation_is_left_to_the_worker(self):
+        join_waitlist(self.first, self.doctor.id, self.day, self.day)
+        join_waitlist(self.second, self.doctor.id, self.day, self.day)
+        with self.captureOnCommitCallbacks(execute=True):
+            generate_availability([self.doctor.id], self.day, self.day, range(7), time(9), time(12), 60)
+        self.assertFalse(Booking.objects.exists())
+        call_command('process_waitlist', stdout=io.StringIO())
+        self.assertEqual(Booking.objects.count(), 2)
+        self.assertEqual(OpenSlotCount.objects.get(doctor=self.doctor, date=self.day).open_slots, 1)
+        self.assertEqual(OpenSlotCount.objects.get(doctor=self.doctor, date=self.day).open_slots, 1)
+
+    def test_empty_queue_costs_one_query(self):
+        self.add_slot()
+        with self.assertNumQueries(1):
+            self.assertEqual(fill_waitlist(self.doctor.id), 0)
+
+
+def reload_urls():
+    # The root urlconf holds a resolver for core.urls that caches its patterns
+    importlib.reload(importlib.import_module('core.urls'))
+    importlib.reload(importlib.import_module(settings.ROOT_URLCONF))
+    clear_url_caches()
+
+
+class AsyncViewTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Registered first so it runs last, after the settings override is undone
+        cls.addClassCleanup(reload_urls)
+        super().setUpClass()
+        cls.enterClassContext(override_settings(ASYNC_VIEWS=True))
+        reload_urls()
+
+    def setUp(self):
+        cache.clear()
+        self.doctor = User.objects.create(username='doc', role='doctor', first_name='Ann', last_name='Lee')
+        DoctorProfile.objects.create(user=self.doctor, specialization='Cardiology')
+        self.patient = User.objects.create(username='patient', role='patient')
+        self.day = timezone.now().date() + timedelta(days=1)
+        generate_availability([self.doctor.id], self.day, self.day, range(7), time(9), time(11), 60)
+
+    async def test_patient_dashboard(self):
+        await self.async_client.aforce_login(self.patient)
+        response = await self.async_client.get(reverse('dashboard'))
+        self.assertContains(response, 'Cardiology')
+        self.assertEqual(response.context['doctors'][0][1], self.day)
+
+    def test_async_views_are_routed(self):
+        self.assertTrue(iscoroutinefunction(resolve(reverse('dashboard')).func))
+
+    async def test_doctor_dashboard(self):
+        await self.async_client.aforce_login(self.doctor)
+        response = await self.async_client.get(reverse('dashboard'))
+        self.assertEqual(len(response.context['page']), 2)
+
+    async def test_available_slots(self):
+        await self.async_client.aforce_login(self.patient)
+        response = await self.async_client.get(reverse('view_available_slots', args=[self.doctor.id]))
+        self.assertEqual(len(response.context['slots']), 2)
+        self.assertEqual(response.context['open_this_week'], 2 if self.day.weekday() else 0)
+
+    async def test_available_slots_rejects_doctors(self):
+        await self.async_client.aforce_login(self.doctor)
+        response = await self.async_client.get(reverse('view_available_slots', args=[self.doctor.id]))
+        self.assertRedirects(response, reverse('dashboard'), fetch_redirect_response=False)
+
+
+class EmailOutboxTests(TestCase):
+
+    def setUp(self):
+        queue_emails([
+            {'action': 'SIGNUP_WELCOME', 'to': 'a@example.com', 'data': {}},
+            {'action': 'SIGNUP_WELCOME', 'to': 'b@example.com', 'data': {}},
+        ])
+
+    def process(self, result):
+        with mock.patch('core.email_service.deliver_emails', **result) as deliver:
+            before = timezone.now()
+            outcome = process_outbox()
+        return outcome, before, deliver
+
+    def test_delivered_messages_are_marked_sent(self):
+        outcome, _, deliver = self.process({'return_value': [None, None]})
+        self.assertEqual(outcome, (2, 0, 0))
+        self.assertEqual(len(deliver.call_args.args[0]), 2)
+        for message in EmailOutbox.objects.all():
+            self.assertEqual((message.status, message.attempts, message.last_error), ('sent', 1, ''))
+            self.assertIsNotNone(message.sent_at)
+
+    def test_transient_failure_is_retried_with_backoff(self):
+        outcome, before, _ = self.process({'side_effect': EmailDeliveryError('HTTP 500')})
+        self.assertEqual(outcome, (0, 2, 0))
+        for message in EmailOutbox.objects.all():
+            self.assertEqual((message.status, message.attempts, message.last_error), ('pending', 1, 'HTTP 500'))
+            self.assertGreaterEqual(message.next_attempt_at, before + timedelta(seconds=30))
+            self.assertLess(message.next_attempt_at, before + timedelta(seconds=60))
+
+    def test_rejected_message_is_retried_alone(self):
+        outcome, _, _ = self.process({'return_value': [None, 'Mailbox unavailable']})
+        self.assertEqual(outcome, (1, 1, 0))
+        retried = EmailOutbox.objects.get(to_email='b@example.com')
+        self.assertEqual((retried.status, retried.attempts, retried.last_error),
+                         ('pending', 1, 'Mailbox unavailable'))
+
+    def test_final_attempt_marks_failed(self):
+        EmailOutbox.objects.update(attempts=OUTBOX_MAX_ATTEMPTS - 1)
+        outcome, _, _ = self.process({'side_effect': EmailDeliveryError('HTTP 500')})
+        self.assertEqual(outcome, (0, 0, 2))
+        self.assertEqual(
+            set(EmailOutbox.objects.values_list('status', 'attempts')), {('failed', OUTBOX_MAX_ATTEMPTS)}
+        )
+
+    def test_open_circuit_does_not_use_an_attempt(self):
+        outcome, before, _ = self.process({'side_effect': CircuitOpenError('Email service circuit is open')})
+        self.assertEqual(outcome, (0, 2, 0))
+        for message in EmailOutbox.objects.all():
+            self.assertEqual((message.status, message.attempts), ('pending', 0))
+            self.assertGreaterEqual(message.next_attempt_at, before + timedelta(seconds=EMAIL_BREAKER_RESET_SECONDS))
+
+    def test_stale_claims_are_reclaimed(self):
+        self.assertEqual(len(claim_outbox_batch(10)), 2)
+        self.assertEqual(claim_outbox_batch(10), [])
+        lapsed = timezone.now() + timedelta(seconds=OUTBOX_CLAIM_SECONDS + 1)
+        with mock.patch('core.email_service.timezone.now', return_value=lapsed):
+            self.assertEqual(len(claim_outbox_batch(10)), 2)
+
+
+class CircuitBreakerTests(TestCase):
+
+    def setUp(self):
+        self.breaker = CircuitBreaker(threshold=2, reset_timeout=30)
+
+    def trip(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+
+    def wait_out_reset(self):
+        self.breaker.opened_at -= self.breaker.reset_timeout
+
+    def test_opens_after_threshold_failures(self):
+        self.breaker.record_failure()
+        self.assertEqual((self.breaker.state, self.breaker.allow()), ('closed', True))
+        self.breaker.record_failure()
+        self.assertEqual((self.breaker.state, self.breaker.allow()), ('open', False))
+
+    def test_success_resets_the_failure_count(self):
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, 'closed')
+
+    def test_half_open_lets_one_trial_through(self):
+        self.trip()
+        self.wait_out_reset()
+        self.assertEqual(self.breaker.state, 'half-open')
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+
+    def test_trial_success_closes(self):
+        self.trip()
+        self.wait_out_reset()
+        self.breaker.allow()
+        self.breaker.record_success()
+        self.assertEqual((self.breaker.state, self.breaker.allow()), ('closed', True))
+
+    def test_trial_failure_reopens(self):
+        self.trip()
+        self.wait_out_reset()
+        self.breaker.allow()
+        self.breaker.record_failure()
+        self.assertEqual((self.breaker.state, self.breaker.allow()), ('open', False))
+
+
+class EmailClientTests(TestCase):
+
+    def test_only_retries_requests_that_never_reached_the_function(self):
+        client = EmailClient(url='http://email.test/send', max_retries=3)
+        retry = client.session.get_adapter(client.url).max_retries
+        self.assertEqual((retry.total, retry.connect, retry.read, retry.status), (3, 3, 0, 3))
+        self.assertEqual(set(retry.status_forcelist), {429, 502, 503})
+        self.assertEqual(retry.allowed_methods, {'POST'})
+        self.assertFalse(retry.raise_on_status)
+
+    def test_open_circuit_short_circuits_calls(self):
+        client = EmailClient(url='http://email.test/send', breaker_threshold=1)
+        client.breaker.record_failure()
+        with mock.patch.object(client.session, 'post') as post, self.assertRaises(CircuitOpenError):
+            client.post({'action': 'SIGNUP_WELCOME'})
+        post.assert_not_called()
+        self.assertEqual(client.stats()['short_circuited'], 1)
+
+
+    def test_unexpected_error_frees_the_half_open_trial(self):
+        client = EmailClient(url='http://email.test/send', breaker_threshold=1, breaker_reset=30)
+        client.breaker.record_failure()
+        client.breaker.opened_at -= 30
+        with mock.patch.object(client.session, 'post', side_effect=ValueError('bad payload')):
+            with self.assertRaises(ValueError):
+                client.post({'action': 'SIGNUP_WELCOME'})
+        self.assertEqual((client.breaker.state, client.breaker.allow()), ('half-open', True))
+
+
+class AsyncEmailClientTests(TestCase):
+
+    def make_client(self, statuses):
+        calls = []
+
+        def handler(request):
+            calls.append(request)
+            return httpx.Response(statuses[min(len(calls), len(statuses)) - 1], json={})
+
+        client = AsyncEmailClient(url='http://email.test/send', max_retries=2, breaker_threshold=1)
+        client.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        return client, calls
+
+    async def test_retries_throttled_calls(self):
+        client, calls = self.make_client([503, 200])
+        await client.post({'action': 'SIGNUP_WELCOME'})
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(client.stats()['circuit'], 'closed')
+
+    async def test_server_errors_open_the_circuit(self):
+        client, calls = self.make_client([500])
+        with self.assertRaises(EmailDeliveryError):
+            await client.post({'action': 'SIGNUP_WELCOME'})
+        with self.assertRaises(EmailDeliveryError):
+            await client.post({'action': 'SIGNUP_WELCOME'})
+        self.assertEqual((len(calls), client.stats()['short_circuited']), (1, 1))
+
+
+class FakeSMTP:
+    """Stands in for an smtplib.SMTP session; `failures` are raised by successive sends"""
+
+    def __init__(self, *failures, noop=250):
+        self.failures = list(failures)
+        self.noop_code = noop
+        self.sent = []
+        self.closed = False
+
+    def send_message(self, message):
+        failure = self.failures.pop(0) if self.failures else None
+        if failure:
+            raise failure
+        self.sent.append(message['To'])
+
+    def noop(self):
+        return self.noop_code, b''
+
+    def close(self):
+        self.closed = True
+
+
+class EmailHandlerTests(TestCase):
+
+    def setUp(self):
+        email_handler._session = None
+        self.addCleanup(setattr, email_handler, '_session', None)
+
+    def invoke(self, *recipients, batch=True):
+        messages = [{'action': 'SIGNUP_WELCOME', 'to': to, 'data': {}} for to in recipients]
+        event = {'body': json.dumps({'messages': messages} if batch else messages[0])}
+        # The handler prints its errors to the function log
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = email_handler.send_email(event, None)
+        return response['statusCode'], json.loads(response['body'])
+
+    def sessions(self, *sessions):
+        return mock.patch.object(email_handler, 'open_smtp_session', side_effect=sessions)
+
+    def test_batch_reports_a_refused_message_alone(self):
+        session = FakeSMTP(None, smtplib.SMTPRecipientsRefused({}))
+        with self.sessions(session):
+            status, body = self.invoke('a@example.com', 'b@example.com', 'c@example.com')
+        self.assertEqual(status, 200)
+        self.assertEqual([r['status'] for r in body['results']], ['sent', 'error', 'sent'])
+        self.assertIs(email_handler._session, session)
+
+    def test_batch_connection_failure_fails_only_unsent_messages(self):
+        session = FakeSMTP(None, TimeoutError('timed out'))
+        with self.sessions(session):
+            status, body = self.invoke('a@example.com', 'b@example.com', 'c@example.com')
+        self.assertEqual(status, 200)
+        self.assertEqual([r['status'] for r in body['results']], ['sent', 'error', 'error'])
+        self.assertEqual((body['sent'], body['failed']), (1, 2))
+        self.assertEqual(session.sent, ['a@example.com'])
+        self.assertTrue(session.closed)
+        self.assertIsNone(email_handler._session)
+
+    def test_warm_invocations_reuse_the_session(self):
+        session = FakeSMTP()
+        with self.sessions(session) as dial:
+            self.invoke('a@example.com', batch=False)
+            self.invoke('b@example.com', batch=False)
+        self.assertEqual((dial.call_count, session.sent), (1, ['a@example.com', 'b@example.com']))
+
+    def test_idle_session_is_checked_with_noop(self):
+        stale, fresh = FakeSMTP(noop=421), FakeSMTP()
+        with self.sessions(stale, fresh):
+            self.invoke('a@example.com', batch=False)
+            email_handler._session_used_at -= email_handler.SMTP_IDLE_CHECK_SECONDS + 1
+            self.invoke('b@example.com', batch=False)
+        self.assertTrue(stale.closed)
+        self.assertEqual(fresh.sent, ['b@example.com'])
+        self.assertIs(email_handler._session, fresh)
+
+    def test_dropped_session_reconnects_once(self):
+        dropped, fresh = FakeSMTP(smtplib.SMTPServerDisconnected()), FakeSMTP()
+        with self.sessions(dropped, fresh):
+            status, _ = self.invoke('a@example.com', batch=False)
+        self.assertEqual((status, fresh.sent), (200, ['a@example.com']))
+
+    def test_second_disconnect_is_not_retried(self):
+        disconnected = smtplib.SMTPServerDisconnected
+        with self.sessions(FakeSMTP(disconnected()), FakeSMTP(None, disconnected())) as dial:
+            status, body = self.invoke('a@example.com', 'b@example.com')
+        self.assertEqual(dial.call_count, 2)
+        self.assertEqual((status, [r['status'] for r in body['results']]), (200, ['sent', 'error']))
+
+    def test_single_message_connection_failure_is_an_error(self):
+        with self.sessions(FakeSMTP(TimeoutError('timed out'))):
+            status, _ = self.invoke('a@example.com', batch=False)
+        self.assertEqual(status, 500)
+        self.assertIsNone(email_handler._session)
+
+
+class ApiTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.doctor = User.objects.create(username='doc', role='doctor', first_name='Ann', last_name='Lee')
+        DoctorProfile.objects.create(user=self.doctor, specialization='Cardiology')
+        self.patient = User.objects.create(username='patient', role='patient', first_name='Bo')
+        self.day = timezone.now().date() + timedelta(days=1)
+        generate_availability([self.doctor.id], self.day, self.day, range(7), time(9), time(14), 60)
+        self.slots = list(AvailabilitySlot.objects.filter(doctor=self.doctor).order_by('start_time'))
+        self.client.force_login(self.patient)
+
+    def test_requires_login(self):
+        self.client.logout()
+        response = self.client.get(reverse('api_doctors'))
+        self.assertEqual(response.status_code, 401)
+
+    def test_doctors(self):
+        response = self.client.get(reverse('api_doctors'), {'specialization': 'cardiology'})
+        self.assertEqual(response.json()['results'], [{
+            'id': self.doctor.id, 'name': 'Ann Lee', 'specialization': 'Cardiology',
+            'next_available_date': self.day.isoformat(),
+        }])
+
+    def test_slot_cursors_walk_both_ways(self):
+        url = reverse('api_doctor_slots', args=[self.doctor.id])
+        first = self.client.get(url, {'limit': 2}).json()
+        second = self.client.get(url, {'limit': 2, 'after': first['next']}).json()
+        third = self.client.get(url, {'limit': 2, 'after': second['next']}).json()
+        ids = [slot['id'] for page in (first, second, third) for slot in page['results']]
+        self.assertEqual(ids, [slot.id for slot in self.slots])
+        self.assertIsNone(third['next'])
+        back = self.client.get(url, {'limit': 2, 'before': third['previous']}).json()
+        self.assertEqual(back['results'], second['results'])
+
+    def test_etag_not_modified(self):
+        url = reverse('api_doctor_slots', args=[self.doctor.id])
+        response = self.client.get(url)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            book_slot(self.patient, self.slots[0].id)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_bookings_are_scoped_to_user(self):
+        other = User.objects.create(username='other', role='patient')
+        book_slot(self.patient, self.slots[0].id)
+        book_slot(other, self.slots[1].id)
+        results = self.client.get(reverse('api_bookings')).json()['results']
+        self.assertEqual([b['id'] for b in results], [Booking.objects.get(patient=self.patient).id])
+        self.client.force_login(self.doctor)
+        self.assertEqual(len(self.client.get(reverse('api_bookings')).json()['results']), 2)
+
+    def test_export_streams_ndjson_and_csv(self):
+        for slot in self.slots[:3]:
+            book_slot(self.patient, slot.id)
+        self.client.force_login(self.doctor)
+        response = self.client.get(reverse('api_bookings_export'))
+        self.assertTrue(response.streaming)
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([row['date'] for row in rows], [self.day.isoformat()] * 3)
+        response = self.client.get(reverse('api_bookings_export'), {'format': 'csv', 'to': self.day.isoformat()})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual((lines[0].split(',')[0], len(lines)), ('id', 4))
+
+
+class EarliestSlotsTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.patient = User.objects.create(username='patient', role='patient')
+        self.other = User.objects.create(username='other', role='patient')
+        self.cardiologists = []
+        for n, (hour, offset) in enumerate([(11, 1), (9, 2), (10, 1)]):
+            doctor = User.objects.create(username=f'card{n}', role='doctor')
+            DoctorProfile.objects.create(user=doctor, specialization='Cardiology')
+            day = timezone.now().date() + timedelta(days=offset)
+            generate_availability([doctor.id], day, day, range(7), time(hour), time(hour + 2), 60)
+            self.cardiologists.append(doctor)
+        self.dermatologist = User.objects.create(username='derm', role='doctor')
+        DoctorProfile.objects.create(user=self.dermatologist, specialization='Dermatology')
+        day = timezone.now().date() + timedelta(days=1)
+        generate_availability([self.dermatologist.id], day, day, range(7), time(8), time(9), 60)
+
+    def starts(self, slots):
+        return [(slot.doctor.username, slot.date - timezone.now().date(), slot.start_time) for slot in slots]
+
+    def test_soonest_slots_across_doctors_in_one_query(self):
+        with self.assertNumQueries(1):
+            slots = find_earliest_slots(['Cardiology'], limit=3)
+        self.assertEqual(self.starts(slots), [
+            ('card2', timedelta(days=1), time(10)),
+            ('card0', timedelta(days=1), time(11)),
+            ('card2', timedelta(days=1), time(11)),
+        ])
+
+    def test_skips_booked_and_held_slots(self):
+        first, second = AvailabilitySlot.objects.filter(doctor=self.cardiologists[2]).order_by('start_time')
+        book_slot(self.other, first.id)
+        hold_slot(self.other, second.id)
+        own = AvailabilitySlot.objects.filter(doctor=self.cardiologists[0]).order_by('start_time').first()
+        hold_slot(self.patient, own.id)
+        slots = find_earliest_slots(['Cardiology'], limit=2, patient_id=self.patient.id)
+        self.assertEqual([slot.id for slot in slots][:1], [own.id])
+        self.assertIsNotNone(slots[0].held_until)
+        self.assertIsNone(slots[1].held_until)
+
+    def test_falls_back_when_held_slots_fill_the_bound(self):
+        # Both of day one's open counters are taken up by holds
+        AvailabilitySlot.objects.filter(doctor__in=[self.cardiologists[0], self.cardiologists[2]]).update(
+            held_by=self.other, held_until=timezone.now() + timedelta(minutes=5)
+        )
+        slots = find_earliest_slots(['Cardiology'], limit=1)
+        self.assertEqual(self.starts(slots), [('card1', timedelta(days=2), time(9))])
+
+    def test_api_matches_specialization_case_insensitively(self):
+        self.client.force_login(self.patient)
+        response = self.client.get(reverse('api_earliest_slots'), {'specialization': 'cardiology', 'limit': 2})
+        results = response.json()['results']
+        self.assertEqual([r['doctor']['id'] for r in results], [self.cardiologists[2].id, self.cardiologists[0].id])
+        later = timezone.now().date() + timedelta(days=2)
+        response = self.client.get(
+            reverse('api_earliest_slots'), {'specialization': 'Cardiology', 'from': later.isoformat(), 'limit': 1}
+        )
+        self.assertEqual(response.json()['results'][0]['doctor']['id'], self.cardiologists[1].id)
+        self.assertEqual(self.client.get(reverse('api_earliest_slots')).status_code, 400)
+
+    def test_search_page(self):
+        self.client.force_login(self.patient)
+        response = self.client.get(reverse('earliest_slots'), {'specialization': 'Dermatology'})
+        self.assertEqual([slot.doctor_id for slot in response.context['slots']], [self.dermatologist.id])
+
+
+class UserImportTests(TestCase):
+
+    def csv_rows(self, lines):
+        return read_rows(io.StringIO('\n'.join(lines)), 'csv')
+
+    def patient_rows(self, count, start=0):
+        return [(n, {'username': f'p{n}', 'email': f'p{n}@example.com', 'first_name': 'Pat',
+                     'last_name': str(n), 'role': 'patient'}) for n in range(start, start + count)]
+
+    def test_imports_doctors_patients_and_schedules(self):
+        User.objects.create(username='taken', email='Taken@example.com', role='patient')
+        day = timezone.now().date() + timedelta(days=1)
+        cache.clear()
+        self.assertEqual(get_doctor_directory(), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            result = import_users(self.csv_rows([
+                'username,email,first_name,last_name,role,specialization,weekdays,day_start,day_end,slot_minutes',
+                'ann,ann@example.com,Ann,Lee,doctor,Cardiology,"0,1,2,3,4,5,6",09:00,10:00,30',
+                'bo,bo@example.com,Bo,Ng,patient,,,,,',
+                'dup,taken@EXAMPLE.com,Dup,Licate,patient,,,,,',
+                'nospec,nospec@example.com,No,Spec,doctor,,,,,',
+            ]), schedule_dates=(day, day))
+        self.assertEqual(len(get_doctor_directory()), 1)
+        self.assertEqual((result.created, result.skipped, result.slots_created), (2, 2, 2))
+        self.assertEqual(sorted(line for line, _ in result.errors), [4, 5])
+        ann = User.objects.get(username='ann')
+        self.assertEqual(ann.doctor_profile.specialization, 'Cardiology')
+        self.assertFalse(ann.has_usable_password())
+        self.assertTrue(User.objects.get(username='bo').patient_profile)
+        self.assertEqual(EmailOutbox.objects.filter(action='SIGNUP_WELCOME').count(), 2)
+
+    def test_queries_per_chunk_do_not_grow_with_rows(self):
+        with CaptureQueriesContext(connection) as small:
+            import_users(self.patient_rows(2))
+        with CaptureQueriesContext(connection) as large:
+            import_users(self.patient_rows(50, start=100))
+        self.assertEqual(len(small), len(large))
+        self.assertEqual(User.objects.count(), 52)
+
+    def test_rejects_duplicates_within_file_and_bad_json(self):
+        rows = read_rows(io.StringIO(
+            '{"username": "a", "email": "a@example.com", "first_name": "A", "last_name": "A"}\n'
+            '{"username": "b", "email": "A@example.com", "first_name": "B", "last_name": "B"}\n'
+            'not json\n'
+        ), 'ndjson')
+        result = import_users(rows, role='patient')
+        self.assertEqual((result.created, [line for line, _ in result.errors]), (1, [2, 3]))
+
+
+class AvailabilitySlotFormTests(TestCase):
+
+    def setUp(self):
+        self.doctor = User.objects.create(username='doc', role='doctor')
+        self.day = timezone.now().date() + timedelta(days=1)
+        AvailabilitySlot.objects.create(doctor=self.doctor, date=self.day, start_time=time(9), end_time=time(10))
+
+    def form(self, start, end, doctor=None):
+        return AvailabilitySlotForm(
+            {'date': self.day.isoformat(), 'start_time': start, 'end_time': end}, doctor=doctor or self.doctor
+        )
+
+    def test_overlapping_slot_is_rejected(self):
+        form = self.form('09:30', '10:30')
+        self.assertFalse(form.is_valid())
+        self.assertIn('overlaps your existing slot 09:00-10:00', form.non_field_errors()[0])
+
+    def test_enclosing_slot_is_rejected(self):
+        self.assertFalse(self.form('08:00', '11:00').is_valid())
+
+    def test_adjacent_slots_are_allowed(self):
+        self.assertTrue(self.form('08:00', '09:00').is_valid())
+        self.assertTrue(self.form('10:00', '11:00').is_valid())
+
+    def test_other_doctors_slots_do_not_conflict(self):
+        other = User.objects.create(username='other', role='doctor')
+        self.assertTrue(self.form('09:00', '10:00', doctor=other).is_valid())
+
+
+class SignupTests(TestCase):
+
+    def form_data(self, **overrides):
+        return {
+            'username': 'newpatient', 'email': 'New@Example.com', 'first_name': 'New', 'last_name': 'Patient',
+            'password1': 'a-Long-unusual-passphrase-42', 'password2': 'a-Long-unusual-passphrase-42',
+            **overrides,
+        }
+
+    def test_checks_username_and_email_in_one_query(self):
+        User.objects.create(username='newpatient', email='new@example.com', role='patient')
+        User.objects.create(username='newpatient1', role='patient')
+        form = PatientSignUpForm(self.form_data())
+        with CaptureQueriesContext(connection) as queries:
+            self.assertFalse(form.is_valid())
+        # The taken check plus one suggestion lookup; no COUNT(*)
+        self.assertEqual(len(queries), 2)
+        self.assertNotIn('COUNT', ' '.join(q['sql'] for q in queries))
+        self.assertIn('Try: newpatient2, newpatient3, newpatient4', form.errors['username'][0])
+        self.assertIn('email', form.errors)
+
+    def test_email_lookup_uses_the_partial_email_index(self):
+        User.objects.bulk_create([User(username=f'user{n}', email=f'user{n}@example.com') for n in range(50)])
+        if connection.vendor == 'postgresql':
+            # Tiny tables are cheaper to scan; ask whether the index is usable at all
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = matching_accounts(['newpatient'], ['new@example.com']).explain()
+        self.assertIn('user_email_ci_unique', plan)
+
+    def test_signup_creates_user_and_profile(self):
+        response = self.client.post(reverse('doctor_signup'), {**self.form_data(), 'specialization': 'Cardiology'})
+        self.assertRedirects(response, reverse('dashboard'), fetch_redirect_response=False)
+        user = User.objects.get(username='newpatient')
+        self.assertEqual((user.role, user.email, user.doctor_profile.specialization),
+                         ('doctor', 'New@Example.com', 'Cardiology'))
+        self.assertEqual(EmailOutbox.objects.get().data, {'name': 'New Patient', 'role': 'Doctor'})
+
+    def test_email_is_unique_regardless_of_case(self):
+        User.objects.create(username='first', email='same@example.com', role='patient')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            User.objects.create(username='second', email='SAME@example.com', role='patient')
+        User.objects.create(username='blank1', role='patient')
+        User.objects.create(username='blank2', role='patient')
+
+    def test_race_past_validation_reports_field(self):
+        form = PatientSignUpForm(self.form_data())
+        self.assertTrue(form.is_valid())
+        User.objects.create(username='other', email='new@example.com', role='patient')
+        with self.assertRaises(SignupConflict) as conflict:
+            form.save()
+        self.assertEqual(conflict.exception.field, 'email')
+        self.assertFalse(User.objects.filter(username='newpatient').exists())
+
+
+@override_settings(PASSWORD_HASH_ITERATIONS=1000, LOGIN_MAX_FAILURES_PER_USER=2, LOGIN_MAX_FAILURES_PER_IP=3)
+class LoginTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='pat', password='right-password', role='patient')
+
+    def login(self, password, username='pat'):
+        return self.client.post(reverse('login'), {'username': username, 'password': password})
+
+    def test_rehashes_at_new_cost_on_login(self):
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$1000$'))
+        with self.settings(PASSWORD_HASH_ITERATIONS=1500):
+            self.assertRedirects(self.login('right-password'), reverse('dashboard'), fetch_redirect_response=False)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$1500$'))
+
+    def test_failures_throttle_before_authenticating(self):
+        self.login('wrong')
+        self.login('wrong')
+        with mock.patch('core.views.authenticate') as authenticate:
+            response = self.login('right-password')
+        self.assertEqual(response.status_code, 429)
+        authenticate.assert_not_called()
+        self.assertNotIn('_auth_user_id', self.client.session)
+
+    def test_ip_limit_covers_many_usernames(self):
+        for name in ('a', 'b', 'c'):
+            self.login('wrong', username=name)
+        self.assertEqual(self.login('right-password').status_code, 429)
+
+    def test_success_clears_user_failures(self):
+        self.login('wrong')
+        self.login('right-password')
+        self.client.logout()
+        self.login('wrong')
+        self.assertEqual(self.login('right-password').status_code, 302)
+
+
+class CalendarSyncTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = StubCalendarServer().start()
+        cls.enterClassContext(override_settings(GOOGLE_CALENDAR_API_URL=cls.stub.url))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.stub.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.stub.calendars.clear()
+        self.stub.stats.update(dict.fromkeys(self.stub.stats, 0))
+        self.doctor = User.objects.create(
+            username='doc', role='doctor', google_calendar_credentials=self.credentials('doc')
+        )
+        self.patient = User.objects.create(
+            username='pat', role='patient', google_calendar_credentials=self.credentials('pat')
+        )
+        day = timezone.now().date() + timedelta(days=1)
+        generate_availability([self.doctor.id], day, day, range(7), time(9), time(13), 60)
+        self.slots = list(AvailabilitySlot.objects.filter(doctor=self.doctor))
+
+    def credentials(self, name):
+        return {'refresh_token': name, 'token_uri': f'{self.stub.url}/token', 'client_id': 'id', 'client_secret': 's'}
+
+    def test_queues_only_connected_users(self):
+        User.objects.filter(id=self.patient.id).update(google_calendar_credentials=None)
+        self.patient.refresh_from_db()
+        booking = book_slot(self.patient, self.slots[0].id)
+        self.assertEqual(
+            list(CalendarSyncTask.objects.values_list('user_id', 'booking_id', 'action')),
+            [(self.doctor.id, booking.id, 'upsert')]
+        )
+
+    def test_sync_creates_events_in_one_batch_per_user(self):
+        bookings = book_slots(self.patient, [slot.id for slot in self.slots])
+        self.assertEqual(sync_calendar_batch(), (8, 0, 0, 0))
+        self.assertEqual(self.stub.stats['batches'], 2)
+        self.assertEqual(self.stub.stats['token_refreshes'], 2)
+        self.assertEqual(len(self.stub.events('doc')), 4)
+        booking = Booking.objects.get(id=bookings[0].id)
+        self.assertEqual(booking.doctor_calendar_event_id, event_id(booking.id, self.doctor.id))
+        self.assertEqual(booking.patient_calendar_event_id, event_id(booking.id, self.patient.id))
+        self.assertFalse(CalendarSyncTask.objects.filter(status='pending').exists())
+
+    def test_reschedule_and_cancel_update_and_delete_events(self):
+        booking = book_slot(self.patient, self.slots[0].id)
+        sync_calendar_batch()
+        reschedule_booking(self.patient, booking.id, self.slots[2].id)
+        self.assertEqual(sync_calendar_batch(), (2, 0, 0, 0))
+        events = self.stub.events('pat')
+        self.assertEqual(list(events), [event_id(booking.id, self.patient.id)])
+        self.assertIn('T11:00:00', events[event_id(booking.id, self.patient.id)]['start']['dateTime'])
+        # Cached access tokens are reused
+        self.assertEqual(self.stub.stats['token_refreshes'], 2)
+
+        cancel_booking(self.patient, booking.id)
+        self.assertEqual(sync_calendar_batch(), (2, 0, 0, 0))
+        self.assertEqual(self.stub.events('pat'), {})
+        self.assertEqual(self.stub.events('doc'), {})
+
+    def test_rate_limit_defers_excess_calls(self):
+        book_slots(self.patient, [slot.id for slot in self.slots])
+        with self.settings(CALENDAR_SYNC_RATE_PER_USER=3):
+            self.assertEqual(sync_calendar_batch(), (6, 2, 0, 0))
+        self.assertEqual(CalendarSyncTask.objects.filter(status='pending').count(), 2)
+        self.assertEqual(len(self.stub.events('doc')), 3)
+
+    def test_pull_applies_changes_made_in_google(self):
+        first, second = book_slots(self.patient, [self.slots[0].id, self.slots[1].id])
+        sync_calendar_batch()
+        self.assertEqual(pull_calendar_changes(self.patient), 0)
+        self.stub.change('pat', event_id(first.id, self.patient.id), status='cancelled')
+        moved = self.stub.events('pat')[event_id(second.id, self.patient.id)]
+        self.stub.change('pat', event_id(second.id, self.patient.id),
+                         start={**moved['start'], 'dateTime': moved['start']['dateTime'].replace('T10', 'T15')})
+
+        self.assertEqual(pull_calendar_changes(self.patient), 2)
+        self.assertEqual(Booking.objects.get(id=first.id).patient_calendar_event_id, '')
+        self.assertTrue(CalendarSyncTask.objects.filter(
+            user=self.patient, booking_id=second.id, action='upsert', status='pending'
+        ).exists())
+        # The next pull only sees what changed since
+        self.assertEqual(pull_calendar_changes(self.patient), 0)
+
+
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        self.doctor = User.objects.create(username='doc', role='doctor')
+        self.patient = User.objects.create(username='patient', role='patient')
+        self.slot = AvailabilitySlot.objects.create(
+            doctor=self.doctor, date=timezone.now().date() + timedelta(days=1),
+            start_time=time(9), end_time=time(10)
+        )
+        self.client.force_login(self.patient)
+
+    def test_records_view_latency_and_queries(self):
+        requests = REQUEST_LATENCY.count('dashboard', 'GET', '200')
+        per_view = REQUEST_DB_QUERIES.count('dashboard')
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual(REQUEST_LATENCY.count('dashboard', 'GET', '200'), requests + 1)
+        self.assertEqual(REQUEST_DB_QUERIES.count('dashboard'), per_view + 1)
+        timing = dict(entry.split(';', 1) for entry in response['Server-Timing'].split(', '))
+        self.assertEqual(set(timing), {'total', 'db'})
+        self.assertNotIn('"0 queries"', timing['db'])
+
+    def test_records_lock_wait_when_booking(self):
+        waits = LOCK_WAIT.count('slot')
+        response = self.client.post(reverse('book_appointment', args=[self.slot.id]))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(LOCK_WAIT.count('slot'), waits + 1)
+        self.assertGreater(LOCK_WAIT.count('open_slot_count'), 0)
+        self.assertIn('lock;dur=', response['Server-Timing'])
+
+    async def test_records_email_latency(self):
+        client = AsyncEmailClient(url='http://email.test/send')
+        client.client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(200)))
+        sent = EMAIL_LATENCY.count('ok')
+        await client.post({'action': 'SIGNUP_WELCOME'})
+        self.assertEqual(EMAIL_LATENCY.count('ok'), sent + 1)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram('test_seconds', 'Test', ('view',), buckets=(0.5, 1))
+        REGISTRY.remove(histogram)
+        for value in (0.25, 0.5, 1, 2):
+            histogram.observe(value, 'a"b')
+        self.assertEqual(histogram.render()[2:], [
+            'test_seconds_bucket{view="a\\"b",le="0.5"} 2',
+            'test_seconds_bucket{view="a\\"b",le="1"} 3',
+            'test_seconds_bucket{view="a\\"b",le="+Inf"} 4',
+            'test_seconds_sum{view="a\\"b"} 3.75',
+            'test_seconds_count{view="a\\"b"} 4',
+        ])
+
+    @override_settings(METRICS_TOKEN='scrape-secret', METRICS_ALLOWED_IPS=[])
+    def test_metrics_endpoint_is_restricted(self):
+        self.client.get(reverse('home'))
+        response = self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer scrape-secret'})
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        self.assertIn('hms_request_duration_seconds_count{view="home",method="GET",status="200"}',
+                      response.content.decode())
+        # Loopback is what a same-host proxy looks like, so it gets no access by default
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='127.0.0.1').status_code, 404)
+        self.assertEqual(
+            self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer wrong'}).status_code, 404
+        )
+        with override_settings(METRICS_ALLOWED_IPS=['10.0.0.9']):
+            self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.9').status_code, 200)
+        User.objects.filter(id=self.patient.id).update(is_staff=True)
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.1').status_code, 200)
+
+
+@override_settings(PASSWORD_HASH_ITERATIONS=1000)
+class SeedLoadTests(TestCase):
+
+    def seed(self, **options):
+        out = io.StringIO()
+        call_command('seed_load', stdout=out, verbosity=0, **options)
+        return out.getvalue()
+
+    def test_seeds_consistent_data(self):
+        out = self.seed(doctors=3, patients=4, days=2, past_days=1, slots_per_day=4, booked=0.5)
+        self.assertIn('3 doctors, 4 patients, 36 slots', out)
+        self.assertEqual(User.objects.filter(role='doctor', doctor_profile__isnull=False).count(), 3)
+        self.assertEqual(User.objects.filter(role='patient', patient_profile__isnull=False).count(), 4)
+        self.assertEqual(AvailabilitySlot.objects.count(), 3 * 3 * 4)
+        self.assertEqual(Booking.objects.count(), AvailabilitySlot.objects.filter(is_booked=True).count())
+        self.assertEqual(
+            OpenSlotCount.objects.aggregate(total=Sum('open_slots'))['total'],
+            AvailabilitySlot.objects.filter(is_booked=False).count()
+        )
+        self.assertTrue(self.client.login(username='load-patient-3', password='load-test-password'))
+
+        with self.assertRaises(CommandError):
+            self.seed(doctors=1, patients=1)
+        self.assertIn('1 doctors, 1 patients, 1 slots', self.seed(
+            doctors=1, patients=1, days=1, past_days=0, slots_per_day=1, prefix='more'
+        ))
+        self.assertTrue(User.objects.filter(username='more-doctor-0').exists())
+
+    def test_rejects_slots_past_midnight(self):
+        with self.assertRaisesMessage(CommandError, 'reach midnight'):
+            self.seed(doctors=1, patients=1, slots_per_day=32, slot_minutes=30)
+        self.assertFalse(User.objects.exists())
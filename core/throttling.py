@@ -0,0 +1,44 @@
+"""
+Cache-backed login throttling.
+
+Failed logins are counted per client IP and per username in fixed windows
+of LOGIN_THROTTLE_WINDOW_SECONDS. Once either count reaches its limit,
+further attempts are refused before authenticate() runs, so abusive traffic
+never reaches the password hasher. Only failures count: a clinic of staff
+logging in from one NAT address is never throttled by its own successes.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+
+def _keys(request, username):
+    keys = [
+        (f'login-fail:ip:{request.META.get("REMOTE_ADDR", "")}', settings.LOGIN_MAX_FAILURES_PER_IP),
+    ]
+    if username:
+        keys.append((f'login-fail:user:{username.lower()}', settings.LOGIN_MAX_FAILURES_PER_USER))
+    return keys
+
+
+def login_blocked(request, username):
+    """Whether this IP or username has used up its failed attempts for the window"""
+    keys = _keys(request, username)
+    counts = cache.get_many([key for key, _ in keys])
+    return any(counts.get(key, 0) >= limit for key, limit in keys)
+
+
+def record_login_failure(request, username):
+    window = settings.LOGIN_THROTTLE_WINDOW_SECONDS
+    for key, _ in _keys(request, username):
+        # add() starts the window; incr() is atomic on shared caches
+        if not cache.add(key, 1, timeout=window):
+            try:
+                cache.incr(key)
+            except ValueError:
+                # The window expired between add() and incr()
+                cache.add(key, 1, timeout=window)
+
+
+def record_login_success(request, username):
+    """Clear the username's failures; the IP's keep counting down"""
+    cache.delete(f'login-fail:user:{username.lower()}')
@@ -1,5 +1,14 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import api, views
+
+if settings.ASYNC_VIEWS:
+    from . import async_views
+    dashboard_view = async_views.dashboard
+    available_slots_view = async_views.view_available_slots
+else:
+    dashboard_view = views.dashboard
+    available_slots_view = views.view_available_slots
 
 urlpatterns = [
     path('', views.home, name='home'),
@@ -7,8 +16,23 @@ urlpatterns = [
     path('signup/patient/', views.patient_signup, name='patient_signup'),
     path('login/', views.user_login, name='login'),
     path('logout/', views.user_logout, name='logout'),
-    path('dashboard/', views.dashboard, name='dashboard'),
+    path('dashboard/', dashboard_view, name='dashboard'),
     path('availability/create/', views.create_availability, name='create_availability'),
-    path('doctor/<int:doctor_id>/slots/', views.view_available_slots, name='view_available_slots'),
+    path('availability/recurring/', views.create_recurring_availability, name='create_recurring_availability'),
+    path('doctor/<int:doctor_id>/slots/', available_slots_view, name='view_available_slots'),
+    path('slots/earliest/', views.earliest_slots, name='earliest_slots'),
     path('book/<int:slot_id>/', views.book_appointment, name='book_appointment'),
+    path('book/<int:slot_id>/hold/', views.hold_appointment, name='hold_appointment'),
+    path('book/<int:slot_id>/confirm/', views.confirm_appointment, name='confirm_appointment'),
+    path('book/', views.book_appointments, name='book_appointments'),
+    path('bookings/<int:booking_id>/cancel/', views.cancel_appointment, name='cancel_appointment'),
+    path('bookings/<int:booking_id>/reschedule/', views.reschedule_appointment, name='reschedule_appointment'),
+    path('doctor/<int:doctor_id>/waitlist/', views.join_doctor_waitlist, name='join_waitlist'),
+    path('waitlist/<int:entry_id>/leave/', views.leave_doctor_waitlist, name='leave_waitlist'),
+    path('metrics', views.metrics, name='metrics'),
+    path('api/v1/doctors/', api.doctors, name='api_doctors'),
+    path('api/v1/doctors/<int:doctor_id>/slots/', api.doctor_slots, name='api_doctor_slots'),
+    path('api/v1/slots/earliest/', api.earliest_slots, name='api_earliest_slots'),
+    path('api/v1/bookings/', api.bookings, name='api_bookings'),
+    path('api/v1/bookings/export/', api.bookings_export, name='api_bookings_export'),
 ]
\ No newline at end of file
@@ -1,12 +1,38 @@
+from datetime import datetime, time
+from django.conf import settings
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db import transaction
+from django.core.paginator import Paginator
+from django.db import IntegrityError, transaction
+from django.http import Http404, HttpResponse
 from django.utils import timezone
-from .forms import DoctorSignUpForm, PatientSignUpForm, AvailabilitySlotForm
-from .models import User, AvailabilitySlot, Booking
-from .email_service import send_email
+from django.utils.crypto import constant_time_compare
+from .accounts import SignupConflict
+from .forms import (
+    DoctorSignUpForm, PatientSignUpForm, AvailabilitySlotForm, RecurringAvailabilityForm,
+    SlotWindowForm, WaitlistForm, EarliestSlotsForm,
+)
+from .models import User, AvailabilitySlot, Booking, WaitlistEntry
+from .availability import find_earliest_slots, next_available_dates, open_slots_this_week
+from .booking import (
+    book_slot, book_slots, cancel_booking, hold_slot, reschedule_booking, BookingError, SlotInPast,
+    SlotUnavailable,
+)
+from .caching import get_doctor_directory, get_open_slots, specialization_spellings, specializations
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, render_metrics
+from .pagination import keyset_paginate
+from .scheduling import generate_availability
+from .throttling import login_blocked, record_login_failure, record_login_success
+from .waitlist import join_waitlist, leave_waitlist
+
+DOCTOR_DASHBOARD_PAGE_SIZE = 50
+DOCTOR_DIRECTORY_PAGE_SIZE = 25
+EARLIEST_SLOTS_PAGE_SIZE = 20
+# Keyset orderings of the doctor dashboard's slots and appointments
+SLOT_PAGE_KEYS = ('date', 'start_time', 'id')
+BOOKING_PAGE_KEYS = ('availability_slot__date', 'availability_slot__start_time', 'id')
 
 
 def home(request):
@@ -17,14 +43,14 @@ def doctor_signup(request):
     if request.method == 'POST':
         form = DoctorSignUpForm(request.POST)
         if form.is_valid():
-            user = form.save()
-            send_email('SIGNUP_WELCOME', user.email, {
-                'name': user.get_full_name(),
-                'role': 'Doctor'
-            })
-            login(request, user)
-            messages.success(request, 'Welcome! Your doctor account has been created.')
-            return redirect('dashboard')
+            try:
+                user = form.save()
+            except SignupConflict as e:
+                form.add_error(e.field, e.message)
+            else:
+                login(request, user)
+                messages.success(request, 'Welcome! Your doctor account has been created.')
+                return redirect('dashboard')
     else:
         form = DoctorSignUpForm()
     return render(request, 'core/signup.html', {'form': form, 'role': 'Doctor'})
@@ -34,14 +60,14 @@ def patient_signup(request):
     if request.method == 'POST':
         form = PatientSignUpForm(request.POST)
         if form.is_valid():
-            user = form.save()
-            send_email('SIGNUP_WELCOME', user.email, {
-                'name': user.get_full_name(),
-                'role': 'Patient'
-            })
-            login(request, user)
-            messages.success(request, 'Welcome! Your patient account has been created.')
-            return redirect('dashboard')
+            try:
+                user = form.save()
+            except SignupConflict as e:
+                form.add_error(e.field, e.message)
+            else:
+                login(request, user)
+                messages.success(request, 'Welcome! Your patient account has been created.')
+                return redirect('dashboard')
     else:
         form = PatientSignUpForm()
     return render(request, 'core/signup.html', {'form': form, 'role': 'Patient'})
@@ -51,12 +77,20 @@ def user_login(request):
     if request.method == 'POST':
         username = request.POST['username']
         password = request.POST['password']
+        # Refused before authenticate() so throttled attempts cost no password hash
+        if login_blocked(request, username):
+            messages.error(request, 'Too many failed login attempts. Please try again later.')
+            response = render(request, 'core/login.html', status=429)
+            response['Retry-After'] = settings.LOGIN_THROTTLE_WINDOW_SECONDS
+            return response
         user = authenticate(request, username=username, password=password)
         if user:
+            record_login_success(request, username)
             login(request, user)
             messages.success(request, f'Welcome back, {user.get_full_name()}!')
             return redirect('dashboard')
         else:
+            record_login_failure(request, username)
             messages.error(request, 'Invalid username or password')
     return render(request, 'core/login.html')
 
@@ -67,21 +101,103 @@ def user_logout(request):
     return redirect('home')
 
 
+def doctor_dashboard_queries(request, doctor):
+    """
+    Build the doctor dashboard's window form and unevaluated slot and booking
+    querysets from the request, for the sync and async dashboards alike.
+    Returns (params, window, slots, bookings); params holds the window only.
+    """
+    # Show one window of slots at a time (from today onwards by default),
+    # paged by (date, start_time, id) so deep pages cost the same as the first
+    params = request.GET.copy()
+    params.setdefault('from_date', timezone.now().date().isoformat())
+    window = SlotWindowForm(params)
+    from_date = to_date = None
+    if window.is_valid():
+        from_date = window.cleaned_data['from_date']
+        to_date = window.cleaned_data['to_date']
+    
+    slots = AvailabilitySlot.objects.filter(doctor=doctor).only(
+        'id', 'date', 'start_time', 'end_time', 'is_booked'
+    )
+    bookings = Booking.objects.filter(availability_slot__doctor=doctor)
+    if from_date:
+        slots = slots.filter(date__gte=from_date)
+        bookings = bookings.filter(availability_slot__date__gte=from_date)
+    if to_date:
+        slots = slots.filter(date__lte=to_date)
+        bookings = bookings.filter(availability_slot__date__lte=to_date)
+    bookings = bookings.select_related('patient', 'availability_slot')
+    
+    for key in ('after', 'before', 'bookings_after', 'bookings_before'):
+        params.pop(key, None)
+    return params, window, slots, bookings
+
+
+def doctor_dashboard_context(request, params, window, page, bookings_page):
+    """
+    Template context for the doctor dashboard. Slots and appointments page
+    independently; each list's links keep the window and the other list's
+    current position.
+    """
+    slots_params = params.copy()
+    bookings_params = params.copy()
+    for key in ('bookings_after', 'bookings_before'):
+        if request.GET.get(key):
+            slots_params[key] = request.GET[key]
+    for key in ('after', 'before'):
+        if request.GET.get(key):
+            bookings_params[key] = request.GET[key]
+    return {
+        'slots': page,
+        'page': page,
+        'window': window,
+        'window_query': slots_params.urlencode(),
+        'bookings': bookings_page,
+        'bookings_page': bookings_page,
+        'bookings_query': bookings_params.urlencode(),
+        'today': timezone.now().date()
+    }
+
+
+def search_directory(doctors, search):
+    if not search:
+        return doctors
+    needle = search.lower()
+    return [
+        d for d in doctors
+        if needle in d.name.lower() or needle in d.specialization.lower()
+    ]
+
+
 @login_required
 def dashboard(request):
     if request.user.role == 'doctor':
-        slots = AvailabilitySlot.objects.filter(doctor=request.user).order_by('date', 'start_time')
-        bookings = Booking.objects.filter(availability_slot__doctor=request.user).select_related('patient', 'availability_slot')
-        return render(request, 'core/doctor_dashboard.html', {
-            'slots': slots,
-            'bookings': bookings
-        })
+        params, window, slots, bookings = doctor_dashboard_queries(request, request.user)
+        page = keyset_paginate(
+            slots, SLOT_PAGE_KEYS, DOCTOR_DASHBOARD_PAGE_SIZE,
+            after=request.GET.get('after'), before=request.GET.get('before')
+        )
+        bookings_page = keyset_paginate(
+            bookings, BOOKING_PAGE_KEYS, DOCTOR_DASHBOARD_PAGE_SIZE,
+            after=request.GET.get('bookings_after'), before=request.GET.get('bookings_before')
+        )
+        return render(request, 'core/doctor_dashboard.html',
+                      doctor_dashboard_context(request, params, window, page, bookings_page))
     else:
-        doctors = User.objects.filter(role='doctor')
+        search = request.GET.get('q', '').strip()
+        doctors = search_directory(get_doctor_directory(), search)
+        doctors_page = Paginator(doctors, DOCTOR_DIRECTORY_PAGE_SIZE).get_page(request.GET.get('page'))
+        next_dates = next_available_dates([d.id for d in doctors_page])
         bookings = Booking.objects.filter(patient=request.user).select_related('availability_slot__doctor')
+        waitlist = WaitlistEntry.objects.filter(patient=request.user, status='waiting').select_related('doctor')
         return render(request, 'core/patient_dashboard.html', {
-            'doctors': doctors,
-            'bookings': bookings
+            'doctors': [(d, next_dates.get(d.id)) for d in doctors_page],
+            'doctors_page': doctors_page,
+            'search': search,
+            'bookings': bookings,
+            'waitlist': waitlist,
+            'today': timezone.now().date()
         })
 
 
@@ -92,40 +208,115 @@ def create_availability(request):
         return redirect('dashboard')
     
     if request.method == 'POST':
-        form = AvailabilitySlotForm(request.POST)
+        form = AvailabilitySlotForm(request.POST, doctor=request.user)
         if form.is_valid():
             slot = form.save(commit=False)
             slot.doctor = request.user
-            slot.save()
-            messages.success(request, 'Availability slot created successfully')
-            return redirect('dashboard')
+            try:
+                with transaction.atomic():
+                    slot.save()
+            except IntegrityError:
+                # Another request created a clashing slot after validation
+                form.add_error(None, 'This slot overlaps one of your existing slots.')
+            else:
+                messages.success(request, 'Availability slot created successfully')
+                return redirect('dashboard')
     else:
-        form = AvailabilitySlotForm()
+        form = AvailabilitySlotForm(doctor=request.user)
     
     return render(request, 'core/create_availability.html', {'form': form})
 
 
+@login_required
+def create_recurring_availability(request):
+    if request.user.role != 'doctor':
+        messages.error(request, 'Only doctors can create availability slots')
+        return redirect('dashboard')
+    
+    if request.method == 'POST':
+        form = RecurringAvailabilityForm(request.POST)
+        if form.is_valid():
+            created, skipped = generate_availability([request.user.id], **form.cleaned_data)
+            messages.success(request, f'{created} availability slots created, {skipped} skipped (existing or overlapping)')
+            return redirect('dashboard')
+    else:
+        form = RecurringAvailabilityForm()
+    
+    return render(request, 'core/create_recurring_availability.html', {'form': form})
+
+
 @login_required
 def view_available_slots(request, doctor_id):
     if request.user.role != 'patient':
         messages.error(request, 'Only patients can book appointments')
         return redirect('dashboard')
     
-    doctor = get_object_or_404(User, id=doctor_id, role='doctor')
-    available_slots = AvailabilitySlot.objects.filter(
-        doctor=doctor,
-        is_booked=False,
-        date__gte=timezone.now().date()
-    ).order_by('date', 'start_time')
+    doctor = get_object_or_404(User.objects.select_related('doctor_profile'), id=doctor_id, role='doctor')
+    available_slots = get_open_slots(doctor.id, request.user.id)
     
     return render(request, 'core/available_slots.html', {
         'doctor': doctor,
-        'slots': available_slots
+        'slots': available_slots,
+        'open_this_week': open_slots_this_week(doctor.id),
+        'waitlist_form': WaitlistForm()
     })
 
 
 @login_required
-@transaction.atomic
+def earliest_slots(request):
+    """The soonest open slots across every doctor of a specialization"""
+    if request.user.role != 'patient':
+        messages.error(request, 'Only patients can book appointments')
+        return redirect('dashboard')
+    
+    form = EarliestSlotsForm(request.GET or None, specializations=specializations())
+    slots = None
+    if form.is_valid():
+        after = form.cleaned_data['after']
+        if after:
+            after = timezone.make_aware(datetime.combine(after, time.min))
+        slots = find_earliest_slots(
+            specialization_spellings(form.cleaned_data['specialization']), after,
+            EARLIEST_SLOTS_PAGE_SIZE, request.user.id
+        )
+    
+    return render(request, 'core/earliest_slots.html', {'form': form, 'slots': slots})
+
+
+@login_required
+def hold_appointment(request, slot_id):
+    """Reserve a slot for a few minutes while the patient confirms the booking"""
+    if request.user.role != 'patient':
+        messages.error(request, 'Only patients can book appointments')
+        return redirect('dashboard')
+    
+    if request.method != 'POST':
+        messages.warning(request, 'Invalid request')
+        return redirect('dashboard')
+    
+    slot = hold_slot(request.user, slot_id)
+    if slot is None:
+        messages.error(request, 'This slot is no longer available or is being booked by someone else')
+        return redirect('dashboard')
+    return redirect('confirm_appointment', slot_id=slot.id)
+
+
+@login_required
+def confirm_appointment(request, slot_id):
+    if request.user.role != 'patient':
+        messages.error(request, 'Only patients can book appointments')
+        return redirect('dashboard')
+    
+    slot = AvailabilitySlot.objects.select_related('doctor').filter(
+        id=slot_id, held_by=request.user, held_until__gt=timezone.now(), is_booked=False
+    ).first()
+    if slot is None:
+        messages.warning(request, 'Your reservation for this slot has expired. Please choose a slot again.')
+        return redirect('dashboard')
+    return render(request, 'core/confirm_appointment.html', {'slot': slot})
+
+
+@login_required
 def book_appointment(request, slot_id):
     if request.user.role != 'patient':
         messages.error(request, 'Only patients can book appointments')
@@ -133,52 +324,155 @@ def book_appointment(request, slot_id):
     
     if request.method == 'POST':
         try:
-            # Use select_for_update to prevent race conditions
-            slot = AvailabilitySlot.objects.select_for_update().get(
-                id=slot_id,
-                is_booked=False
-            )
-        except AvailabilitySlot.DoesNotExist:
-            messages.error(request, 'This slot is no longer available or does not exist')
-            return redirect('dashboard')
-        
-        # Check if slot is in the past
-        if slot.date < timezone.now().date():
+            booking = book_slot(request.user, slot_id)
+        except SlotInPast:
             messages.error(request, 'Cannot book past slots')
             return redirect('dashboard')
+        except SlotUnavailable:
+            messages.error(request, 'This slot is no longer available or does not exist')
+            return redirect('dashboard')
         
-        # Create booking
-        booking = Booking.objects.create(
-            patient=request.user,
-            availability_slot=slot
-        )
-        
-        # Mark slot as booked
-        slot.is_booked = True
-        slot.save()
-        
-        # Send confirmation emails
-        try:
-            send_email('BOOKING_CONFIRMATION', request.user.email, {
-                'patient_name': request.user.get_full_name(),
-                'doctor_name': slot.doctor.get_full_name(),
-                'date': slot.date.strftime('%Y-%m-%d'),
-                'time': slot.start_time.strftime('%H:%M')
-            })
-            
-            send_email('BOOKING_CONFIRMATION', slot.doctor.email, {
-                'patient_name': request.user.get_full_name(),
-                'doctor_name': slot.doctor.get_full_name(),
-                'date': slot.date.strftime('%Y-%m-%d'),
-                'time': slot.start_time.strftime('%H:%M')
-            })
-        except Exception as e:
-            # Log email error but don't fail the booking
-            print(f"Email sending failed: {e}")
-        
-        messages.success(request, f'Appointment booked successfully with Dr. {slot.doctor.get_full_name()}!')
+        doctor = booking.availability_slot.doctor
+        messages.success(request, f'Appointment booked successfully with Dr. {doctor.get_full_name()}!')
         return redirect('dashboard')
     
     # If not POST, redirect to dashboard
     messages.warning(request, 'Invalid request')
-    return redirect('dashboard')
\ No newline at end of file
+    return redirect('dashboard')
+
+
+@login_required
+def book_appointments(request):
+    """Book several selected slots at once; either all are booked or none"""
+    if request.user.role != 'patient':
+        messages.error(request, 'Only patients can book appointments')
+        return redirect('dashboard')
+    
+    if request.method != 'POST':
+        messages.warning(request, 'Invalid request')
+        return redirect('dashboard')
+    
+    try:
+        slot_ids = [int(slot_id) for slot_id in request.POST.getlist('slot_ids')]
+    except ValueError:
+        slot_ids = []
+    if not slot_ids:
+        messages.error(request, 'Select at least one slot to book')
+        return redirect('dashboard')
+    
+    try:
+        bookings = book_slots(request.user, slot_ids)
+    except SlotInPast:
+        messages.error(request, 'Cannot book past slots')
+        return redirect('dashboard')
+    except SlotUnavailable:
+        messages.error(request, 'One or more selected slots are no longer available; nothing was booked')
+        return redirect('dashboard')
+    except BookingError as e:
+        messages.error(request, str(e))
+        return redirect('dashboard')
+    
+    messages.success(request, f'{len(bookings)} appointments booked successfully!')
+    return redirect('dashboard')
+
+
+@login_required
+def join_doctor_waitlist(request, doctor_id):
+    if request.user.role != 'patient':
+        messages.error(request, 'Only patients can join a waitlist')
+        return redirect('dashboard')
+    
+    doctor = get_object_or_404(User, id=doctor_id, role='doctor')
+    if request.method == 'POST':
+        form = WaitlistForm(request.POST)
+        if form.is_valid():
+            join_waitlist(request.user, doctor.id, **form.cleaned_data)
+            messages.success(
+                request,
+                f'You are on the waitlist for Dr. {doctor.get_full_name()}. '
+                'The first matching slot will be booked for you automatically.'
+            )
+            return redirect('dashboard')
+        for error in form.non_field_errors():
+            messages.error(request, error)
+        return redirect('view_available_slots', doctor_id=doctor.id)
+    
+    messages.warning(request, 'Invalid request')
+    return redirect('dashboard')
+
+
+@login_required
+def leave_doctor_waitlist(request, entry_id):
+    if request.method == 'POST' and leave_waitlist(request.user, entry_id):
+        messages.success(request, 'You have left the waitlist')
+    else:
+        messages.warning(request, 'Invalid request')
+    return redirect('dashboard')
+
+
+@login_required
+def cancel_appointment(request, booking_id):
+    if request.method != 'POST':
+        messages.warning(request, 'Invalid request')
+        return redirect('dashboard')
+    
+    try:
+        cancel_booking(request.user, booking_id)
+    except SlotInPast:
+        messages.error(request, 'Past appointments cannot be cancelled')
+    except BookingError as e:
+        messages.error(request, str(e))
+    else:
+        messages.success(request, 'Appointment cancelled')
+    return redirect('dashboard')
+
+
+@login_required
+def reschedule_appointment(request, booking_id):
+    if request.user.role != 'patient':
+        messages.error(request, 'Only patients can reschedule appointments')
+        return redirect('dashboard')
+    
+    booking = get_object_or_404(
+        Booking.objects.select_related('availability_slot__doctor'), id=booking_id, patient=request.user
+    )
+    if request.method == 'POST':
+        slot_id = request.POST.get('slot_id', '')
+        if not slot_id.isdecimal():
+            messages.error(request, 'Select a new slot')
+        else:
+            try:
+                reschedule_booking(request.user, booking.id, int(slot_id))
+            except SlotInPast:
+                messages.error(request, 'Past slots cannot be rescheduled or booked')
+            except SlotUnavailable:
+                messages.error(request, 'That slot is no longer available')
+            except BookingError as e:
+                messages.error(request, str(e))
+            else:
+                messages.success(request, 'Appointment rescheduled')
+                return redirect('dashboard')
+    
+    doctor = booking.availability_slot.doctor
+    return render(request, 'core/reschedule_appointment.html', {
+        'booking': booking,
+        'doctor': doctor,
+        'slots': get_open_slots(doctor.id, request.user.id)
+    })
+
+
+def metrics_allowed(request):
+    """Staff, a scraper sending METRICS_TOKEN, or an address in METRICS_ALLOWED_IPS"""
+    if request.user.is_staff:
+        return True
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if settings.METRICS_TOKEN and scheme.lower() == 'bearer' and constant_time_compare(token, settings.METRICS_TOKEN):
+        return True
+    return request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS
+
+
+def metrics(request):
+    """This process's metrics in the Prometheus text format, for scrapers and staff"""
+    if not metrics_allowed(request):
+        raise Http404
+    return HttpResponse(render_metrics(), content_type=METRICS_CONTENT_TYPE)
@@ -0,0 +1,157 @@
+from django.db import transaction
+from django.utils import timezone
+from .availability import adjust_open_slots, unheld
+from .caching import invalidate_open_slots
+from .calendar_sync import queue_calendar_upserts
+from .email_service import queue_email
+from .models import User, AvailabilitySlot, Booking, WaitlistEntry
+
+# Waiting entries considered per doctor each time the queue is drained
+WAITLIST_BATCH_SIZE = 100
+# Covering entries a single freed slot is offered to before giving up
+# (more are only needed when other workers hold the first ones locked)
+WAITLIST_OFFER_ATTEMPTS = 3
+
+
+def join_waitlist(patient, doctor_id, start_date, end_date):
+    """
+    Put a patient in a doctor's queue, or update the dates of their existing
+    place, and try to assign it a slot straight away once the entry commits.
+    """
+    with transaction.atomic():
+        entry, created = WaitlistEntry.objects.update_or_create(
+            patient=patient, doctor_id=doctor_id, status='waiting',
+            defaults={'start_date': start_date, 'end_date': end_date}
+        )
+        entry_id = entry.id
+        transaction.on_commit(lambda: assign_next_slot(entry_id), robust=True)
+    return entry
+
+
+def leave_waitlist(patient, entry_id):
+    """Cancel a patient's waiting entry; returns whether one was cancelled"""
+    return WaitlistEntry.objects.filter(
+        id=entry_id, patient=patient, status='waiting'
+    ).update(status='cancelled') > 0
+
+
+def assign_next_slot(entry_id, slot_id=None):
+    """
+    Give a waiting entry the earliest open slot in its date range (or only
+    slot_id, if given), in one transaction. Entries and slots already locked
+    by another worker, and slots held for other patients, are skipped.
+    Returns the Booking, or None if nothing was assigned.
+    """
+    now = timezone.now()
+    today = now.date()
+    with transaction.atomic():
+        entry = WaitlistEntry.objects.select_for_update(skip_locked=True).filter(
+            id=entry_id, status='waiting', end_date__gte=today
+        ).first()
+        if entry is None:
+            return None
+        slots = AvailabilitySlot.objects.select_for_update(skip_locked=True).filter(
+            unheld(entry.patient_id, now), doctor_id=entry.doctor_id, is_booked=False,
+            date__range=(max(entry.start_date, today), entry.end_date)
+        )
+        if slot_id is not None:
+            slots = slots.filter(id=slot_id)
+        slot = slots.order_by('date', 'start_time').first()
+        if slot is None:
+            return None
+        # The row count re-checks the claim where row locks are unsupported
+        if not AvailabilitySlot.objects.filter(
+            unheld(entry.patient_id, now), id=slot.id, is_booked=False
+        ).update(is_booked=True, held_by=None, held_until=None):
+            return None
+        slot.is_booked = True
+
+        booking = Booking.objects.create(patient_id=entry.patient_id, availability_slot=slot)
+        entry.status = 'assigned'
+        entry.booking = booking
+        entry.save(update_fields=['status', 'booking'])
+
+        people = User.objects.only('first_name', 'last_name', 'email', 'google_calendar_credentials').in_bulk(
+            [entry.patient_id, entry.doctor_id]
+        )
+        patient, doctor = people[entry.patient_id], people[entry.doctor_id]
+        slot.doctor = doctor
+        email_data = {
+            'patient_name': patient.get_full_name(),
+            'doctor_name': doctor.get_full_name(),
+            'date': slot.date.strftime('%Y-%m-%d'),
+            'time': slot.start_time.strftime('%H:%M')
+        }
+        queue_email('BOOKING_CONFIRMATION', patient.email, email_data)
+        queue_email('BOOKING_CONFIRMATION', doctor.email, email_data)
+        queue_calendar_upserts([(patient, booking.id), (doctor, booking.id)])
+
+        adjust_open_slots(slot.doctor_id, slot.date, -1)
+        invalidate_open_slots(slot.doctor_id)
+    return booking
+
+
+def offer_slot(slot_id):
+    """
+    Give one newly opened slot to the first waiting patient whose date range
+    covers it. The queue is read once, through the queue index, for the
+    entries covering the slot's date; only that slot is assigned. Returns the
+    Booking, or None if the slot is gone or nobody is waiting for that day.
+    """
+    today = timezone.now().date()
+    slot = AvailabilitySlot.objects.filter(
+        id=slot_id, is_booked=False, date__gte=today
+    ).values_list('doctor_id', 'date').first()
+    if slot is None:
+        return None
+    doctor_id, date = slot
+    entry_ids = list(
+        WaitlistEntry.objects.filter(
+            doctor_id=doctor_id, status='waiting', start_date__lte=date, end_date__gte=date
+        ).order_by('created_at', 'id').values_list('id', flat=True)[:WAITLIST_OFFER_ATTEMPTS]
+    )
+    for entry_id in entry_ids:
+        booking = assign_next_slot(entry_id, slot_id)
+        if booking:
+            return booking
+    return None
+
+
+def offer_slot_on_commit(slot_id):
+    """Offer a slot to the waitlist once the caller's transaction commits"""
+    # A failed offer must not turn the committed write into an error response
+    transaction.on_commit(lambda: offer_slot(slot_id), robust=True)
+
+
+def fill_waitlist(doctor_id):
+    """
+    Assign a doctor's open slots to waiting patients in queue order.
+    Walks the queue index only; stops as soon as the doctor has no open
+    future slots left. One transaction per entry, so this is for workers
+    and commands (process_waitlist), not request paths.
+    Returns the number of bookings made.
+    """
+    today = timezone.now().date()
+    open_slots = AvailabilitySlot.objects.filter(doctor_id=doctor_id, is_booked=False, date__gte=today)
+    entry_ids = list(
+        WaitlistEntry.objects.filter(doctor_id=doctor_id, status='waiting', end_date__gte=today)
+        .order_by('created_at', 'id').values_list('id', flat=True)[:WAITLIST_BATCH_SIZE]
+    )
+    assigned = 0
+    for entry_id in entry_ids:
+        if assign_next_slot(entry_id):
+            assigned += 1
+        elif not open_slots.exists():
+            break
+    return assigned
+
+
+def fill_waitlists(doctor_ids=None):
+    """Drain the queues of the given doctors (default: all) that have waiting patients"""
+    doctors = WaitlistEntry.objects.filter(status='waiting', end_date__gte=timezone.now().date())
+    if doctor_ids is not None:
+        doctors = doctors.filter(doctor_id__in=doctor_ids)
+    return sum(
+        fill_waitlist(doctor_id)
+        for doctor_id in doctors.values_list('doctor_id', flat=True).distinct().order_by('doctor_id')
+    )
@@ -0,0 +1,85 @@
+"""
+Compare single-message and batched sends through the email handler.
+
+Runs the Lambda handler in-process against a local stub SMTP server and
+reports messages per second for:
+  * single  - one handler invocation per message
+  * batched - messages grouped into one invocation per batch
+The cached SMTP session is dropped after every invocation, so this compares
+one session per message with one session per batch. --warm keeps the session
+across invocations instead and measures only the per-invocation overhead;
+see benchmark_invocations.py for cold starts.
+
+Usage:
+    python benchmark_batch.py --messages 200 --batch-size 20 --latency-ms 5 [--warm]
+"""
+import argparse
+import json
+import os
+import time
+
+from stub_smtp import StubSMTPServer
+
+
+def booking_message(i):
+    return {
+        'action': 'BOOKING_CONFIRMATION',
+        'to': f'patient{i}@example.com',
+        'data': {
+            'patient_name': f'Patient {i}',
+            'doctor_name': 'Dr. Example',
+            'date': '2026-01-01',
+            'time': '09:00',
+        },
+    }
+
+
+def run(label, server, payloads, warm):
+    from handler import drop_smtp_session, send_email
+    drop_smtp_session()
+    before = dict(server.stats)
+    start = time.perf_counter()
+    for payload in payloads:
+        response = send_email({'body': json.dumps(payload)}, None)
+        if response['statusCode'] != 200:
+            raise RuntimeError(f"{label}: handler returned {response}")
+        if not warm:
+            drop_smtp_session()
+    elapsed = time.perf_counter() - start
+    sent = server.stats['messages'] - before['messages']
+    sessions = server.stats['connections'] - before['connections']
+    print(f"{label:<8} {sent:>6} msgs  {sessions:>5} sessions  "
+          f"{elapsed:8.3f}s  {sent / elapsed:10.1f} msgs/s")
+    return sent / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--batch-size', type=int, default=20)
+    parser.add_argument('--latency-ms', type=float, default=2.0,
+                        help='Delay added to every SMTP reply to emulate network round trips')
+    parser.add_argument('--warm', action='store_true',
+                        help='Keep the SMTP session across invocations, as a warm container does')
+    args = parser.parse_args()
+
+    messages = [booking_message(i) for i in range(args.messages)]
+    with StubSMTPServer(latency=args.latency_ms / 1000.0) as server:
+        os.environ.update({
+            'SMTP_SERVER': '127.0.0.1',
+            'SMTP_PORT': str(server.port),
+            'SMTP_USERNAME': 'bench@example.com',
+            'SMTP_PASSWORD': 'bench',
+            'SMTP_USE_TLS': 'false',
+        })
+        single = run('single', server, messages, args.warm)
+        batches = [
+            {'messages': messages[i:i + args.batch_size]}
+            for i in range(0, len(messages), args.batch_size)
+        ]
+        batched = run('batched', server, batches, args.warm)
+    print(f"speedup  {batched / single:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
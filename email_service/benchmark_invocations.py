@@ -0,0 +1,95 @@
+"""
+Cold-start and warm-invocation cost of the email handler.
+
+Each cold start is a fresh Python process (like a new Lambda container) that
+imports the handler and invokes it --invocations times against a local stub
+SMTP server. Reports, as medians over --cold-starts containers, the module
+import (init) time, the first invocation, warm p50/p99 and the container's
+peak RSS. Pass --handler to measure another version of handler.py, e.g. one
+saved with `git show <rev>:email_service/handler.py > /tmp/old_handler.py`.
+
+Usage:
+    python benchmark_invocations.py --cold-starts 5 --invocations 200 --latency-ms 2
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from stub_smtp import StubSMTPServer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Runs inside each fresh process; prints one JSON line of measurements
+CONTAINER = """
+import importlib.util, json, resource, sys, time
+path, invocations = sys.argv[1], int(sys.argv[2])
+event = {'body': json.dumps({
+    'action': 'BOOKING_CONFIRMATION', 'to': 'patient@example.com',
+    'data': {'patient_name': 'Patient', 'doctor_name': 'Dr. Example', 'date': '2026-01-01', 'time': '09:00'},
+})}
+started = time.perf_counter()
+spec = importlib.util.spec_from_file_location('handler', path)
+handler = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(handler)
+imported = time.perf_counter()
+timings = []
+for _ in range(invocations):
+    begin = time.perf_counter()
+    response = handler.send_email(event, None)
+    timings.append(time.perf_counter() - begin)
+    assert response['statusCode'] == 200, response
+print(json.dumps({
+    'init': imported - started,
+    'timings': timings,
+    # ru_maxrss is in KiB on Linux
+    'rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+}))
+"""
+
+
+def percentile(samples, pct):
+    return statistics.quantiles(samples, n=100, method='inclusive')[pct - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--handler', default=os.path.join(HERE, 'handler.py'))
+    parser.add_argument('--cold-starts', type=int, default=5)
+    parser.add_argument('--invocations', type=int, default=200)
+    parser.add_argument('--latency-ms', type=float, default=2.0,
+                        help='Delay added to every SMTP reply to emulate network round trips')
+    args = parser.parse_args()
+
+    containers = []
+    with StubSMTPServer(latency=args.latency_ms / 1000.0) as server:
+        env = dict(
+            os.environ,
+            SMTP_SERVER='127.0.0.1',
+            SMTP_PORT=str(server.port),
+            SMTP_USERNAME='bench@example.com',
+            SMTP_PASSWORD='bench',
+            SMTP_USE_TLS='false',
+        )
+        for _ in range(args.cold_starts):
+            output = subprocess.run(
+                [sys.executable, '-c', CONTAINER, args.handler, str(args.invocations)],
+                env=env, capture_output=True, text=True, check=True,
+            ).stdout
+            containers.append(json.loads(output.strip().splitlines()[-1]))
+        stats = dict(server.stats)
+
+    warm = [t * 1000 for c in containers for t in c['timings'][1:]]
+    init = statistics.median(c['init'] * 1000 for c in containers)
+    first = statistics.median(c['timings'][0] * 1000 for c in containers)
+    print(f"handler     {args.handler}")
+    print(f"cold start  init={init:7.2f}ms first_invocation={first:7.2f}ms total={init + first:7.2f}ms")
+    print(f"warm        p50={percentile(warm, 50):7.2f}ms p99={percentile(warm, 99):7.2f}ms n={len(warm)}")
+    print(f"memory      peak_rss={statistics.median(c['rss'] for c in containers):6.1f}MiB")
+    print(f"smtp        connections={stats['connections']} logins={stats['logins']} messages={stats['messages']}")
+
+
+if __name__ == '__main__':
+    main()
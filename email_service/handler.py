@@ -1,12 +1,264 @@
 import json
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 import os
+import time
+
+# Read once per container. Lambda reuses a warm container for many
+# invocations, so everything here is paid for once, at cold start.
+SMTP_SERVER = os.environ.get('SMTP_SERVER', 'smtp.gmail.com')
+SMTP_PORT = int(os.environ.get('SMTP_PORT', '587'))
+SMTP_USERNAME = os.environ.get('SMTP_USERNAME', '')
+SMTP_PASSWORD = os.environ.get('SMTP_PASSWORD', '')
+SMTP_USE_TLS = os.environ.get('SMTP_USE_TLS', 'true').lower() == 'true'
+SMTP_TIMEOUT = float(os.environ.get('SMTP_TIMEOUT', '10'))
+# A cached session idle for longer than this is checked with NOOP before use
+SMTP_IDLE_CHECK_SECONDS = float(os.environ.get('SMTP_IDLE_CHECK_SECONDS', '5'))
+
+RESPONSE_HEADERS = {
+    'Content-Type': 'application/json',
+    'Access-Control-Allow-Origin': '*'
+}
+
+
+# Each template is an f-string in its own function: Python compiles it once,
+# at import, and rendering is a single string build per message.
+def _signup_welcome(data):
+    return f"""
+        <html>
+            <body>
+                <h2>Welcome {data.get('name', 'User')}!</h2>
+                <p>Thank you for signing up as a {data.get('role', 'user')}.</p>
+                <p>You can now access all features of our Hospital Management System.</p>
+                <br>
+                <p>Best regards,<br>HMS Team</p>
+            </body>
+        </html>
+        """
+
+
+def _booking_confirmation(data):
+    return f"""
+        <html>
+            <body>
+                <h2>Appointment Confirmed!</h2>
+                <p>Dear {data.get('patient_name', 'Patient')},</p>
+                <p>Your appointment has been successfully booked:</p>
+                <ul>
+                    <li><strong>Doctor:</strong> {data.get('doctor_name', 'N/A')}</li>
+                    <li><strong>Date:</strong> {data.get('date', 'N/A')}</li>
+                    <li><strong>Time:</strong> {data.get('time', 'N/A')}</li>
+                </ul>
+                <p>Please arrive 10 minutes before your appointment time.</p>
+                <br>
+                <p>Best regards,<br>HMS Team</p>
+            </body>
+        </html>
+        """
+
+
+def _booking_summary(data):
+    rows = ''.join(
+        f"<li>{a.get('date', 'N/A')} at {a.get('time', 'N/A')} with {a.get('doctor_name', 'N/A')}</li>"
+        for a in data.get('appointments', [])
+    )
+    return f"""
+        <html>
+            <body>
+                <h2>Appointments Confirmed!</h2>
+                <p>The following appointments for {data.get('patient_name', 'Patient')} have been booked:</p>
+                <ul>{rows}</ul>
+                <p>Please arrive 10 minutes before each appointment time.</p>
+                <br>
+                <p>Best regards,<br>HMS Team</p>
+            </body>
+        </html>
+        """
+
+
+def _booking_cancelled(data):
+    return f"""
+        <html>
+            <body>
+                <h2>Appointment Cancelled</h2>
+                <p>The following appointment for {data.get('patient_name', 'Patient')} has been cancelled:</p>
+                <ul>
+                    <li><strong>Doctor:</strong> {data.get('doctor_name', 'N/A')}</li>
+                    <li><strong>Date:</strong> {data.get('date', 'N/A')}</li>
+                    <li><strong>Time:</strong> {data.get('time', 'N/A')}</li>
+                </ul>
+                <br>
+                <p>Best regards,<br>HMS Team</p>
+            </body>
+        </html>
+        """
+
+
+def _booking_rescheduled(data):
+    return f"""
+        <html>
+            <body>
+                <h2>Appointment Rescheduled</h2>
+                <p>The appointment for {data.get('patient_name', 'Patient')} with {data.get('doctor_name', 'N/A')}
+                on {data.get('previous_date', 'N/A')} at {data.get('previous_time', 'N/A')} has been moved to:</p>
+                <ul>
+                    <li><strong>Date:</strong> {data.get('date', 'N/A')}</li>
+                    <li><strong>Time:</strong> {data.get('time', 'N/A')}</li>
+                </ul>
+                <p>Please arrive 10 minutes before your appointment time.</p>
+                <br>
+                <p>Best regards,<br>HMS Team</p>
+            </body>
+        </html>
+        """
+
+
+# action -> (subject, render function)
+TEMPLATES = {
+    'SIGNUP_WELCOME': ('Welcome to Hospital Management System', _signup_welcome),
+    'BOOKING_CONFIRMATION': ('Appointment Confirmation', _booking_confirmation),
+    'BOOKING_SUMMARY': ('Appointments Confirmed', _booking_summary),
+    'BOOKING_CANCELLED': ('Appointment Cancelled', _booking_cancelled),
+    'BOOKING_RESCHEDULED': ('Appointment Rescheduled', _booking_rescheduled),
+}
+
+
+def build_email(action, data):
+    """
+    Return (subject, html_content) for an action, or None if the action is unknown
+    """
+    template = TEMPLATES.get(action)
+    if template is None:
+        return None
+    subject, render = template
+    return subject, render(data)
+
+
+def build_message(to_email, subject, html_content):
+    # Imported on first use: invocations that send nothing never load them
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+
+    message = MIMEMultipart('alternative')
+    message['Subject'] = subject
+    message['From'] = SMTP_USERNAME
+    message['To'] = to_email
+    message.attach(MIMEText(html_content, 'html'))
+    return message
+
+
+def open_smtp_session():
+    """
+    Open one authenticated SMTP session using the module configuration
+    """
+    # smtplib pulls in ssl; load it only when a container first sends
+    import smtplib
+
+    server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT, timeout=SMTP_TIMEOUT)
+    try:
+        if SMTP_USE_TLS:
+            server.starttls()
+        if SMTP_USERNAME:
+            server.login(SMTP_USERNAME, SMTP_PASSWORD)
+    except Exception:
+        server.close()
+        raise
+    return server
+
+
+# The SMTP session kept open across warm invocations, and when it was last used
+_session = None
+_session_used_at = 0.0
+
+
+def get_smtp_session():
+    """
+    Return the cached SMTP session, checking it with NOOP if it has been
+    idle (the container may have been frozen, or the server may have timed
+    it out), and reconnecting if it is gone.
+    """
+    global _session, _session_used_at
+    if _session is not None and time.monotonic() - _session_used_at > SMTP_IDLE_CHECK_SECONDS:
+        try:
+            healthy = _session.noop()[0] == 250
+        except Exception:
+            healthy = False
+        if not healthy:
+            drop_smtp_session()
+    if _session is None:
+        _session = open_smtp_session()
+        _session_used_at = time.monotonic()
+    return _session
+
+
+def drop_smtp_session():
+    global _session
+    if _session is not None:
+        try:
+            _session.close()
+        except Exception:
+            pass
+        _session = None
+
+
+def _fail_pending(outgoing, error):
+    # Report the messages not sent yet as failed, so the caller retries only those
+    for result, _ in outgoing:
+        if result['status'] == 'pending':
+            result['status'] = 'error'
+            result['error'] = str(error)
+
+
+def _deliver(outgoing, batch):
+    """
+    Send the messages over the cached SMTP session. A lost session is
+    re-dialled once. In a batch, a rejected message is reported on its own
+    and a session failure marks only the unsent messages as errors, so the
+    messages already sent are never sent again; a single message raises.
+    """
+    import smtplib
+    global _session_used_at
+
+    reconnected = False
+    refused = None
+    try:
+        server = get_smtp_session()
+        for result, message in outgoing:
+            while True:
+                try:
+                    server.send_message(message)
+                    result['status'] = 'sent'
+                except smtplib.SMTPServerDisconnected:
+                    drop_smtp_session()
+                    if reconnected:
+                        raise
+                    # A cached session dropped between the health check and
+                    # the send: dial once more and retry this message
+                    reconnected = True
+                    server = get_smtp_session()
+                    continue
+                except smtplib.SMTPException as e:
+                    # Refused by the server; the session is still usable
+                    result['status'] = 'error'
+                    result['error'] = str(e)
+                    refused = e
+                break
+            _session_used_at = time.monotonic()
+    except OSError as e:
+        # Timeouts, resets and lost sessions leave the session unusable
+        drop_smtp_session()
+        if not batch:
+            raise
+        _fail_pending(outgoing, e)
+    if refused is not None and not batch:
+        raise refused
+
 
 def send_email(event, context):
     """
     Serverless function to send emails
+
+    The body is either a single message {"action", "to", "data"} or a batch
+    {"messages": [...]} of such messages, all delivered over one SMTP session,
+    which is kept open for later invocations of the same container.
     """
     try:
         # Parse the request body
@@ -14,87 +266,57 @@ def send_email(event, context):
             body = json.loads(event['body'])
         else:
             body = event.get('body', event)
-        
-        action = body.get('action')
-        to_email = body.get('to')
-        data = body.get('data', {})
-        
-        # Email configuration from environment variables
-        smtp_server = os.environ.get('SMTP_SERVER', 'smtp.gmail.com')
-        smtp_port = int(os.environ.get('SMTP_PORT', '587'))
-        smtp_username = os.environ.get('SMTP_USERNAME', '')
-        smtp_password = os.environ.get('SMTP_PASSWORD', '')
-        
+
+        batch = 'messages' in body
+        items = body['messages'] if batch else [body]
+
         # Create email content based on action
-        if action == 'SIGNUP_WELCOME':
-            subject = 'Welcome to Hospital Management System'
-            html_content = f"""
-            <html>
-                <body>
-                    <h2>Welcome {data.get('name', 'User')}!</h2>
-                    <p>Thank you for signing up as a {data.get('role', 'user')}.</p>
-                    <p>You can now access all features of our Hospital Management System.</p>
-                    <br>
-                    <p>Best regards,<br>HMS Team</p>
-                </body>
-            </html>
-            """
-        
-        elif action == 'BOOKING_CONFIRMATION':
-            subject = 'Appointment Confirmation'
-            html_content = f"""
-            <html>
-                <body>
-                    <h2>Appointment Confirmed!</h2>
-                    <p>Dear {data.get('patient_name', 'Patient')},</p>
-                    <p>Your appointment has been successfully booked:</p>
-                    <ul>
-                        <li><strong>Doctor:</strong> {data.get('doctor_name', 'N/A')}</li>
-                        <li><strong>Date:</strong> {data.get('date', 'N/A')}</li>
-                        <li><strong>Time:</strong> {data.get('time', 'N/A')}</li>
-                    </ul>
-                    <p>Please arrive 10 minutes before your appointment time.</p>
-                    <br>
-                    <p>Best regards,<br>HMS Team</p>
-                </body>
-            </html>
-            """
-        else:
+        outgoing = []
+        results = []
+        for item in items:
+            action = item.get('action')
+            to_email = item.get('to')
+            content = build_email(action, item.get('data', {}))
+            if content is None:
+                results.append({'to': to_email, 'action': action, 'status': 'error', 'error': 'Invalid action'})
+                continue
+
+            result = {'to': to_email, 'action': action, 'status': 'pending'}
+            results.append(result)
+            outgoing.append((result, build_message(to_email, *content)))
+
+        if not batch and not outgoing:
             return {
                 'statusCode': 400,
                 'body': json.dumps({'error': 'Invalid action'})
             }
-        
-        # Create message
-        message = MIMEMultipart('alternative')
-        message['Subject'] = subject
-        message['From'] = smtp_username
-        message['To'] = to_email
-        
-        html_part = MIMEText(html_content, 'html')
-        message.attach(html_part)
-        
-        # Send email
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
-            server.starttls()
-            server.login(smtp_username, smtp_password)
-            server.send_message(message)
-        
+
+        if outgoing:
+            _deliver(outgoing, batch)
+
+        if not batch:
+            response_body = {
+                'message': 'Email sent successfully',
+                'action': body.get('action')
+            }
+        else:
+            sent = sum(1 for r in results if r['status'] == 'sent')
+            response_body = {
+                'message': f'{sent} of {len(results)} emails sent',
+                'sent': sent,
+                'failed': len(results) - sent,
+                'results': results
+            }
+
         return {
             'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'message': 'Email sent successfully',
-                'action': action
-            })
+            'headers': RESPONSE_HEADERS,
+            'body': json.dumps(response_body)
         }
-    
+
     except Exception as e:
         print(f"Error sending email: {str(e)}")
         return {
             'statusCode': 500,
             'body': json.dumps({'error': str(e)})
-        }
\ No newline at end of file
+        }
@@ -11,7 +11,7 @@ https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
 from pathlib import Path
-from decouple import config
+from decouple import Csv, config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -42,6 +42,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -85,6 +86,20 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+# Local memory by default; point CACHE_BACKEND at
+# django.core.cache.backends.filebased.FileBasedCache or
+# django.core.cache.backends.redis.RedisCache to share the cache between workers.
+
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='hospital-system'),
+        'KEY_PREFIX': 'hms',
+    }
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
 
@@ -121,3 +136,55 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 AUTH_USER_MODEL = 'core.User'
+
+# Password hashing
+# PBKDF2 iterations for new and rehashed passwords (0 keeps Django's
+# default). Every login pays this cost once; lowering it raises login
+# capacity at the price of weaker protection for a leaked database. Changes
+# apply to each user at their next login. See benchmarks/login_throughput.py.
+PASSWORD_HASH_ITERATIONS = config('PASSWORD_HASH_ITERATIONS', default=0, cast=int)
+
+PASSWORD_HASHERS = [
+    'core.hashers.TunablePBKDF2PasswordHasher',
+    # Older formats still verify, and are upgraded on login
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
+# Login throttling: failed attempts allowed per window before further
+# attempts are refused without checking the password
+LOGIN_THROTTLE_WINDOW_SECONDS = config('LOGIN_THROTTLE_WINDOW_SECONDS', default=900, cast=int)
+LOGIN_MAX_FAILURES_PER_IP = config('LOGIN_MAX_FAILURES_PER_IP', default=50, cast=int)
+LOGIN_MAX_FAILURES_PER_USER = config('LOGIN_MAX_FAILURES_PER_USER', default=5, cast=int)
+
+
+# Booking
+# How long a slot stays reserved for a patient between choosing and booking it
+SLOT_HOLD_MINUTES = config('SLOT_HOLD_MINUTES', default=5, cast=int)
+
+
+# Google Calendar sync (manage.py sync_calendars)
+GOOGLE_CALENDAR_API_URL = config('GOOGLE_CALENDAR_API_URL', default='https://www.googleapis.com')
+# Calendar API calls per second for one user's calendar, across all workers;
+# keeps a busy doctor under Google's per-user quota
+CALENDAR_SYNC_RATE_PER_USER = config('CALENDAR_SYNC_RATE_PER_USER', default=5, cast=int)
+
+
+# Metrics (core/metrics.py)
+# Add a Server-Timing header with each response's total, database, row-lock
+# and email time, for the browser's network panel
+METRICS_SERVER_TIMING = config('METRICS_SERVER_TIMING', default=True, cast=bool)
+# Who may read /metrics besides staff users: scrapers sending
+# "Authorization: Bearer <METRICS_TOKEN>", and these client addresses. Behind
+# a reverse proxy on the same host every request comes from 127.0.0.1, so
+# only list addresses that reach Django directly.
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+METRICS_ALLOWED_IPS = config('METRICS_ALLOWED_IPS', default='', cast=Csv())
+
+
+# Serve the dashboard and slot listings with async views. Enable when running
+# under an ASGI server (uvicorn hospital_system.asgi:application)
+ASYNC_VIEWS = config('ASYNC_VIEWS', default=False, cast=bool)
\ No newline at end of file